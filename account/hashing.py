@@ -0,0 +1,38 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+
+# Run in the processes of the hashing pools: importing this module must not
+# need the app registry (no models), spawned workers only load the settings.
+
+# pools by number of workers, started on first use and kept for the life of
+# the process so provisioning requests do not each spawn workers
+hashing_pools = {}
+hashing_pools_lock = threading.Lock()
+
+
+def hash_password(password):
+    return make_password(password)
+
+
+def get_hashing_pool(workers):
+    """The shared pool of ``workers`` processes for :func:`hash_password`."""
+    with hashing_pools_lock:
+        pool = hashing_pools.get(workers)
+        if pool is None:
+            # spawned, not forked: workers inherit no database connections
+            # or threads from this process
+            pool = hashing_pools[workers] = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return pool
+
+
+def discard_hashing_pool(workers):
+    """Drop a broken pool (a worker died) so the next call starts a new one."""
+    with hashing_pools_lock:
+        pool = hashing_pools.pop(workers, None)
+    if pool is not None:
+        pool.shutdown(wait=False)
@@ -2,6 +2,7 @@ from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
 from .models import User, UserDetails
+from .permissions import ROLE_CLAIM, get_user_role
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -15,4 +16,6 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
     def get_token(cls, user):
         token = super().get_token(user)
         token["user_info"] = UserSerializer(user).data
+        # lets permission checks skip the UserDetails query on every request
+        token[ROLE_CLAIM] = get_user_role(user)
         return token
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from account.provisioning import (
+    USER_FILE_FORMATS,
+    get_user_file_format,
+    provision_users,
+    read_user_rows,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Create users from a CSV (with a header line) or JSONL file of email, "
+        "first_name, last_name, password and role (ops_user or client_user, "
+        "default client_user). Client users get a verification mail in the "
+        "outbox. Rows that are invalid or whose email is taken are reported "
+        "and skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument(
+            "--format",
+            choices=USER_FILE_FORMATS,
+            help="default: from the file extension",
+        )
+        parser.add_argument("--workers", type=int, help="password hashing processes")
+        parser.add_argument("--batch-size", type=int, help="users per insert")
+
+    def handle(self, *args, **options):
+        file_format = options["format"] or get_user_file_format(options["path"])
+        if file_format is None:
+            raise CommandError("unknown file format, use --format")
+
+        try:
+            with open(options["path"], encoding="utf-8-sig", newline="") as user_file:
+                result = provision_users(
+                    read_user_rows(user_file, file_format),
+                    workers=options["workers"],
+                    batch_size=options["batch_size"],
+                )
+        except OSError as e:
+            raise CommandError(e)
+
+        for line_number, errors in result["errors"].items():
+            self.stderr.write(f"line {line_number}: {errors}")
+        self.stdout.write(
+            f"created {result['created']} users ({result['ops_users']} ops, "
+            f"{result['client_users']} client), skipped {len(result['errors'])} "
+            f"in {result['seconds']:.1f}s ({result['users_per_second'] or 0} users/s)"
+        )
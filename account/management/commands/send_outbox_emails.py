@@ -0,0 +1,41 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from account.outbox import send_pending_emails
+
+
+class Command(BaseCommand):
+    help = "Send queued outbox emails in batches over one SMTP connection per batch."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=settings.EMAIL_OUTBOX_BATCH_SIZE
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep polling the outbox instead of exiting once it is empty.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5,
+            help="Seconds to wait between polls of an empty outbox (with --loop).",
+        )
+
+    def handle(self, *args, **options):
+        total_sent = total_failed = 0
+        while True:
+            sent, failed = send_pending_emails(options["batch_size"])
+            total_sent += sent
+            total_failed += failed
+
+            if sent + failed < options["batch_size"]:
+                # outbox drained (or only mails waiting for a retry are left)
+                if not options["loop"]:
+                    break
+                time.sleep(options["interval"])
+
+        self.stdout.write(f"sent {total_sent} emails, {total_failed} failed")
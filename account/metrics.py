@@ -0,0 +1,12 @@
+from standard.metrics import Counter
+
+login_count = Counter(
+    "account_logins",
+    "Login attempts through POST /api/auth/login/, by outcome.",
+    labelnames=["outcome"],
+)
+outbox_email_count = Counter(
+    "account_outbox_emails",
+    "Outbox emails (signup verification mails) sent or failed, by outcome.",
+    labelnames=["outcome"],
+)
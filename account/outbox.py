@@ -0,0 +1,147 @@
+from django.conf import settings
+from django.contrib.auth.tokens import default_token_generator
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from .metrics import outbox_email_count
+from .models import OutboxEmail
+
+
+def queue_email(subject, message, from_email, recipient):
+    """
+    Queue an email for the ``send_outbox_emails`` worker. Call it inside the
+    transaction that creates whatever the mail is about, so the mail is only
+    sent if that transaction commits.
+    """
+    return OutboxEmail.objects.create(
+        subject=subject,
+        message=message,
+        from_email=from_email,
+        recipient=recipient,
+    )
+
+
+def queue_emails(emails):
+    """
+    :func:`queue_email` of a list of (subject, message, from_email,
+    recipient) in one query.
+    """
+    return OutboxEmail.objects.bulk_create(
+        [
+            OutboxEmail(
+                subject=subject,
+                message=message,
+                from_email=from_email,
+                recipient=recipient,
+            )
+            for subject, message, from_email, recipient in emails
+        ]
+    )
+
+
+def get_verification_email(user_obj):
+    """(subject, message, from_email, recipient) of a signup verification mail."""
+    uidb64 = urlsafe_base64_encode(force_bytes(user_obj.pk))
+    verification_token = default_token_generator.make_token(user_obj)
+
+    domain_url = settings.CLIENT_SIDE_URL
+    verify_url = f"{domain_url}/api/verify/{uidb64}/{verification_token}/"
+
+    subject = "Email Verification"
+    message = f"Click the following link to verify your email: {verify_url}"
+    from_email = settings.EMAIL_HOST_USER
+
+    return subject, message, from_email, user_obj.email
+
+
+def get_retry_delay(attempts):
+    # exponential backoff: base, 2 * base, 4 * base, ...
+    return settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** (attempts - 1)
+
+
+def claim_due_emails(batch_size):
+    """
+    Lease one batch of due outbox emails to this worker.
+
+    A short transaction locks the rows (``skip_locked``), counts the attempt
+    and moves ``next_attempt_at`` past ``EMAIL_OUTBOX_LEASE``, so other
+    workers leave them alone while they are sent, without a lock held. Mails
+    of a worker that died are sent again once their lease runs out.
+    """
+    with transaction.atomic():
+        outbox_emails = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True)
+            .filter(
+                status=OutboxEmail.STATUS_PENDING,
+                next_attempt_at__lte=timezone.now(),
+            )
+            .order_by("next_attempt_at", "id")[:batch_size]
+        )
+        leased_until = timezone.now() + settings.EMAIL_OUTBOX_LEASE
+        for outbox_email in outbox_emails:
+            outbox_email.attempts += 1
+            outbox_email.next_attempt_at = leased_until
+        OutboxEmail.objects.bulk_update(outbox_emails, ["attempts", "next_attempt_at"])
+    return outbox_emails
+
+
+def send_pending_emails(batch_size=None):
+    """
+    Send one batch of due outbox emails over a single SMTP connection.
+
+    The batch is claimed first (see :func:`claim_due_emails`) and sent
+    outside any transaction, so a slow SMTP server holds no database locks.
+    A failed mail is retried with exponential backoff and marked failed
+    after ``EMAIL_OUTBOX_MAX_ATTEMPTS`` attempts. Returns (sent, failed)
+    counts.
+    """
+    batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+    sent = failed = 0
+
+    outbox_emails = claim_due_emails(batch_size)
+    if not outbox_emails:
+        return sent, failed
+
+    connection = get_connection(fail_silently=False)
+    try:
+        for outbox_email in outbox_emails:
+            email_message = EmailMessage(
+                outbox_email.subject,
+                outbox_email.message,
+                outbox_email.from_email,
+                [outbox_email.recipient],
+                connection=connection,
+            )
+            try:
+                # the first send opens the connection, the rest reuse it
+                email_message.send()
+            except Exception as e:
+                # drop a possibly broken connection, the next send reopens it
+                connection.close()
+                outbox_email.last_error = repr(e)
+                if outbox_email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+                    outbox_email.status = OutboxEmail.STATUS_FAILED
+                else:
+                    outbox_email.next_attempt_at = timezone.now() + get_retry_delay(
+                        outbox_email.attempts
+                    )
+                failed += 1
+            else:
+                outbox_email.status = OutboxEmail.STATUS_SENT
+                outbox_email.sent_at = timezone.now()
+                outbox_email.last_error = ""
+                sent += 1
+    finally:
+        connection.close()
+
+    OutboxEmail.objects.bulk_update(
+        outbox_emails, ["status", "next_attempt_at", "last_error", "sent_at"]
+    )
+
+    outbox_email_count.inc(sent, outcome="sent")
+    outbox_email_count.inc(failed, outcome="failed")
+
+    return sent, failed
@@ -0,0 +1,79 @@
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.permissions import BasePermission
+from rest_framework_simplejwt.models import TokenUser
+
+from standard.response import ErrorMessage, MessageCode, get_error_response
+
+from .models import UserDetails
+
+ROLE_CLAIM = "role"
+OPS_USER_ROLE = "ops_user"
+CLIENT_USER_ROLE = "client_user"
+
+
+def get_user_role(user):
+    """
+    Role of an authenticated user, None if the user has no UserDetails.
+
+    Tokens issued by CustomTokenObtainPairSerializer carry the role, so a
+    stateless TokenUser costs no query. User instances (and tokens issued
+    before the claim existed) fall back to one UserDetails lookup.
+    """
+    if isinstance(user, TokenUser):
+        role = user.token.get(ROLE_CLAIM)
+        if role is not None:
+            return role
+
+    is_ops_user = (
+        UserDetails.objects.filter(user_id=user.id)
+        .values_list("is_ops_user", flat=True)
+        .first()
+    )
+    if is_ops_user is None:
+        return None
+    return OPS_USER_ROLE if is_ops_user else CLIENT_USER_ROLE
+
+
+async def aget_user_role(user):
+    """Async version of :func:`get_user_role`."""
+    if isinstance(user, TokenUser):
+        role = user.token.get(ROLE_CLAIM)
+        if role is not None:
+            return role
+
+    is_ops_user = await (
+        UserDetails.objects.filter(user_id=user.id)
+        .values_list("is_ops_user", flat=True)
+        .afirst()
+    )
+    if is_ops_user is None:
+        return None
+    return OPS_USER_ROLE if is_ops_user else CLIENT_USER_ROLE
+
+
+class RoleAccessDenied(APIException):
+    # keeps the 400 + get_error_response body the views always returned
+    status_code = status.HTTP_400_BAD_REQUEST
+
+    def __init__(self, message):
+        super().__init__(
+            get_error_response(
+                error_code=MessageCode.ACCESS_DENIED,
+                errors={"operation_user": message},
+            )
+        )
+
+
+class IsOpsUser(BasePermission):
+    def has_permission(self, request, view):
+        if get_user_role(request.user) != OPS_USER_ROLE:
+            raise RoleAccessDenied(ErrorMessage.ACCESS_DENIED_UPLOAD)
+        return True
+
+
+class IsClientUser(BasePermission):
+    def has_permission(self, request, view):
+        if get_user_role(request.user) != CLIENT_USER_ROLE:
+            raise RoleAccessDenied(ErrorMessage.ACCESS_DENIED_DOWNLOAD)
+        return True
@@ -0,0 +1,196 @@
+import csv
+import io
+import json
+import os
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from rest_framework import serializers
+
+from standard.response import ErrorMessage
+
+from .hashing import discard_hashing_pool, get_hashing_pool, hash_password
+from .models import User, UserDetails
+from .outbox import get_verification_email, queue_emails
+from .permissions import CLIENT_USER_ROLE, OPS_USER_ROLE
+
+USER_FILE_FORMATS = ["csv", "jsonl"]
+
+
+class UserImportSerializer(serializers.Serializer):
+    email = serializers.EmailField(max_length=150)
+    first_name = serializers.CharField(max_length=150)
+    last_name = serializers.CharField(max_length=150)
+    password = serializers.CharField()
+    role = serializers.ChoiceField(
+        choices=[OPS_USER_ROLE, CLIENT_USER_ROLE], default=CLIENT_USER_ROLE
+    )
+
+
+def get_user_file_format(file_name):
+    extension = os.path.splitext(file_name)[1].lower().lstrip(".")
+    return extension if extension in USER_FILE_FORMATS else None
+
+
+def read_user_rows(user_file, file_format):
+    """
+    (line number, row) of a CSV (with a header line) or JSONL text file of
+    users. A JSONL line that is not a JSON object gives a ``None`` row.
+    """
+    if file_format == "csv":
+        reader = csv.DictReader(user_file)
+        for row in reader:
+            # a row's number is the line it ends on; empty cells are unset
+            yield reader.line_num, {
+                key: value for key, value in row.items() if value not in ("", None)
+            }
+        return
+
+    for line_number, line in enumerate(user_file, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+
+def read_uploaded_user_rows(uploaded_file, file_format):
+    return read_user_rows(
+        io.TextIOWrapper(uploaded_file, encoding="utf-8-sig", newline=""),
+        file_format,
+    )
+
+
+def provision_users(rows, workers=None, batch_size=None):
+    """
+    Create the users of ``rows`` the way the signup views do, hashing
+    passwords in a pool of ``workers`` and inserting ``batch_size`` at a time.
+    Returns the counts, the errors by line number and the throughput.
+    """
+    workers = workers or settings.USER_PROVISIONING_WORKERS
+    batch_size = batch_size or settings.USER_PROVISIONING_BATCH_SIZE
+    started = time.monotonic()
+
+    errors = {}
+    valid_rows = {}
+    emails = set()
+    for line_number, row in rows:
+        if row is None:
+            errors[line_number] = {"non_field_errors": [ErrorMessage.INVALID_USER_ROW]}
+            continue
+        serializer = UserImportSerializer(data=row)
+        if not serializer.is_valid():
+            errors[line_number] = serializer.errors
+        elif serializer.validated_data["email"] in emails:
+            errors[line_number] = {"email": [ErrorMessage.UNIQUE_CONSTRAINT]}
+        else:
+            emails.add(serializer.validated_data["email"])
+            valid_rows[line_number] = serializer.validated_data
+
+    created = {OPS_USER_ROLE: 0, CLIENT_USER_ROLE: 0}
+    if valid_rows:
+        line_numbers = list(valid_rows)
+        # hashed in order, in chunks, while the batches before are inserted
+        password_hashes = get_hashing_pool(workers).map(
+            hash_password,
+            [valid_rows[line_number]["password"] for line_number in line_numbers],
+            chunksize=max(1, min(batch_size, len(line_numbers) // (workers * 4))),
+        )
+        batch = []
+        try:
+            for line_number, password_hash in zip(line_numbers, password_hashes):
+                batch.append((line_number, valid_rows[line_number], password_hash))
+                if len(batch) == batch_size:
+                    insert_users(batch, created, errors)
+                    batch = []
+        except BrokenProcessPool:
+            discard_hashing_pool(workers)
+            raise
+        if batch:
+            insert_users(batch, created, errors)
+
+    seconds = time.monotonic() - started
+    total = sum(created.values())
+    return {
+        "created": total,
+        "ops_users": created[OPS_USER_ROLE],
+        "client_users": created[CLIENT_USER_ROLE],
+        "errors": dict(sorted(errors.items())),
+        "seconds": round(seconds, 3),
+        "users_per_second": round(total / seconds, 1) if seconds else None,
+    }
+
+
+def insert_users(batch, created, errors, retry=True):
+    """
+    Insert a batch of (line number, row, password hash) in one transaction;
+    rows whose email is taken are added to ``errors``.
+    """
+    taken = set(
+        User.objects.filter(
+            username__in=[row["email"] for _line_number, row, _hash in batch]
+        ).values_list("username", flat=True)
+    )
+    for line_number, row, _password_hash in batch:
+        if row["email"] in taken:
+            errors[line_number] = {"email": [ErrorMessage.UNIQUE_CONSTRAINT]}
+    batch = [entry for entry in batch if entry[1]["email"] not in taken]
+    if not batch:
+        return
+
+    try:
+        with transaction.atomic():
+            create_users(batch)
+    except IntegrityError:
+        if not retry:
+            raise
+        # an email taken by a concurrent signup since the check
+        insert_users(batch, created, errors, retry=False)
+        return
+
+    for _line_number, row, _password_hash in batch:
+        created[row["role"]] += 1
+
+
+def create_users(batch):
+    user_objs = User.objects.bulk_create(
+        [
+            User(
+                email=row["email"],
+                username=row["email"],  # Must be Same as Email
+                first_name=row["first_name"],
+                last_name=row["last_name"],
+                password=password_hash,
+                # ops users need no verification
+                is_active=row["role"] == OPS_USER_ROLE,
+            )
+            for _line_number, row, password_hash in batch
+        ]
+    )
+    if user_objs[0].pk is None:
+        # backends that return no ids from bulk inserts (MySQL)
+        user_ids = dict(
+            User.objects.filter(
+                username__in=[user_obj.username for user_obj in user_objs]
+            ).values_list("username", "id")
+        )
+        for user_obj in user_objs:
+            user_obj.pk = user_ids[user_obj.username]
+
+    UserDetails.objects.bulk_create(
+        [
+            UserDetails(user=user_obj, is_ops_user=row["role"] == OPS_USER_ROLE)
+            for user_obj, (_line_number, row, _hash) in zip(user_objs, batch)
+        ]
+    )
+    queue_emails(
+        [
+            get_verification_email(user_obj)
+            for user_obj in user_objs
+            if not user_obj.is_active
+        ]
+    )
@@ -1,13 +1,29 @@
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core import mail
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase
 
 from account.jwt import CustomTokenObtainPairSerializer
 from file.models import File
+from standard.metrics import get_sample_value
+from standard.response import ErrorMessage, MessageCode
 
-from .models import UserDetails
+from . import outbox, views
+from .hashing import get_hashing_pool
+from .models import OutboxEmail, UserDetails
 
 User = get_user_model()
 
@@ -110,6 +126,25 @@ class TestViews(TestSetUp):
         response = self.client.post(login_url, data=data, format="json")
         self.assertEqual(response.status_code, 200)
 
+    def test_login_metrics(self):
+        login_url = reverse("user_login_view")
+        successes = get_sample_value("account_logins_total", outcome="success")
+        failures = get_sample_value("account_logins_total", outcome="failure")
+
+        data = {"username": self.client_user_data["email"], "password": "wrong"}
+        response = self.client.post(login_url, data=data, format="json")
+        self.assertEqual(response.status_code, 400)
+        data["password"] = self.client_user_data["password"]
+        response = self.client.post(login_url, data=data, format="json")
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(
+            get_sample_value("account_logins_total", outcome="success"), successes + 1
+        )
+        self.assertEqual(
+            get_sample_value("account_logins_total", outcome="failure"), failures + 1
+        )
+
     def test_file_post_view(self):
         file_post_view_url = reverse("file_multi_view")
 
@@ -146,3 +181,268 @@ class TestViews(TestSetUp):
         # import pdb
         # pdb.set_trace()
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestEmailOutbox(APITestCase):
+    def setUp(self):
+        self.url = reverse("client_user_register_view")
+        self.data = {
+            "email": "client@register.com",
+            "password": "12345",
+            "password1": "12345",
+            "first_name": "first_name",
+            "last_name": "last_name",
+        }
+
+    def run_worker(self):
+        call_command("send_outbox_emails", stdout=mock.Mock())
+
+    def test_signup_queues_the_mail_without_sending_it(self):
+        response = self.client.post(self.url, data=self.data, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(mail.outbox), 0)
+
+        outbox_email = OutboxEmail.objects.get()
+        self.assertEqual(outbox_email.recipient, self.data["email"])
+        self.assertIn("/api/verify/", outbox_email.message)
+
+        self.run_worker()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, [self.data["email"]])
+        self.assertEqual(mail.outbox[0].body, outbox_email.message)
+
+        outbox_email.refresh_from_db()
+        self.assertEqual(outbox_email.status, OutboxEmail.STATUS_SENT)
+        self.assertIsNotNone(outbox_email.sent_at)
+
+        # already sent mails are not sent again
+        self.run_worker()
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_failed_user_creation_queues_nothing(self):
+        with mock.patch.object(UserDetails.objects, "create", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.post(self.url, data=self.data, format="json")
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(OutboxEmail.objects.exists())
+
+    def test_batch_uses_one_connection(self):
+        for index in range(3):
+            outbox.queue_email("subject", "message", None, f"user{index}@mail.com")
+        sent = get_sample_value("account_outbox_emails_total", outcome="sent")
+
+        with mock.patch.object(
+            outbox, "get_connection", wraps=outbox.get_connection
+        ) as get_connection:
+            self.run_worker()
+
+        get_connection.assert_called_once()
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(
+            get_sample_value("account_outbox_emails_total", outcome="sent"), sent + 3
+        )
+
+    def test_failures_are_retried_with_backoff(self):
+        outbox_email = outbox.queue_email("subject", "message", None, "a@mail.com")
+
+        with self.settings(
+            EMAIL_OUTBOX_MAX_ATTEMPTS=2,
+            EMAIL_OUTBOX_RETRY_DELAY=timedelta(minutes=1),
+        ), mock.patch.object(
+            EmailBackend, "send_messages", side_effect=ConnectionError("down")
+        ):
+            self.run_worker()
+            outbox_email.refresh_from_db()
+            self.assertEqual(outbox_email.status, OutboxEmail.STATUS_PENDING)
+            self.assertEqual(outbox_email.attempts, 1)
+            self.assertIn("down", outbox_email.last_error)
+            self.assertGreater(
+                outbox_email.next_attempt_at,
+                outbox_email.created_at + timedelta(seconds=59),
+            )
+
+            # not due yet
+            self.run_worker()
+            outbox_email.refresh_from_db()
+            self.assertEqual(outbox_email.attempts, 1)
+
+            OutboxEmail.objects.update(next_attempt_at=outbox_email.created_at)
+            self.run_worker()
+            outbox_email.refresh_from_db()
+            self.assertEqual(outbox_email.status, OutboxEmail.STATUS_FAILED)
+            self.assertEqual(outbox_email.attempts, 2)
+
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_mails_are_sent_outside_the_claiming_transaction(self):
+        outbox_email = outbox.queue_email("subject", "message", None, "a@mail.com")
+        send_messages = EmailBackend.send_messages
+        other_worker = []
+
+        def send_while_another_worker_runs(backend, messages):
+            # the batch is leased: nothing is due for a second worker
+            other_worker.append(outbox.claim_due_emails(10))
+            return send_messages(backend, messages)
+
+        with mock.patch.object(
+            EmailBackend,
+            "send_messages",
+            autospec=True,
+            side_effect=send_while_another_worker_runs,
+        ):
+            self.assertEqual(outbox.send_pending_emails(), (1, 0))
+
+        self.assertEqual(other_worker, [[]])
+        self.assertEqual(len(mail.outbox), 1)
+        outbox_email.refresh_from_db()
+        self.assertEqual(outbox_email.status, OutboxEmail.STATUS_SENT)
+        self.assertEqual(outbox_email.attempts, 1)
+
+        # a worker that died mid-batch: its mails come back once the lease ends
+        lost_email = outbox.queue_email("subject", "message", None, "b@mail.com")
+        outbox.claim_due_emails(10)
+        self.assertEqual(outbox.send_pending_emails(), (0, 0))
+        OutboxEmail.objects.filter(id=lost_email.id).update(
+            next_attempt_at=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertEqual(outbox.send_pending_emails(), (1, 0))
+        lost_email.refresh_from_db()
+        self.assertEqual(lost_email.attempts, 2)
+
+
+class TestUserProvisioning(TestSetUp):
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+
+    def test_command_creates_users_from_csv(self):
+        path = os.path.join(self.temp_dir, "users.csv")
+        with open(path, "w", newline="") as users_file:
+            users_file.write(
+                "email,first_name,last_name,password,role\n"
+                "ops@bulk.com,Ops,One,secret-1,ops_user\n"
+                "client@bulk.com,Client,Two,secret-2,\n"
+                "not-an-email,Bad,Row,secret-3,client_user\n"
+                "client@bulk.com,Client,Again,secret-4,client_user\n"
+                f"{self.client_user_data['email']},Taken,Row,secret-5,client_user\n"
+                "other@bulk.com,Other,Three,secret-6,client_user\n"
+            )
+
+        out, err = StringIO(), StringIO()
+        call_command(
+            "provision_users", path, workers=2, batch_size=2, stdout=out, stderr=err
+        )
+        self.assertIn("created 3 users (1 ops, 2 client), skipped 3", out.getvalue())
+        self.assertIn("users/s", out.getvalue())
+        self.assertEqual(
+            [line.split(":")[0] for line in err.getvalue().splitlines()],
+            ["line 4", "line 5", "line 6"],
+        )
+
+        ops_user = User.objects.get(email="ops@bulk.com")
+        self.assertTrue(ops_user.is_active)
+        self.assertTrue(ops_user.check_password("secret-1"))
+        self.assertTrue(ops_user.userdetails.is_ops_user)
+
+        client_user = User.objects.get(email="client@bulk.com")
+        self.assertEqual(client_user.first_name, "Client")
+        self.assertFalse(client_user.is_active)
+        self.assertTrue(client_user.check_password("secret-2"))
+        self.assertFalse(client_user.userdetails.is_ops_user)
+
+        # mails are queued, not sent; the link activates the user
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(
+            sorted(OutboxEmail.objects.values_list("recipient", flat=True)),
+            ["client@bulk.com", "other@bulk.com"],
+        )
+        verify_url = OutboxEmail.objects.get(recipient="client@bulk.com").message.split(
+            settings.CLIENT_SIDE_URL
+        )[1]
+        self.client.get(verify_url)
+        client_user.refresh_from_db()
+        self.assertTrue(client_user.is_active)
+
+    def test_api_is_for_staff_only(self):
+        users = SimpleUploadedFile(
+            "users.jsonl",
+            b'{"email": "a@bulk.com", "first_name": "A", "last_name": "B", '
+            b'"password": "secret"}\n'
+            b"\n"
+            b"[1, 2]\n",
+        )
+        url = reverse("user_provisioning_view")
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.ops_token}")
+        response = self.client.post(url, {"users": users}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.ops_user_obj.is_staff = True
+        self.ops_user_obj.save()
+        staff_token = CustomTokenObtainPairSerializer.get_token(self.ops_user_obj)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {staff_token.access_token}")
+        users.seek(0)
+        with self.settings(USER_PROVISIONING_WORKERS=1):
+            response = self.client.post(url, {"users": users}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["created"], 1)
+        self.assertEqual(response.data["client_users"], 1)
+        self.assertEqual(
+            response.data["errors"],
+            {3: {"non_field_errors": [ErrorMessage.INVALID_USER_ROW]}},
+        )
+        self.assertFalse(User.objects.get(email="a@bulk.com").is_active)
+
+        response = self.client.post(
+            url,
+            {"users": SimpleUploadedFile("users.xlsx", b"email")},
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            response.data["errors"]["users"], ErrorMessage.INVALID_USER_FILE_TYPE
+        )
+
+        # the token still says staff, the user row no longer does
+        self.ops_user_obj.is_staff = False
+        self.ops_user_obj.save()
+        users.seek(0)
+        response = self.client.post(url, {"users": users}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_api_stops_reading_past_the_row_limit(self):
+        self.ops_user_obj.is_staff = True
+        self.ops_user_obj.save()
+        staff_token = CustomTokenObtainPairSerializer.get_token(self.ops_user_obj)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {staff_token.access_token}")
+        users = SimpleUploadedFile(
+            "users.jsonl",
+            b"".join(
+                b'{"email": "user%d@bulk.com", "first_name": "A", "last_name": "B", '
+                b'"password": "secret"}\n' % index
+                for index in range(50)
+            ),
+        )
+        read_uploaded_user_rows = views.read_uploaded_user_rows
+        rows_read = []
+
+        def read_rows(*args):
+            for row in read_uploaded_user_rows(*args):
+                rows_read.append(row)
+                yield row
+
+        with self.settings(USER_PROVISIONING_MAX_ROWS=3), mock.patch.object(
+            views, "read_uploaded_user_rows", read_rows
+        ):
+            response = self.client.post(
+                reverse("user_provisioning_view"), {"users": users}, format="multipart"
+            )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["code"], MessageCode.INVALID_DATA)
+        self.assertEqual(len(rows_read), 4)
+        self.assertFalse(User.objects.filter(email__endswith="@bulk.com").exists())
+
+    def test_requests_share_one_hashing_pool(self):
+        self.assertIs(get_hashing_pool(1), get_hashing_pool(1))
+        self.assertIsNot(get_hashing_pool(1), get_hashing_pool(2))
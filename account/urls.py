@@ -1,7 +1,7 @@
 from django.urls import path
 
 from .views import (ClientUserSignupView, OpsUserSignupView, UserLoginView,
-                    email_activate)
+                    UserProvisioningView, email_activate)
 
 urlpatterns = [
     path(
@@ -14,6 +14,11 @@ urlpatterns = [
         ClientUserSignupView.as_view(),
         name="client_user_register_view",
     ),
+    path(
+        "auth/users/bulk/",
+        UserProvisioningView.as_view(),
+        name="user_provisioning_view",
+    ),
     path(
         "verify/<uidb64>/<verification_token>/",
         email_activate,
@@ -1,27 +1,39 @@
+from itertools import islice
+
 from django.conf import settings
 from django.contrib.auth import login
 from django.contrib.auth.tokens import default_token_generator
-from django.core.mail import send_mail
 from django.db import IntegrityError, transaction
 from django.http import HttpResponse
-from django.utils.encoding import force_bytes
-from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+from django.utils.http import urlsafe_base64_decode
 from drf_yasg.utils import no_body, swagger_auto_schema
 from rest_framework import serializers, status
 from rest_framework.authtoken.serializers import AuthTokenSerializer
-from rest_framework.permissions import AllowAny
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from standard.response import ErrorMessage, MessageCode, get_error_response
 
 from .jwt import CustomTokenObtainPairSerializer
+from .metrics import login_count
 from .models import User, UserDetails
+from .outbox import get_verification_email, queue_email
+from .provisioning import (
+    get_user_file_format,
+    provision_users,
+    read_uploaded_user_rows,
+)
 from .serializer import AccountSerializer, UserModelSerializer
 
 # Create your views here.
 
 
+def queue_verification_email(user_obj):
+    queue_email(*get_verification_email(user_obj))
+
+
 class OpsUserSignupView(APIView):
     serializer_class = AccountSerializer
     permission_classes = [AllowAny]
@@ -95,7 +107,20 @@ class ClientUserSignupView(APIView):
             user_obj = User.objects.get(email=email)
 
         except User.DoesNotExist:
-            with transaction.atomic():
+            user_obj = None
+
+        # resent activation link logic
+        if user_obj is not None and user_obj.is_active:
+            return Response(
+                get_error_response(
+                    error_code=MessageCode.EMAIL_ALREADY_VERIFIED,
+                    errors={"error": ErrorMessage.EMAIL_ALREADY_VERIFIED},
+                ),
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        with transaction.atomic():
+            if user_obj is None:
                 user_obj = User.objects.create(
                     email=email,
                     username=serializer.validated_data[
@@ -115,29 +140,8 @@ class ClientUserSignupView(APIView):
                     is_ops_user=False,
                 )
 
-        # resent activation link logic
-        if user_obj.is_active:
-            return Response(
-                get_error_response(
-                    error_code=MessageCode.EMAIL_ALREADY_VERIFIED,
-                    errors={"error": ErrorMessage.EMAIL_ALREADY_VERIFIED},
-                ),
-                status=status.HTTP_400_BAD_REQUEST,
-            )
-
-        to_emails = user_obj.email
-        uidb64 = urlsafe_base64_encode(force_bytes(user_obj.pk))
-        verification_token = default_token_generator.make_token(user_obj)
-
-        domain_url = settings.CLIENT_SIDE_URL
-        verify_url = f"{domain_url}/api/verify/{uidb64}/{verification_token}/"
-
-        subject = "Email Verification"
-        message = f"Click the following link to verify your email: {verify_url}"
-        from_email = settings.EMAIL_HOST_USER
-        recipient_list = [to_emails]  # User's email address
-
-        send_mail(subject, message, from_email, recipient_list)
+            # queued with the user, sent later by `manage.py send_outbox_emails`
+            queue_verification_email(user_obj)
 
         return Response(
             UserModelSerializer(user_obj).data, status=status.HTTP_201_CREATED
@@ -160,9 +164,11 @@ class UserLoginView(APIView):
         )
 
         if not serializer.is_valid():
+            login_count.inc(outcome="failure")
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
         user = serializer.validated_data["user"]
+        login_count.inc(outcome="success")
         # Here you are logging in the user
         login(request, user)
         # Creating a JWT token
@@ -175,6 +181,55 @@ class UserLoginView(APIView):
         )
 
 
+class UserProvisioningView(APIView):
+    permission_classes = [IsAuthenticated, IsAdminUser]
+    parser_classes = [MultiPartParser]
+
+    class RequestValidationSerializer(serializers.Serializer):
+        users = serializers.FileField(
+            help_text="CSV (with a header line) or JSONL of email, first_name, "
+            "last_name, password and role (ops_user or client_user)"
+        )
+
+    @swagger_auto_schema(
+        request_body=RequestValidationSerializer,
+        responses={201: None},
+    )
+    def post(self, request):
+        serializer = self.RequestValidationSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        users_file = serializer.validated_data["users"]
+        file_format = get_user_file_format(users_file.name)
+        if file_format is None:
+            return Response(
+                get_error_response(
+                    error_code=MessageCode.INVALID_FILE_TYPE,
+                    errors={"users": ErrorMessage.INVALID_USER_FILE_TYPE},
+                ),
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # one row over the limit is enough to refuse the file
+        rows = list(
+            islice(
+                read_uploaded_user_rows(users_file, file_format),
+                settings.USER_PROVISIONING_MAX_ROWS + 1,
+            )
+        )
+        if len(rows) > settings.USER_PROVISIONING_MAX_ROWS:
+            return Response(
+                get_error_response(
+                    error_code=MessageCode.INVALID_DATA,
+                    errors={"users": ErrorMessage.TOO_MANY_USERS},
+                ),
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        return Response(provision_users(rows), status=status.HTTP_201_CREATED)
+
+
 # direct activate from email
 def email_activate(request, uidb64, verification_token):
     try:
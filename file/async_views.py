@@ -0,0 +1,162 @@
+import time
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views import View
+from itsdangerous import BadSignature
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework_simplejwt.authentication import (
+    JWTAuthentication,
+    JWTStatelessUserAuthentication,
+)
+
+from account.permissions import CLIENT_USER_ROLE, aget_user_role
+from standard.response import ErrorMessage, MessageCode, get_error_response
+
+from .list_cache import file_list_cache
+from .metrics import observe_download
+from .models import File
+from .services import FileDownloadService
+from .streaming import FileListJSONStream
+from .throttling import DownloadRequestThrottle, limit_download
+from .views import FileMultiView, download_link_signer
+
+# Async (ASGI) versions of the listing, export and download endpoints. DRF's
+# APIView is sync only, so these are plain Django async views that run the
+# same JWT authentication and role checks. Under WSGI prefer the APIView
+# routes: Django would run these through async_to_sync on every request.
+
+
+class AsyncAPIView(View):
+    # loads the User (refused once deactivated); the hot list and download
+    # views trust the token alone, as their APIView routes do
+    authentication_class = JWTAuthentication
+
+    async def dispatch(self, request, *args, **kwargs):
+        authenticate = self.authentication_class().authenticate
+        try:
+            if issubclass(self.authentication_class, JWTStatelessUserAuthentication):
+                # validates the token without a query
+                user_auth_tuple = authenticate(request)
+            else:
+                user_auth_tuple = await sync_to_async(authenticate)(request)
+        except exceptions.AuthenticationFailed as e:
+            return self.get_unauthorized_response(e.detail)
+        if user_auth_tuple is None:
+            return self.get_unauthorized_response(
+                exceptions.NotAuthenticated.default_detail
+            )
+
+        request.user = user_auth_tuple[0]
+        return await super().dispatch(request, *args, **kwargs)
+
+    def get_unauthorized_response(self, detail):
+        if not isinstance(detail, dict):
+            detail = {"detail": detail}
+        response = JsonResponse(detail, status=401)
+        response["WWW-Authenticate"] = self.authentication_class().authenticate_header(
+            None
+        )
+        return response
+
+    def get_throttled_response(self, exc):
+        # what DRF's exception handler sends for Throttled
+        response = JsonResponse({"detail": exc.detail}, status=exc.status_code)
+        response["Retry-After"] = str(exc.wait)
+        return response
+
+
+class AsyncFileListView(AsyncAPIView):
+    authentication_class = JWTStatelessUserAuthentication
+
+    async def get(self, request, *args, **kwargs):
+        query_serializer = FileMultiView.QueryValidationSerializer(data=request.GET)
+        if not query_serializer.is_valid():
+            return JsonResponse(query_serializer.errors, status=400)
+
+        # DRF's cursor paginator is sync; run it (and its one query, and the
+        # listing cache) in Django's thread for sync ORM calls, as the async
+        # ORM itself does
+        return await sync_to_async(self.get_page_response)(
+            request, dict(query_serializer.validated_data)
+        )
+
+    def get_page_response(self, request, filters):
+        generation = file_list_cache.get_generation()
+        not_modified_response = file_list_cache.get_not_modified_response(
+            request, generation
+        )
+        if not_modified_response is not None:
+            return not_modified_response
+
+        data = file_list_cache.get_page(
+            request,
+            generation,
+            lambda: FileMultiView.get_page_data(Request(request), filters, self),
+        )
+        return file_list_cache.add_etag(
+            HttpResponse(JSONRenderer().render(data), content_type="application/json"),
+            generation,
+        )
+
+
+class AsyncFileExportView(AsyncAPIView):
+    async def get(self, request, *args, **kwargs):
+        file_stream = FileListJSONStream(
+            File.objects.order_by("-id"),
+            FileMultiView.FileModelSerializer,
+        )
+
+        return StreamingHttpResponse(
+            file_stream.aiter_chunks(), content_type="application/json"
+        )
+
+
+class AsyncDownloadFileView(AsyncAPIView):
+    authentication_class = JWTStatelessUserAuthentication
+
+    async def get(self, request, *args, **kwargs):
+        started = time.monotonic()
+        if await aget_user_role(request.user) != CLIENT_USER_ROLE:
+            return JsonResponse(
+                get_error_response(
+                    error_code=MessageCode.ACCESS_DENIED,
+                    errors={"operation_user": ErrorMessage.ACCESS_DENIED_DOWNLOAD},
+                ),
+                status=400,
+            )
+
+        # a shared throttle state is a cache round trip, keep it off the loop
+        throttle = DownloadRequestThrottle()
+        if not await sync_to_async(throttle.allow_request)(request, self):
+            return self.get_throttled_response(exceptions.Throttled(throttle.wait()))
+
+        try:
+            file_identifier = download_link_signer.loads(kwargs["signed_identifier"])
+            file_obj = await File.objects.aget(file_identifier=file_identifier)
+        except (BadSignature, File.DoesNotExist):
+            return JsonResponse(
+                get_error_response(
+                    error_code=MessageCode.INVALID_ID,
+                    errors={"file_id": ErrorMessage.INVALID_ID},
+                ),
+                status=400,
+            )
+
+        # validators and sizes may hit the storage (a stat, or a HEAD on
+        # S3); run in the request's thread for sync code, whose database
+        # connections Django closes when the request ends (a plain thread
+        # pool would leave one open per thread). The body is then read
+        # block by block in worker threads
+        response = await sync_to_async(FileDownloadService(file_obj).get_response)(
+            request, asynchronous=True
+        )
+        try:
+            response = await sync_to_async(limit_download)(
+                request, response, lambda: file_obj.file_content.size
+            )
+        except exceptions.Throttled as e:
+            return self.get_throttled_response(e)
+        return observe_download(response, started)
@@ -0,0 +1,796 @@
+import base64
+import http.client
+import json
+import random
+import re
+import statistics
+import threading
+import time
+import uuid
+import zipfile
+from collections import Counter, defaultdict, namedtuple
+from io import BytesIO
+from urllib.parse import urlencode, urlsplit
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.tokens import default_token_generator
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import F
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from account.jwt import CustomTokenObtainPairSerializer
+from account.models import User, UserDetails
+
+from .models import File, FileBlob, FileSearchDocument
+from .preview_jobs import generate_pending_previews
+from .search import get_search_title
+from .services import (
+    acquire_file_blob,
+    create_blob_file,
+    get_file_bundle,
+    get_sha256,
+)
+from .views import bundle_link_signer, download_link_signer
+
+# Load test harness behind `manage.py benchmark_api`: seeds benchmark users
+# and files straight into the database of the server under test, then
+# drives its routes over HTTP from a pool of threads.
+
+BENCHMARK_DOMAIN = "benchmark.example.com"
+BENCHMARK_PASSWORD = "benchmark-password"
+BENCHMARK_IDENTIFIER_PREFIX = "benchmark-"
+BENCHMARK_SEARCH_WORD = "benchmark"
+
+# set by standard.middleware.RequestTimingMiddleware (QUERY_COUNT_HEADER)
+QUERY_COUNT_HEADER = "X-DB-Queries"
+
+# 1x1 PNG, embedded as the seeded document's thumbnail
+THUMBNAIL_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA"
+    "60e6kgAAAABJRU5ErkJggg=="
+)
+
+Sample = namedtuple("Sample", ["route", "status", "seconds", "queries", "error"])
+
+
+def make_benchmark_document(text):
+    """docx with ``text`` as its only paragraph and a PNG thumbnail."""
+    parts = {
+        "[Content_Types].xml": (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/'
+            'content-types"><Default Extension="xml" ContentType="application/'
+            'xml"/><Default Extension="rels" ContentType="application/'
+            'vnd.openxmlformats-package.relationships+xml"/><Default '
+            'Extension="png" ContentType="image/png"/><Override PartName="/word/'
+            'document.xml" ContentType="application/vnd.openxmlformats-'
+            'officedocument.wordprocessingml.document.main+xml"/></Types>'
+        ),
+        "_rels/.rels": (
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/'
+            'relationships"><Relationship Id="rId1" Target="word/document.xml" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+            'relationships/officeDocument"/><Relationship Id="rId2" '
+            'Target="docProps/thumbnail.png" Type="http://schemas.openxmlformats.'
+            'org/package/2006/relationships/metadata/thumbnail"/></Relationships>'
+        ),
+        "docProps/thumbnail.png": THUMBNAIL_PNG,
+        "word/document.xml": (
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/'
+            'wordprocessingml/2006/main"><w:body><w:p><w:r><w:t>'
+            f"{text}</w:t></w:r></w:p></w:body></w:document>"
+        ),
+    }
+    document = BytesIO()
+    with zipfile.ZipFile(document, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in parts.items():
+            archive.writestr(name, data)
+    return document.getvalue()
+
+
+def get_benchmark_email(role, index):
+    return f"{role}-{index}@{BENCHMARK_DOMAIN}"
+
+
+def get_access_token(user):
+    return str(CustomTokenObtainPairSerializer.get_token(user).access_token)
+
+
+def seed_users(count, is_ops_user):
+    """``count`` active benchmark users of one role, created if missing."""
+    role = "ops" if is_ops_user else "client"
+    emails = [get_benchmark_email(role, index) for index in range(count)]
+    # one hash for everyone, hashing is what makes creating users slow
+    password = make_password(BENCHMARK_PASSWORD)
+    User.objects.bulk_create(
+        [
+            User(
+                username=email,
+                email=email,
+                first_name=role,
+                last_name="benchmark",
+                password=password,
+                is_active=True,
+            )
+            for email in emails
+        ],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+    users = list(User.objects.filter(username__in=emails).order_by("id"))
+    UserDetails.objects.bulk_create(
+        [UserDetails(user=user, is_ops_user=is_ops_user) for user in users],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+    return users
+
+
+def seed_files(count, users):
+    """
+    At least ``count`` benchmark Files, owned by ``users`` in turn. They all
+    share one stored document, which gets its preview generated.
+    """
+    file_objs = File.objects.filter(
+        file_identifier__startswith=BENCHMARK_IDENTIFIER_PREFIX
+    )
+    missing = count - file_objs.count()
+    if missing > 0:
+        content = ContentFile(
+            make_benchmark_document(f"{BENCHMARK_SEARCH_WORD} quarterly report"),
+            name="benchmark.docx",
+        )
+        with transaction.atomic():
+            blob = acquire_file_blob(content, get_sha256(content))
+            first_obj = create_blob_file(
+                users[0].id,
+                "benchmark document",
+                blob,
+                content.name,
+                file_identifier=f"{BENCHMARK_IDENTIFIER_PREFIX}{uuid.uuid4()}",
+            )
+            new_objs = File.objects.bulk_create(
+                [
+                    File(
+                        user=users[index % len(users)],
+                        file_name=f"benchmark document {index}",
+                        file_content=blob.content.name,
+                        file_identifier=f"{BENCHMARK_IDENTIFIER_PREFIX}{uuid.uuid4()}",
+                        content_sha256=blob.sha256,
+                        blob=blob,
+                        original_name=content.name,
+                    )
+                    for index in range(1, missing)
+                ],
+                batch_size=1000,
+            )
+            FileBlob.objects.filter(id=blob.id).update(
+                ref_count=F("ref_count") + len(new_objs)
+            )
+            body = first_obj.search_document.body
+            FileSearchDocument.objects.bulk_create(
+                [
+                    FileSearchDocument(
+                        file=file_obj, title=get_search_title(file_obj), body=body
+                    )
+                    for file_obj in new_objs
+                ],
+                batch_size=1000,
+            )
+        generate_pending_previews()
+
+    return list(file_objs.order_by("id")[:count])
+
+
+class BenchmarkFixtures:
+    """What the scenarios need: tokens, usernames, file ids and email links."""
+
+    def __init__(self, ops_users, client_users, file_objs):
+        self.ops_tokens = [get_access_token(user) for user in ops_users]
+        self.client_tokens = [get_access_token(user) for user in client_users]
+        self.usernames = [user.username for user in ops_users]
+        # email links of users that never log in, so their tokens stay valid
+        self.verify_paths = [
+            "/api/verify/{}/{}/".format(
+                urlsafe_base64_encode(force_bytes(user.pk)),
+                default_token_generator.make_token(user),
+            )
+            for user in client_users
+        ]
+        self.file_ids = [file_obj.id for file_obj in file_objs]
+        self.file_identifiers = [file_obj.file_identifier for file_obj in file_objs]
+        # bundles of five files, the links are server-side FileBundles
+        rng = random.Random(0)
+        self.signed_bundle_tokens = [
+            bundle_link_signer.dumps(
+                get_file_bundle(
+                    rng.sample(
+                        self.file_identifiers, min(5, len(self.file_identifiers))
+                    )
+                ).token
+            )
+            for _bundle in range(10)
+        ]
+
+
+def seed(users, files):
+    """Seed ``users`` (half of them ops users) and ``files`` Files."""
+    ops_count = max(1, users // 2)
+    ops_users = seed_users(ops_count, is_ops_user=True)
+    client_users = seed_users(max(1, users - ops_count), is_ops_user=False)
+    file_objs = seed_files(max(1, files), ops_users)
+    return BenchmarkFixtures(ops_users, client_users, file_objs)
+
+
+class BenchmarkClient:
+    """One keep-alive connection to the server under test, recording Samples."""
+
+    def __init__(self, base_url, timeout):
+        url = urlsplit(base_url)
+        if url.scheme == "https":
+            self.connection_class = http.client.HTTPSConnection
+        else:
+            self.connection_class = http.client.HTTPConnection
+        self.netloc = url.netloc
+        self.prefix = url.path.rstrip("/")
+        self.timeout = timeout
+        self.connection = None
+        self.samples = []
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def request(self, route, method, path, token=None, json_body=None, **kwargs):
+        """
+        Send a request and read the whole response. Returns (status, body),
+        ``(None, b"")`` if the request failed.
+        """
+        headers = kwargs.pop("headers", {})
+        body = kwargs.pop("body", None)
+        if json_body is not None:
+            body = json.dumps(json_body).encode()
+            headers["Content-Type"] = "application/json"
+        if token is not None:
+            headers["Authorization"] = f"Bearer {token}"
+
+        started = time.perf_counter()
+        try:
+            if self.connection is None:
+                self.connection = self.connection_class(
+                    self.netloc, timeout=self.timeout
+                )
+            self.connection.request(
+                method, self.prefix + path, body=body, headers=headers
+            )
+            response = self.connection.getresponse()
+            content = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            self.close()
+            self.samples.append(
+                Sample(route, None, time.perf_counter() - started, None, repr(e))
+            )
+            return None, b""
+
+        seconds = time.perf_counter() - started
+        if response.will_close:
+            self.close()
+        queries = response.getheader(QUERY_COUNT_HEADER)
+        self.samples.append(
+            Sample(
+                route,
+                response.status,
+                seconds,
+                int(queries) if queries is not None else None,
+                None,
+            )
+        )
+        return response.status, content
+
+
+# Scenarios drive one or more routes. They are named after the requests of
+# the Postman collection where it has one.
+SCENARIOS = {}
+
+
+def scenario(name):
+    def register(func):
+        SCENARIOS[name] = func
+        return func
+
+    return register
+
+
+def get_signup_data(role):
+    email = f"new-{role}-{uuid.uuid4().hex}@{BENCHMARK_DOMAIN}"
+    return {
+        "email": email,
+        "first_name": role,
+        "last_name": "benchmark",
+        "password": BENCHMARK_PASSWORD,
+        "password1": BENCHMARK_PASSWORD,
+    }
+
+
+def get_upload_document():
+    # unique bytes, so every upload stores (and indexes) a new blob
+    return make_benchmark_document(f"{BENCHMARK_SEARCH_WORD} upload {uuid.uuid4()}")
+
+
+@scenario("client_register")
+def client_register(client, fixtures, rng):
+    client.request(
+        "POST /api/auth/client_user/register/",
+        "POST",
+        "/api/auth/client_user/register/",
+        json_body=get_signup_data("client"),
+    )
+
+
+@scenario("ops_user_register")
+def ops_user_register(client, fixtures, rng):
+    client.request(
+        "POST /api/auth/ops_user/register/",
+        "POST",
+        "/api/auth/ops_user/register/",
+        json_body=get_signup_data("ops"),
+    )
+
+
+@scenario("login")
+def login(client, fixtures, rng):
+    client.request(
+        "POST /api/auth/login/",
+        "POST",
+        "/api/auth/login/",
+        json_body={
+            "username": rng.choice(fixtures.usernames),
+            "password": BENCHMARK_PASSWORD,
+        },
+    )
+
+
+@scenario("verify_email")
+def verify_email(client, fixtures, rng):
+    client.request(
+        "GET /api/verify/<uidb64>/<verification_token>/",
+        "GET",
+        rng.choice(fixtures.verify_paths),
+    )
+
+
+@scenario("upload file")
+def upload_file(client, fixtures, rng):
+    document = BytesIO(get_upload_document())
+    document.name = "benchmark.docx"
+    client.request(
+        "POST /api/file/",
+        "POST",
+        "/api/file/",
+        token=rng.choice(fixtures.ops_tokens),
+        body=encode_multipart(
+            BOUNDARY, {"file_name": "benchmark upload", "file_content": document}
+        ),
+        headers={"Content-Type": MULTIPART_CONTENT},
+    )
+
+
+@scenario("upload_session")
+def upload_session(client, fixtures, rng):
+    token = rng.choice(fixtures.ops_tokens)
+    document = get_upload_document()
+    status, content = client.request(
+        "POST /api/file/upload_session/",
+        "POST",
+        "/api/file/upload_session/",
+        token=token,
+        json_body={
+            "file_name": "benchmark upload",
+            "original_name": "benchmark.docx",
+            "total_size": len(document),
+        },
+    )
+    if status != 201:
+        return
+
+    session_path = f"/api/file/upload_session/{json.loads(content)['id']}/"
+    route = "/api/file/upload_session/<session_id>/"
+    client.request(f"GET {route}", "GET", session_path, token=token)
+    client.request(
+        f"PUT {route}",
+        "PUT",
+        f"{session_path}?offset=0",
+        token=token,
+        body=document,
+        headers={"Content-Type": "application/octet-stream"},
+    )
+    client.request(
+        f"POST {route}finalize/", "POST", f"{session_path}finalize/", token=token
+    )
+
+
+@scenario("get_all_files")
+def get_all_files(client, fixtures, rng):
+    client.request(
+        "GET /api/file/", "GET", "/api/file/", token=rng.choice(fixtures.client_tokens)
+    )
+
+
+@scenario("async_get_all_files")
+def async_get_all_files(client, fixtures, rng):
+    client.request(
+        "GET /api/async/file/",
+        "GET",
+        "/api/async/file/",
+        token=rng.choice(fixtures.client_tokens),
+    )
+
+
+@scenario("export_files")
+def export_files(client, fixtures, rng):
+    client.request(
+        "GET /api/file/export/",
+        "GET",
+        "/api/file/export/",
+        token=rng.choice(fixtures.client_tokens),
+    )
+
+
+@scenario("async_export_files")
+def async_export_files(client, fixtures, rng):
+    client.request(
+        "GET /api/async/file/export/",
+        "GET",
+        "/api/async/file/export/",
+        token=rng.choice(fixtures.client_tokens),
+    )
+
+
+@scenario("search_files")
+def search_files(client, fixtures, rng):
+    client.request(
+        "GET /api/file/search/",
+        "GET",
+        "/api/file/search/?" + urlencode({"q": BENCHMARK_SEARCH_WORD}),
+        token=rng.choice(fixtures.client_tokens),
+    )
+
+
+@scenario("file_preview")
+def file_preview(client, fixtures, rng):
+    client.request(
+        "GET /api/file/<file_id>/preview/",
+        "GET",
+        f"/api/file/{rng.choice(fixtures.file_ids)}/preview/",
+        token=rng.choice(fixtures.client_tokens),
+    )
+
+
+@scenario("file_preview_thumbnail")
+def file_preview_thumbnail(client, fixtures, rng):
+    client.request(
+        "GET /api/file/<file_id>/preview/thumbnail/",
+        "GET",
+        f"/api/file/{rng.choice(fixtures.file_ids)}/preview/thumbnail/",
+        token=rng.choice(fixtures.client_tokens),
+    )
+
+
+@scenario("generate_download_link")
+def generate_download_link(client, fixtures, rng):
+    client.request(
+        "POST /api/genarate_link/<file_id>/",
+        "POST",
+        f"/api/genarate_link/{rng.choice(fixtures.file_ids)}/",
+        token=rng.choice(fixtures.client_tokens),
+    )
+
+
+@scenario("generate_download_links")
+def generate_download_links(client, fixtures, rng):
+    client.request(
+        "POST /api/genarate_link/bulk/",
+        "POST",
+        "/api/genarate_link/bulk/",
+        token=rng.choice(fixtures.client_tokens),
+        json_body={
+            "file_ids": rng.sample(fixtures.file_ids, min(10, len(fixtures.file_ids)))
+        },
+    )
+
+
+@scenario("download_file")
+def download_file(client, fixtures, rng):
+    signed_identifier = download_link_signer.dumps(
+        rng.choice(fixtures.file_identifiers)
+    )
+    client.request(
+        "GET /api/download_file/<signed_identifier>/",
+        "GET",
+        f"/api/download_file/{signed_identifier}/",
+        token=rng.choice(fixtures.client_tokens),
+    )
+
+
+@scenario("async_download_file")
+def async_download_file(client, fixtures, rng):
+    signed_identifier = download_link_signer.dumps(
+        rng.choice(fixtures.file_identifiers)
+    )
+    client.request(
+        "GET /api/async/download_file/<signed_identifier>/",
+        "GET",
+        f"/api/async/download_file/{signed_identifier}/",
+        token=rng.choice(fixtures.client_tokens),
+    )
+
+
+@scenario("download_bundle")
+def download_bundle(client, fixtures, rng):
+    client.request(
+        "GET /api/download_bundle/<signed_token>/",
+        "GET",
+        f"/api/download_bundle/{rng.choice(fixtures.signed_bundle_tokens)}/",
+        token=rng.choice(fixtures.client_tokens),
+    )
+
+
+POSTMAN_VARIABLE_PATTERN = re.compile(r"{{\s*(\w+)\s*}}")
+
+
+class ReplayScenario:
+    """
+    A Postman request that no built-in scenario covers, sent as written.
+    {{api_host}} is the server under test; {{ops_token}}, {{client_token}}
+    and {{file_id}} are filled in from the seeded data. Requests carry an
+    ops user token unless they set their own Authorization header; file
+    fields of form-data bodies upload a new document.
+    """
+
+    def __init__(self, item):
+        request = item["request"]
+        self.method = request.get("method", "GET")
+        url = request.get("url", "")
+        self.url = url.get("raw", "") if isinstance(url, dict) else url
+        self.headers = {
+            header["key"]: header["value"]
+            for header in request.get("header", [])
+            if not header.get("disabled")
+        }
+        self.body = request.get("body") or {}
+
+    def __call__(self, client, fixtures, rng):
+        variables = {
+            "ops_token": rng.choice(fixtures.ops_tokens),
+            "client_token": rng.choice(fixtures.client_tokens),
+            "file_id": str(rng.choice(fixtures.file_ids)),
+        }
+
+        def fill(text):
+            return POSTMAN_VARIABLE_PATTERN.sub(
+                lambda match: variables.get(match.group(1), ""), text
+            )
+
+        url = urlsplit(fill(self.url))
+        path = url.path or "/"
+        headers = {key: fill(value) for key, value in self.headers.items()}
+        headers.setdefault("Authorization", f"Bearer {variables['ops_token']}")
+
+        body = None
+        mode = self.body.get("mode")
+        if mode == "raw":
+            body = fill(self.body.get("raw", "")).encode()
+        elif mode == "urlencoded":
+            body = urlencode(
+                [
+                    (field["key"], fill(field.get("value", "")))
+                    for field in self.body[mode]
+                ]
+            ).encode()
+            headers.setdefault("Content-Type", "application/x-www-form-urlencoded")
+        elif mode == "formdata":
+            fields = {}
+            for field in self.body[mode]:
+                if field.get("type") == "file":
+                    document = BytesIO(get_upload_document())
+                    document.name = "benchmark.docx"
+                    fields[field["key"]] = document
+                else:
+                    fields[field["key"]] = fill(field.get("value", ""))
+            body = encode_multipart(BOUNDARY, fields)
+            headers["Content-Type"] = MULTIPART_CONTENT
+
+        client.request(
+            f"{self.method} {path}",
+            self.method,
+            f"{path}?{url.query}" if url.query else path,
+            body=body,
+            headers=headers,
+        )
+
+
+def iter_postman_requests(items):
+    for item in items:
+        if "item" in item:
+            # a folder
+            yield from iter_postman_requests(item["item"])
+        elif "request" in item:
+            yield item
+
+
+def load_mix(collection_path, weights=None):
+    """
+    Request mix as {name: (weight, scenario)}: every request of the Postman
+    collection and every built-in scenario, weight 1 unless ``weights``
+    ({name: weight}) says otherwise. A weight of 0 leaves a request out.
+    Collection requests with the name of a built-in scenario run it, others
+    are replayed from the collection (see ReplayScenario).
+    """
+    with open(collection_path) as collection_file:
+        collection = json.load(collection_file)
+
+    scenarios = dict(SCENARIOS)
+    for item in iter_postman_requests(collection.get("item", [])):
+        if item["name"] not in scenarios:
+            scenarios[item["name"]] = ReplayScenario(item)
+
+    weights = weights or {}
+    unknown = set(weights) - set(scenarios)
+    if unknown:
+        raise ValueError(f"unknown requests: {', '.join(sorted(unknown))}")
+
+    mix = {}
+    for name, func in scenarios.items():
+        weight = weights.get(name, 1)
+        if weight > 0:
+            mix[name] = (weight, func)
+    if not mix:
+        raise ValueError("every request has a weight of 0")
+    return mix
+
+
+def run_benchmark(
+    base_url, mix, fixtures, concurrency, requests=None, duration=None, **options
+):
+    """
+    Run ``requests`` scenarios (or as many as fit in ``duration`` seconds)
+    picked by weight from ``mix``, in ``concurrency`` threads with one
+    connection each. Every scenario is first run ``warmup`` times without
+    being measured. Returns (samples, wall clock seconds).
+    """
+    timeout = options.get("timeout", 30)
+    seed = options.get("seed")
+    names = list(mix)
+    weights = [mix[name][0] for name in names]
+
+    warmup_client = BenchmarkClient(base_url, timeout)
+    warmup_rng = random.Random(seed)
+    for _ in range(options.get("warmup", 1)):
+        for _weight, func in mix.values():
+            func(warmup_client, fixtures, warmup_rng)
+    warmup_client.close()
+
+    lock = threading.Lock()
+    started_scenarios = 0
+    deadline = None
+
+    def next_scenario():
+        nonlocal started_scenarios
+        if deadline is not None:
+            return time.perf_counter() < deadline
+        with lock:
+            started_scenarios += 1
+            return started_scenarios <= requests
+
+    def work(client, rng):
+        while next_scenario():
+            name = rng.choices(names, weights)[0]
+            mix[name][1](client, fixtures, rng)
+        client.close()
+
+    clients = [BenchmarkClient(base_url, timeout) for _ in range(concurrency)]
+    threads = [
+        threading.Thread(
+            target=work,
+            args=(client, random.Random(None if seed is None else seed + index)),
+        )
+        for index, client in enumerate(clients)
+    ]
+    started = time.perf_counter()
+    if duration is not None:
+        deadline = started + duration
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return [sample for client in clients for sample in client.samples], elapsed
+
+
+def get_percentile(sorted_values, percent):
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    return statistics.quantiles(sorted_values, n=100, method="inclusive")[percent - 1]
+
+
+def summarize_samples(samples, elapsed):
+    latencies = sorted(sample.seconds * 1000 for sample in samples)
+    queries = [sample.queries for sample in samples if sample.queries is not None]
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for sample in samples if sample.error or sample.status >= 400),
+        "statuses": dict(Counter(str(sample.status or "error") for sample in samples)),
+        "throughput": len(samples) / elapsed if elapsed else 0.0,
+        "latency_ms": {
+            "mean": statistics.fmean(latencies),
+            "p50": get_percentile(latencies, 50),
+            "p95": get_percentile(latencies, 95),
+            "p99": get_percentile(latencies, 99),
+            "max": latencies[-1],
+        },
+        # None when the server does not send QUERY_COUNT_HEADER
+        "queries_per_request": statistics.fmean(queries) if queries else None,
+        "max_queries": max(queries) if queries else None,
+    }
+
+
+def summarize(samples, elapsed):
+    """Throughput, latency percentiles and query counts, overall and per route."""
+    if not samples:
+        raise ValueError("no requests were sent")
+
+    samples_by_route = defaultdict(list)
+    for sample in samples:
+        samples_by_route[sample.route].append(sample)
+    return {
+        "elapsed": elapsed,
+        "total": summarize_samples(samples, elapsed),
+        "routes": {
+            route: summarize_samples(route_samples, elapsed)
+            for route, route_samples in sorted(samples_by_route.items())
+        },
+    }
+
+
+def compare_results(previous, current, threshold):
+    """
+    Regressions of ``current`` against ``previous`` (both summarize()
+    results) as messages: a route whose p95 latency grew, or throughput
+    fell, or queries per request grew, by more than ``threshold`` (0.1 is
+    10%).
+    """
+    regressions = []
+    for route, stats in {"total": current["total"], **current["routes"]}.items():
+        if route == "total":
+            before = previous["total"]
+        elif route in previous["routes"]:
+            before = previous["routes"][route]
+        else:
+            continue
+
+        p95, previous_p95 = stats["latency_ms"]["p95"], before["latency_ms"]["p95"]
+        if p95 > previous_p95 * (1 + threshold):
+            regressions.append(f"{route}: p95 {previous_p95:.1f}ms -> {p95:.1f}ms")
+        throughput, previous_throughput = stats["throughput"], before["throughput"]
+        if throughput < previous_throughput * (1 - threshold):
+            regressions.append(
+                f"{route}: throughput {previous_throughput:.1f}/s -> "
+                f"{throughput:.1f}/s"
+            )
+        queries, previous_queries = (
+            stats["queries_per_request"],
+            before["queries_per_request"],
+        )
+        if None not in (queries, previous_queries) and queries > previous_queries * (
+            1 + threshold
+        ):
+            regressions.append(
+                f"{route}: queries per request {previous_queries:.1f} -> "
+                f"{queries:.1f}"
+            )
+    return regressions
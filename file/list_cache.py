@@ -0,0 +1,95 @@
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+
+GENERATION_KEY = "file-list:generation"
+
+
+class FileListCache:
+    """
+    Caches pages of the file listing under a "files generation" counter.
+
+    The counter is bumped once a transaction that saved or deleted a File
+    commits (see file.signals), so a page is only ever read back for the
+    files it was computed from: pages of older generations are never looked
+    up again and expire. The generation is also the ETag of every page.
+
+    The counter has to be seen by every worker, so caching is off unless
+    ``cache_alias`` (default FILE_LIST_CACHE_ALIAS, read on every call)
+    names a cache; every method then does nothing.
+    """
+
+    def __init__(self, cache_alias=None):
+        self._cache_alias = cache_alias
+
+    @property
+    def shared_cache(self):
+        cache_alias = self._cache_alias or settings.FILE_LIST_CACHE_ALIAS
+        return caches[cache_alias] if cache_alias else None
+
+    def get_generation(self):
+        """Current files generation, None when caching is off."""
+        shared_cache = self.shared_cache
+        if shared_cache is None:
+            return None
+        generation = shared_cache.get(GENERATION_KEY)
+        if generation is None:
+            # start from the clock, not 0: the pages of a counter that was
+            # evicted must not be served again
+            shared_cache.add(GENERATION_KEY, time.time_ns(), timeout=None)
+            generation = shared_cache.get(GENERATION_KEY)
+        return generation
+
+    def bump_generation(self):
+        shared_cache = self.shared_cache
+        if shared_cache is None:
+            return
+        try:
+            shared_cache.incr(GENERATION_KEY)
+        except ValueError:
+            # not set: the next reader starts a new one
+            pass
+
+    def invalidate(self):
+        """Bump the generation when the current transaction commits."""
+        transaction.on_commit(self.bump_generation)
+
+    @staticmethod
+    def get_etag(generation):
+        return f'"files-{generation}"'
+
+    def get_not_modified_response(self, request, generation):
+        """304 response when the client has the page of this generation."""
+        if generation is None:
+            return None
+        response = get_conditional_response(request, etag=self.get_etag(generation))
+        return self.add_etag(response, generation) if response else None
+
+    def get_page(self, request, generation, get_data):
+        """The cached data of this page, ``get_data()`` when there is none."""
+        if generation is None:
+            return get_data()
+
+        # page links are absolute URLs: key on the host and path too
+        query = urlencode(sorted(request.GET.lists()), doseq=True)
+        url = f"{request.build_absolute_uri(request.path)}?{query}"
+        key = f"file-list:{generation}:{hashlib.sha256(url.encode()).hexdigest()}"
+
+        data = self.shared_cache.get(key)
+        if data is None:
+            data = get_data()
+            self.shared_cache.set(key, data, settings.FILE_LIST_CACHE_TIMEOUT)
+        return data
+
+    def add_etag(self, response, generation):
+        if generation is not None:
+            response["ETag"] = self.get_etag(generation)
+        return response
+
+
+file_list_cache = FileListCache()
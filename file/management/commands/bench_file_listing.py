@@ -0,0 +1,84 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework.renderers import JSONRenderer
+
+from account.models import User
+from file.models import File
+from file.streaming import FileListJSONStream
+from file.views import FileMultiView
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the DRF serializer listing with the streaming JSON fast path "
+        "on a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=100000)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.seed(options["rows"])
+            self.run(options["repeat"])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def seed(self, rows):
+        user = User.objects.create(username="bench@example.com")
+        File.objects.bulk_create(
+            (
+                File(
+                    user=user,
+                    file_name=f"document {i}",
+                    file_content=f"uploads/document_{i}.pptx",
+                    file_identifier=f"bench-{i}",
+                )
+                for i in range(rows)
+            ),
+            batch_size=5000,
+        )
+        self.stdout.write(f"seeded {rows} files")
+
+    def run(self, repeat):
+        queryset = File.objects.order_by("-id")
+
+        def serializer_path():
+            data = FileMultiView.FileModelSerializer(queryset.all(), many=True).data
+            return JSONRenderer().render(data)
+
+        def stream_path():
+            stream = FileListJSONStream(
+                queryset.all(), FileMultiView.FileModelSerializer
+            )
+            return b"".join(stream)
+
+        results = {}
+        for label, func in (("serializer", serializer_path), ("stream", stream_path)):
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                body = func()
+                timings.append(time.perf_counter() - started)
+            results[label] = body
+
+            # separate pass, tracemalloc slows everything down
+            tracemalloc.start()
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            self.stdout.write(
+                f"{label:>10}: best {min(timings):.3f}s, "
+                f"peak {peak / 1024 / 1024:.1f} MiB (includes the joined body), "
+                f"{len(body)} bytes"
+            )
+
+        if results["serializer"] != results["stream"]:
+            self.stderr.write("outputs differ")
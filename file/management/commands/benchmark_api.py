@@ -0,0 +1,157 @@
+import json
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from file.benchmark import compare_results, load_mix, run_benchmark, seed, summarize
+
+DEFAULT_COLLECTION = (
+    settings.BASE_DIR / "postmancollection" / "ez_assignment.postman_collection.json"
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed benchmark users and files, then load test every API route of a "
+        "running server and report throughput, latency percentiles and "
+        "database queries per request. The users and files are written to "
+        "this command's database, so run the server with the same settings "
+        "(DB_ENGINE=sqlite for SQLite) and with QUERY_COUNT_HEADER=TRUE to "
+        "get query counts, and with THROTTLE_ENABLED=FALSE so downloads are "
+        "not rate limited. Direct (S3) uploads are not driven."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+        parser.add_argument("--users", type=int, default=20)
+        parser.add_argument("--files", type=int, default=1000)
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=1000,
+            help="scenarios to run; some scenarios send several requests",
+        )
+        parser.add_argument(
+            "--duration", type=float, help="run for this many seconds instead"
+        )
+        parser.add_argument(
+            "--collection",
+            default=str(DEFAULT_COLLECTION),
+            help="Postman collection whose requests make up the mix",
+        )
+        parser.add_argument(
+            "--weight",
+            action="append",
+            default=[],
+            metavar="NAME=WEIGHT",
+            help="relative weight of a request in the mix (default 1, 0 drops it)",
+        )
+        parser.add_argument(
+            "--warmup",
+            type=int,
+            default=1,
+            help="unmeasured runs of every scenario before the benchmark",
+        )
+        parser.add_argument("--timeout", type=float, default=30)
+        parser.add_argument("--seed", type=int, help="seed of the request picks")
+        parser.add_argument("--output", help="write the results to this JSON file")
+        parser.add_argument(
+            "--compare",
+            help="results JSON of an earlier run; fail on regressions against it",
+        )
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=0.1,
+            help="relative change that counts as a regression (0.1 is 10%%)",
+        )
+
+    def handle(self, *args, **options):
+        weights = {}
+        for weight in options["weight"]:
+            name, _, value = weight.rpartition("=")
+            try:
+                weights[name] = float(value)
+            except ValueError:
+                raise CommandError(f"invalid --weight {weight!r}, use NAME=WEIGHT")
+        try:
+            mix = load_mix(options["collection"], weights)
+        except (OSError, ValueError) as e:
+            raise CommandError(e)
+
+        fixtures = seed(options["users"], options["files"])
+        self.stdout.write(
+            f"seeded {len(fixtures.ops_tokens)} ops users, "
+            f"{len(fixtures.client_tokens)} client users, "
+            f"{len(fixtures.file_ids)} files"
+        )
+
+        samples, elapsed = run_benchmark(
+            options["base_url"],
+            mix,
+            fixtures,
+            options["concurrency"],
+            requests=options["requests"],
+            duration=options["duration"],
+            warmup=options["warmup"],
+            timeout=options["timeout"],
+            seed=options["seed"],
+        )
+        try:
+            summary = summarize(samples, elapsed)
+        except ValueError as e:
+            raise CommandError(e)
+        self.write_summary(summary)
+
+        results = {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "config": {
+                "base_url": options["base_url"],
+                "database": connection.vendor,
+                "users": options["users"],
+                "files": options["files"],
+                "concurrency": options["concurrency"],
+                "requests": options["requests"],
+                "duration": options["duration"],
+                "mix": {name: weight for name, (weight, _func) in mix.items()},
+            },
+            **summary,
+        }
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump(results, output, indent=2)
+            self.stdout.write(f"results written to {options['output']}")
+
+        if options["compare"]:
+            with open(options["compare"]) as previous_file:
+                previous = json.load(previous_file)
+            if previous["config"] != results["config"]:
+                self.stderr.write(
+                    "the earlier run used other options, compare with care"
+                )
+            regressions = compare_results(previous, summary, options["threshold"])
+            if regressions:
+                raise CommandError(
+                    "regressions against {}:\n{}".format(
+                        options["compare"], "\n".join(regressions)
+                    )
+                )
+            self.stdout.write(f"no regressions against {options['compare']}")
+
+    def write_summary(self, summary):
+        self.stdout.write(
+            f"{'route':<52} {'reqs':>6} {'errs':>5} {'req/s':>8} "
+            f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>7}"
+        )
+        for route, stats in {**summary["routes"], "total": summary["total"]}.items():
+            latency = stats["latency_ms"]
+            queries = stats["queries_per_request"]
+            self.stdout.write(
+                f"{route:<52} {stats['requests']:>6} {stats['errors']:>5} "
+                f"{stats['throughput']:>8.1f} {latency['p50']:>8.1f} "
+                f"{latency['p95']:>8.1f} {latency['p99']:>8.1f} "
+                f"{'-' if queries is None else format(queries, '.1f'):>7}"
+            )
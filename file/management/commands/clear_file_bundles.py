@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from file.models import FileBundle
+
+
+class Command(BaseCommand):
+    help = "Delete bundle links (FileBundles) older than FILE_BUNDLE_EXPIRY."
+
+    def handle(self, *args, **options):
+        count, _deleted = FileBundle.objects.filter(
+            created_at__lt=timezone.now() - settings.FILE_BUNDLE_EXPIRY
+        ).delete()
+        self.stdout.write(f"deleted {count} expired bundles")
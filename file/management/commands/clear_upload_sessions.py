@@ -0,0 +1,25 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from file.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = "Delete chunked upload sessions (and their temp files) older than CHUNKED_UPLOAD_EXPIRY."
+
+    def handle(self, *args, **options):
+        expired = UploadSession.objects.filter(
+            created_at__lt=timezone.now() - settings.CHUNKED_UPLOAD_EXPIRY
+        )
+
+        count = 0
+        for session_obj in expired.iterator():
+            if os.path.exists(session_obj.temp_path):
+                os.remove(session_obj.temp_path)
+            session_obj.delete()
+            count += 1
+
+        self.stdout.write(f"deleted {count} expired upload sessions")
@@ -0,0 +1,52 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from file.preview_jobs import generate_pending_previews
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate queued document previews (thumbnail and text snippet) in a "
+        "pool of worker processes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=settings.FILE_PREVIEW_BATCH_SIZE
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=settings.FILE_PREVIEW_WORKERS,
+            help="Previews generated at the same time, one process each.",
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep polling for jobs instead of exiting once none are due.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5,
+            help="Seconds to wait between polls when no job is due (with --loop).",
+        )
+
+    def handle(self, *args, **options):
+        total_ready = total_failed = 0
+        while True:
+            ready, failed = generate_pending_previews(
+                options["batch_size"], options["workers"]
+            )
+            total_ready += ready
+            total_failed += failed
+
+            if ready + failed < options["batch_size"]:
+                # queue drained (or only jobs waiting for a retry are left)
+                if not options["loop"]:
+                    break
+                time.sleep(options["interval"])
+
+        self.stdout.write(f"generated {total_ready} previews, {total_failed} failed")
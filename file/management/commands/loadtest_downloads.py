@@ -0,0 +1,107 @@
+import asyncio
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Open many concurrent slow downloads against a running server and "
+        "report how many were served at once. Compare e.g. "
+        "`gunicorn project.wsgi -w 4` on /api/download_file/<id>/ with "
+        "`uvicorn project.asgi:application` on /api/async/download_file/<id>/."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("url", help="http:// URL of a download endpoint")
+        parser.add_argument("--token", required=True, help="client user JWT")
+        parser.add_argument("--concurrency", type=int, default=500)
+        parser.add_argument(
+            "--read-delay",
+            type=float,
+            default=0.05,
+            help="seconds each client waits between 64 KiB reads (a slow link)",
+        )
+        parser.add_argument("--timeout", type=float, default=120)
+
+    def handle(self, *args, **options):
+        url = urlsplit(options["url"])
+        if url.scheme != "http":
+            raise CommandError("only plain http:// URLs are supported")
+
+        results = asyncio.run(self.run(url, options))
+
+        completed = [result for result in results if result["error"] is None]
+        failed = len(results) - len(completed)
+        self.stdout.write(
+            f"clients: {len(results)}, completed: {len(completed)}, failed: {failed}"
+        )
+        if not completed:
+            return
+
+        first_bytes = [result["first_byte"] for result in completed]
+        totals = [result["total"] for result in completed]
+        quantiles = statistics.quantiles(first_bytes, n=100)
+        self.stdout.write(
+            "time to first byte: p50 {:.3f}s p95 {:.3f}s max {:.3f}s".format(
+                quantiles[49], quantiles[94], max(first_bytes)
+            )
+        )
+        self.stdout.write(
+            "download time: p50 {:.3f}s max {:.3f}s".format(
+                statistics.median(totals), max(totals)
+            )
+        )
+        self.stdout.write(f"peak downloads in flight: {self.peak_in_flight(completed)}")
+
+    async def run(self, url, options):
+        request = (
+            f"GET {url.path or '/'}{'?' + url.query if url.query else ''} HTTP/1.1\r\n"
+            f"Host: {url.netloc}\r\n"
+            f"Authorization: Bearer {options['token']}\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode()
+
+        async def fetch(result):
+            reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+            try:
+                writer.write(request)
+                await writer.drain()
+
+                status_line = await reader.readline()
+                result["first_byte"] = time.monotonic() - result["start"]
+                if b" 200 " not in status_line and b" 206 " not in status_line:
+                    raise ValueError(status_line.decode().strip())
+                while await reader.read(64 * 1024):
+                    await asyncio.sleep(options["read_delay"])
+                result["total"] = time.monotonic() - result["start"]
+            finally:
+                writer.close()
+
+        async def download():
+            result = {"start": time.monotonic(), "first_byte": None, "total": None}
+            try:
+                await asyncio.wait_for(fetch(result), options["timeout"])
+                result["error"] = None
+            except Exception as e:
+                result["error"] = repr(e)
+            return result
+
+        return await asyncio.gather(
+            *(download() for _ in range(options["concurrency"]))
+        )
+
+    @staticmethod
+    def peak_in_flight(results):
+        # most downloads that were receiving their body at the same moment
+        events = []
+        for result in results:
+            events.append((result["start"] + result["first_byte"], 1))
+            events.append((result["start"] + result["total"], -1))
+        peak = in_flight = 0
+        for _moment, change in sorted(events):
+            in_flight += change
+            peak = max(peak, in_flight)
+        return peak
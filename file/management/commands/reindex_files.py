@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from file.search import reindex_files
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the full-text search index of every uploaded file, extracting "
+        "document text in a pool of worker processes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=settings.FILE_SEARCH_REINDEX_BATCH_SIZE
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=settings.FILE_SEARCH_REINDEX_WORKERS,
+            help="Documents parsed at the same time, one process each.",
+        )
+
+    def handle(self, *args, **options):
+        indexed = reindex_files(options["batch_size"], options["workers"])
+        self.stdout.write(f"indexed {indexed} files")
@@ -0,0 +1,52 @@
+import time
+
+from standard.metrics import Counter, Histogram
+
+from .responses import call_on_close
+
+SIZE_BUCKETS = [
+    64 * 1024,
+    256 * 1024,
+    1024 * 1024,
+    4 * 1024 * 1024,
+    16 * 1024 * 1024,
+    64 * 1024 * 1024,
+    256 * 1024 * 1024,
+]
+DURATION_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300]
+
+upload_bytes = Histogram(
+    "file_upload_bytes",
+    "Size of the documents uploaded through POST /api/file/.",
+    buckets=SIZE_BUCKETS,
+)
+download_bytes = Histogram(
+    "file_download_bytes",
+    "Body size of download responses (the range of a 206, 0 for a 304 or a "
+    "download sent by the front proxy).",
+    buckets=SIZE_BUCKETS,
+)
+download_seconds = Histogram(
+    "file_download_seconds",
+    "Time from a download request to the last byte of its response.",
+    buckets=DURATION_BUCKETS,
+)
+download_link_count = Counter(
+    "file_download_links",
+    "Download links generated, of single files and of ZIP bundles.",
+    labelnames=["kind"],
+)
+
+
+def observe_download(response, started):
+    """
+    Record a download response's size and, once its body has been sent,
+    the time since ``started`` (a time.monotonic() value).
+    """
+    size = int(response.get("Content-Length") or 0)
+
+    def record():
+        download_bytes.observe(size)
+        download_seconds.observe(time.monotonic() - started)
+
+    return call_on_close(response, record)
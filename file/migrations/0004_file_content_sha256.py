@@ -0,0 +1,17 @@
+# Generated by Django 4.2.4 on 2026-10-18 11:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file", "0003_uploadsession"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="file",
+            name="content_sha256",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.4 on 2026-10-18 11:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+import file.models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file", "0004_file_content_sha256"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FileBlob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("sha256", models.CharField(max_length=64, unique=True)),
+                (
+                    "content",
+                    models.FileField(upload_to=file.models.get_blob_upload_path),
+                ),
+                ("size", models.PositiveBigIntegerField()),
+                ("ref_count", models.PositiveIntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="file",
+            name="original_name",
+            field=models.CharField(blank=True, default="", max_length=255),
+        ),
+        migrations.AddField(
+            model_name="file",
+            name="blob",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="files",
+                to="file.fileblob",
+            ),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 4.2.4 on 2026-10-18 11:30
+
+import django.utils.timezone
+from django.db import migrations, models
+
+import file.models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file", "0005_fileblob"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FilePreview",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("sha256", models.CharField(max_length=64, unique=True)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("ready", "Ready"),
+                            ("failed", "Failed"),
+                        ],
+                        default="pending",
+                        max_length=10,
+                    ),
+                ),
+                (
+                    "thumbnail",
+                    models.FileField(
+                        blank=True, upload_to=file.models.get_preview_upload_path
+                    ),
+                ),
+                ("text", models.TextField(blank=True, default="")),
+                ("attempts", models.PositiveIntegerField(default=0)),
+                (
+                    "next_attempt_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                ("last_error", models.TextField(blank=True, default="")),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("generated_at", models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["status", "next_attempt_at"],
+                        name="file_filepr_status_79b2a7_idx",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,98 @@
+# Generated by Django 4.2.4 on 2026-10-18 11:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# The search index is database specific, see file.search. Existing files are
+# indexed by `manage.py reindex_files`.
+POSTGRESQL_INDEX = [
+    """
+    ALTER TABLE file_filesearchdocument ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', title), 'A')
+        || setweight(to_tsvector('english', body), 'D')
+    ) STORED
+    """,
+    """
+    CREATE INDEX file_filesearchdocument_search_vector_idx
+    ON file_filesearchdocument USING gin (search_vector)
+    """,
+]
+# external content FTS5 table: it stores only the index and is kept in sync
+# with file_filesearchdocument by triggers (a table rebuild by a later
+# migration would drop them)
+SQLITE_INDEX = [
+    """
+    CREATE VIRTUAL TABLE file_search_fts USING fts5(
+        title, body,
+        content='file_filesearchdocument', content_rowid='file_id',
+        tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER file_search_fts_insert AFTER INSERT ON file_filesearchdocument
+    BEGIN
+        INSERT INTO file_search_fts(rowid, title, body)
+        VALUES (new.file_id, new.title, new.body);
+    END
+    """,
+    """
+    CREATE TRIGGER file_search_fts_delete AFTER DELETE ON file_filesearchdocument
+    BEGIN
+        INSERT INTO file_search_fts(file_search_fts, rowid, title, body)
+        VALUES ('delete', old.file_id, old.title, old.body);
+    END
+    """,
+    """
+    CREATE TRIGGER file_search_fts_update AFTER UPDATE ON file_filesearchdocument
+    BEGIN
+        INSERT INTO file_search_fts(file_search_fts, rowid, title, body)
+        VALUES ('delete', old.file_id, old.title, old.body);
+        INSERT INTO file_search_fts(rowid, title, body)
+        VALUES (new.file_id, new.title, new.body);
+    END
+    """,
+]
+
+
+def create_search_index(apps, schema_editor):
+    statements = {
+        "postgresql": POSTGRESQL_INDEX,
+        "sqlite": SQLITE_INDEX,
+    }.get(schema_editor.connection.vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    # the column, index and triggers go with the table
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute("DROP TABLE file_search_fts")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file", "0006_filepreview"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FileSearchDocument",
+            fields=[
+                (
+                    "file",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="search_document",
+                        serialize=False,
+                        to="file.file",
+                    ),
+                ),
+                ("title", models.TextField(blank=True, default="")),
+                ("body", models.TextField(blank=True, default="")),
+                ("indexed_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
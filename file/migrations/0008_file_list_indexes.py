@@ -0,0 +1,39 @@
+# Generated by Django 4.2.4 on 2026-10-18 11:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file", "0007_filesearchdocument"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="file",
+            index=models.Index(fields=["user", "id"], name="file_user_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="file",
+            index=models.Index(
+                fields=["upload_timestamp", "id"], name="file_upload_ts_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="file",
+            index=models.Index(
+                fields=["user", "upload_timestamp", "id"],
+                name="file_user_upload_ts_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="file",
+            index=models.Index(fields=["file_name", "id"], name="file_name_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="file",
+            index=models.Index(
+                fields=["user", "file_name", "id"], name="file_user_name_id_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.4 on 2026-10-18 12:00
+
+from django.db import migrations, models
+import file.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("file", "0008_file_list_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FileBundle",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "token",
+                    models.CharField(
+                        default=file.models.get_bundle_token, max_length=32, unique=True
+                    ),
+                ),
+                ("file_identifiers", models.JSONField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
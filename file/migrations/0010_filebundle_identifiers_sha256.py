@@ -0,0 +1,25 @@
+# Generated by Django 4.2.4 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+def delete_bundles(apps, schema_editor):
+    # bundles without a hash are only reachable by links given out before,
+    # which get "invalid id" and are requested again
+    apps.get_model("file", "FileBundle").objects.all().delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file", "0009_filebundle"),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_bundles, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name="filebundle",
+            name="identifiers_sha256",
+            field=models.CharField(max_length=64, unique=True),
+            preserve_default=False,
+        ),
+    ]
@@ -1,10 +1,77 @@
+import os
+import secrets
+import uuid
+
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
 from account.models import User
 
 # Create your models here.
 
 
+def get_blob_upload_path(instance, filename):
+    # content addressed: the same bytes always land on the same path
+    extension = os.path.splitext(filename)[1].lower()
+    return f"blobs/{instance.sha256[:2]}/{instance.sha256}{extension}"
+
+
+class FileBlob(models.Model):
+    """
+    Stored bytes of an uploaded document, shared by every File with the same
+    SHA-256. ``ref_count`` is the number of File rows pointing at it; the
+    blob and its file are removed when it drops to zero.
+    """
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    content = models.FileField(upload_to=get_blob_upload_path)
+    size = models.PositiveBigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+def get_preview_upload_path(instance, filename):
+    extension = os.path.splitext(filename)[1].lower()
+    return f"previews/{instance.sha256[:2]}/{instance.sha256}{extension}"
+
+
+class FilePreview(models.Model):
+    """
+    Thumbnail and text snippet of a document, generated by the
+    ``generate_file_previews`` worker. One row per content hash, so identical
+    uploads share (and never queue twice) one preview job.
+    """
+
+    STATUS_PENDING = "pending"
+    STATUS_READY = "ready"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_READY, "Ready"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING
+    )
+    thumbnail = models.FileField(
+        upload_to=get_preview_upload_path, blank=True
+    )  # empty when the document has no thumbnail and none could be rendered
+    text = models.TextField(blank=True, default="")
+    attempts = models.PositiveIntegerField(default=0)
+    # when a pending job is due; a claimed job is due again once its worker
+    # has had FILE_PREVIEW_TIMEOUT to finish it
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    generated_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "next_attempt_at"])]
+
+
 class File(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     file_name = models.CharField(max_length=255)
@@ -13,3 +80,91 @@ class File(models.Model):
     file_identifier = models.CharField(
         max_length=255, unique=True
     )  # Unique identifier for the file
+    content_sha256 = models.CharField(
+        max_length=64, blank=True, default=""
+    )  # empty for files uploaded before hashes were stored
+    # file_content is the blob's path; files uploaded before deduplication
+    # have no blob and keep their own copy under uploads/
+    blob = models.ForeignKey(
+        FileBlob,
+        on_delete=models.PROTECT,
+        related_name="files",
+        blank=True,
+        null=True,
+    )
+    original_name = models.CharField(
+        max_length=255, blank=True, default=""
+    )  # name of the uploaded document, used for downloads
+
+    class Meta:
+        # one per listing filter and sort, alone and after ?user= (see
+        # FileMultiView.get); the trailing id matches the listing's orders
+        indexes = [
+            models.Index(fields=["user", "id"], name="file_user_id_idx"),
+            models.Index(fields=["upload_timestamp", "id"], name="file_upload_ts_idx"),
+            models.Index(
+                fields=["user", "upload_timestamp", "id"],
+                name="file_user_upload_ts_idx",
+            ),
+            models.Index(fields=["file_name", "id"], name="file_name_id_idx"),
+            models.Index(
+                fields=["user", "file_name", "id"], name="file_user_name_id_idx"
+            ),
+        ]
+
+
+class UploadSession(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    file_name = models.CharField(max_length=255)
+    original_name = models.CharField(max_length=255)  # name of the uploaded document
+    total_size = models.PositiveBigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def temp_path(self):
+        return os.path.join(settings.CHUNKED_UPLOAD_DIR, f"{self.id}.part")
+
+    @property
+    def offset(self):
+        # bytes already on disk, including a partially received chunk
+        try:
+            return os.path.getsize(self.temp_path)
+        except FileNotFoundError:
+            return 0
+
+
+def get_bundle_token():
+    return secrets.token_urlsafe(16)
+
+
+class FileBundle(models.Model):
+    """
+    Files of a bundle link (see GenerateDownloadFileLinksView). The link
+    only carries the signed token: a list of identifiers would make URLs
+    longer than proxies accept. One row per list of identifiers, valid for
+    FILE_BUNDLE_EXPIRY and deleted by ``manage.py clear_file_bundles``.
+    """
+
+    token = models.CharField(max_length=32, unique=True, default=get_bundle_token)
+    file_identifiers = models.JSONField()
+    # sha256 of the JSON list of identifiers, in order
+    identifiers_sha256 = models.CharField(max_length=64, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class FileSearchDocument(models.Model):
+    """
+    Searchable text of a File: its names and the text extracted from the
+    document. The index over it is database specific and kept in sync by
+    the database: a generated ``search_vector`` tsvector column with a GIN
+    index on PostgreSQL, the ``file_search_fts`` FTS5 table (updated by
+    triggers) on SQLite. See ``file.search``.
+    """
+
+    file = models.OneToOneField(
+        File, on_delete=models.CASCADE, primary_key=True, related_name="search_document"
+    )
+    title = models.TextField(blank=True, default="")
+    body = models.TextField(blank=True, default="")
+    indexed_at = models.DateTimeField(auto_now=True)
@@ -0,0 +1,110 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class PresignedUrlCache:
+    """
+    Reuses presigned URLs while they have enough lifetime left.
+
+    URLs are keyed by (storage name, expiry, time window). A window is
+    ``expire - min_remaining`` seconds long, so every URL handed out from a
+    window is still valid for at least ``min_remaining`` seconds. Entries
+    live in a bounded in-process LRU and, when ``cache_alias`` is set, in
+    that Django cache too so all workers share them.
+
+    ``max_size``, ``min_remaining`` and ``cache_alias`` default to the
+    PRESIGNED_URL_CACHE_* settings, read on every call.
+    """
+
+    def __init__(self, max_size=None, min_remaining=None, cache_alias=None, clock=None):
+        self._max_size = max_size
+        self._min_remaining = min_remaining
+        self._cache_alias = cache_alias
+        self.clock = clock or time.time
+        self.urls = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def max_size(self):
+        return self._max_size or settings.PRESIGNED_URL_CACHE_SIZE
+
+    @property
+    def min_remaining(self):
+        if self._min_remaining is not None:
+            return self._min_remaining
+        return settings.PRESIGNED_URL_CACHE_MIN_REMAINING
+
+    @property
+    def shared_cache(self):
+        cache_alias = self._cache_alias or settings.PRESIGNED_URL_CACHE_ALIAS
+        return caches[cache_alias] if cache_alias else None
+
+    def get_url(self, storage, name, expire):
+        """Presigned URL for ``name``, signed by ``storage.url(name)``."""
+        now = self.clock()
+        min_remaining = min(self.min_remaining, expire // 2)
+        window = int(now // max(expire - min_remaining, 1))
+        key = f"presigned-url:{expire}:{window}:{name}"
+
+        url = self.get(key, now, min_remaining)
+        with self.lock:
+            if url is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if url is not None:
+            return url
+
+        url = storage.url(name)
+        self.set(key, url, now + expire, now, min_remaining)
+        return url
+
+    def get(self, key, now, min_remaining):
+        with self.lock:
+            entry = self.urls.get(key)
+            if entry is not None:
+                self.urls.move_to_end(key)
+
+        if entry is None and self.shared_cache is not None:
+            entry = self.shared_cache.get(key)
+            if entry is not None:
+                self.store(key, entry)
+
+        if entry is None:
+            return None
+        url, expires_at = entry
+        if expires_at - now < min_remaining:
+            return None
+        return url
+
+    def set(self, key, url, expires_at, now, min_remaining):
+        entry = (url, expires_at)
+        self.store(key, entry)
+        if self.shared_cache is not None:
+            self.shared_cache.set(key, entry, timeout=expires_at - now - min_remaining)
+
+    def store(self, key, entry):
+        with self.lock:
+            self.urls[key] = entry
+            self.urls.move_to_end(key)
+            while len(self.urls) > self.max_size:
+                self.urls.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.urls.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def get_stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.urls)}
+
+
+presigned_url_cache = PresignedUrlCache()
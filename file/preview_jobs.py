@@ -0,0 +1,185 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack, contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+
+from .models import FileBlob, FilePreview, FileSearchDocument
+from .previews import generate_preview
+
+
+def queue_file_preview(sha256):
+    """
+    Queue a preview of the content with this hash for the
+    ``generate_file_previews`` worker. Content that already has a preview,
+    or a queued or running job, is not queued again.
+    """
+    queue_file_previews([sha256])
+
+
+def queue_file_previews(sha256s):
+    """:func:`queue_file_preview` of several hashes in one query."""
+    FilePreview.objects.bulk_create(
+        [FilePreview(sha256=sha256) for sha256 in dict.fromkeys(sha256s)],
+        ignore_conflicts=True,
+    )
+
+
+def delete_file_preview(sha256):
+    """Delete the preview of content that is no longer stored, on commit."""
+    preview = FilePreview.objects.filter(sha256=sha256).first()
+    if preview is None:
+        return
+
+    storage, name = preview.thumbnail.storage, preview.thumbnail.name
+    preview.delete()
+    if name:
+        transaction.on_commit(lambda: storage.delete(name))
+
+
+def get_retry_delay(attempts):
+    # exponential backoff: base, 2 * base, 4 * base, ...
+    return settings.FILE_PREVIEW_RETRY_DELAY * 2 ** (attempts - 1)
+
+
+def claim_preview_jobs(batch_size):
+    """
+    Claim up to ``batch_size`` due preview jobs. A claimed job stays pending
+    but is not due again until its worker has had twice FILE_PREVIEW_TIMEOUT
+    to finish, so a crashed worker's jobs are picked up later and concurrent
+    workers never run the same job.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        previews = list(
+            FilePreview.objects.select_for_update(skip_locked=True)
+            .filter(status=FilePreview.STATUS_PENDING, next_attempt_at__lte=now)
+            .order_by("next_attempt_at", "id")[:batch_size]
+        )
+        for preview in previews:
+            preview.attempts += 1
+            preview.next_attempt_at = now + timedelta(
+                seconds=2 * settings.FILE_PREVIEW_TIMEOUT
+            )
+        FilePreview.objects.bulk_update(previews, ["attempts", "next_attempt_at"])
+    return previews
+
+
+@contextmanager
+def get_local_copy(field_file):
+    """Local path of a stored file, copied to a temporary file if needed."""
+    try:
+        path = field_file.path
+    except NotImplementedError:
+        path = None
+    if path is not None:
+        yield path
+        return
+
+    extension = os.path.splitext(field_file.name)[1]
+    with tempfile.NamedTemporaryFile(suffix=extension) as local_file:
+        with field_file.storage.open(field_file.name, "rb") as source:
+            shutil.copyfileobj(source, local_file, 64 * 1024)
+        local_file.flush()
+        yield local_file.name
+
+
+def get_process_pool(workers):
+    # spawned, not forked: workers inherit no database connections, S3
+    # clients or threads from this process
+    return ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    )
+
+
+def generate_pending_previews(batch_size=None, workers=None):
+    """
+    Generate one batch of due previews in a pool of ``workers`` processes.
+
+    Each job is limited to FILE_PREVIEW_TIMEOUT seconds. A failed job is
+    retried with exponential backoff and marked failed after
+    FILE_PREVIEW_MAX_ATTEMPTS attempts. A job also extracts the text of the
+    document for the search index (see ``file.search.index_files``).
+    Returns (ready, failed) counts.
+    """
+    batch_size = batch_size or settings.FILE_PREVIEW_BATCH_SIZE
+    workers = workers or settings.FILE_PREVIEW_WORKERS
+    ready = failed = 0
+
+    previews = claim_preview_jobs(batch_size)
+    if not previews:
+        return ready, failed
+
+    blobs = FileBlob.objects.in_bulk(
+        [preview.sha256 for preview in previews], field_name="sha256"
+    )
+    with ExitStack() as stack:
+        executor = stack.enter_context(get_process_pool(workers))
+        jobs = {}
+        for preview in previews:
+            blob = blobs.get(preview.sha256)
+            if blob is None:
+                # every file with this content was deleted in the meantime
+                delete_file_preview(preview.sha256)
+                continue
+            path = stack.enter_context(get_local_copy(blob.content))
+            job = executor.submit(
+                generate_preview,
+                path,
+                os.path.splitext(blob.content.name)[1].lower().lstrip("."),
+                settings.FILE_PREVIEW_TIMEOUT,
+                settings.FILE_PREVIEW_TEXT_LENGTH,
+                settings.FILE_PREVIEW_MAX_PART_SIZE,
+                settings.FILE_PREVIEW_SOFFICE,
+                settings.FILE_SEARCH_MAX_TEXT_LENGTH,
+            )
+            jobs[job] = preview
+
+        for job in as_completed(jobs):
+            preview = jobs[job]
+            try:
+                thumbnail, extension, text, search_text = job.result()
+            except Exception as e:
+                # PreviewError, or a pool process that died (BrokenProcessPool)
+                preview.last_error = repr(e)
+                if preview.attempts >= settings.FILE_PREVIEW_MAX_ATTEMPTS:
+                    preview.status = FilePreview.STATUS_FAILED
+                else:
+                    preview.next_attempt_at = timezone.now() + get_retry_delay(
+                        preview.attempts
+                    )
+                failed += 1
+            else:
+                if thumbnail is not None:
+                    preview.thumbnail.save(
+                        f"thumbnail{extension}", ContentFile(thumbnail), save=False
+                    )
+                preview.text = text
+                preview.status = FilePreview.STATUS_READY
+                preview.generated_at = timezone.now()
+                preview.last_error = ""
+                # every File with this content, indexed with an empty body
+                FileSearchDocument.objects.filter(
+                    file__content_sha256=preview.sha256
+                ).update(body=search_text, indexed_at=timezone.now())
+                ready += 1
+
+    FilePreview.objects.bulk_update(
+        list(jobs.values()),
+        [
+            "status",
+            "thumbnail",
+            "text",
+            "next_attempt_at",
+            "last_error",
+            "generated_at",
+        ],
+    )
+    return ready, failed
@@ -0,0 +1,325 @@
+import os
+import posixpath
+import signal
+import subprocess
+import tempfile
+import zipfile
+from contextlib import contextmanager
+from xml.etree import ElementTree
+
+# Preview and text extraction for pptx/docx/xlsx. This module runs in the
+# preview and search reindex pool processes, so it only uses the standard
+# library and must not touch Django settings, the database or storages:
+# every limit is passed in.
+
+RELATIONSHIPS_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+DOCUMENT_RELATIONSHIPS_NS = (
+    "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+)
+THUMBNAIL_RELATIONSHIP = (
+    "http://schemas.openxmlformats.org/package/2006/relationships/metadata/thumbnail"
+)
+WORDPROCESSING_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+DRAWING_NS = "http://schemas.openxmlformats.org/drawingml/2006/main"
+PRESENTATION_NS = "http://schemas.openxmlformats.org/presentationml/2006/main"
+SPREADSHEET_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+
+# thumbnails browsers can show; Office also writes EMF/WMF ones
+THUMBNAIL_EXTENSIONS = {".jpeg": ".jpeg", ".jpg": ".jpeg", ".png": ".png"}
+
+
+# raised by zipfile and ElementTree, or by a dangling reference in a package
+UNREADABLE_PACKAGE_ERRORS = (
+    zipfile.BadZipFile,
+    ElementTree.ParseError,
+    KeyError,
+    IndexError,
+    ValueError,
+)
+
+
+class PreviewError(Exception):
+    pass
+
+
+class PreviewTimeout(PreviewError):
+    pass
+
+
+@contextmanager
+def time_limit(seconds):
+    """
+    Raise PreviewTimeout in the block after ``seconds``. Uses SIGALRM, so it
+    only works in a process's main thread, which is where pool workers run
+    their jobs.
+    """
+
+    def on_alarm(signum, frame):
+        raise PreviewTimeout(f"preview took longer than {seconds}s")
+
+    previous_handler = signal.signal(signal.SIGALRM, on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+
+
+class LimitedReader:
+    """Readable that fails once more than ``limit`` bytes were read."""
+
+    def __init__(self, file_obj, limit):
+        self.file_obj = file_obj
+        self.remaining = limit
+
+    def read(self, size=-1):
+        data = self.file_obj.read(size)
+        self.remaining -= len(data)
+        if self.remaining < 0:
+            raise PreviewError("document part is too large to preview")
+        return data
+
+
+def generate_preview(
+    path, kind, timeout, text_length, max_part_size, soffice="", search_text_length=0
+):
+    """
+    Thumbnail, text snippet and searchable text of the document at ``path``.
+
+    The thumbnail is the one Office embeds in the package
+    (docProps/thumbnail.jpeg) or, when there is none and ``soffice`` names a
+    LibreOffice binary, the first page/slide/sheet rendered by it. The text
+    is the first ``text_length`` characters of the first page, slide or
+    sheet. The searchable text is the whole document up to
+    ``search_text_length`` characters (see :func:`extract_text`), "" when
+    that is 0. XML parts larger than ``max_part_size`` bytes are not read.
+
+    Returns ``(thumbnail_bytes, thumbnail_extension, text, search_text)``;
+    the thumbnail is ``(None, "")`` when there is none. Raises PreviewError.
+    """
+    with time_limit(timeout):
+        try:
+            with zipfile.ZipFile(path) as package:
+                thumbnail, extension = get_embedded_thumbnail(package, max_part_size)
+                text = get_text_snippet(package, kind, text_length, max_part_size)
+        except UNREADABLE_PACKAGE_ERRORS as e:
+            raise PreviewError(f"unreadable {kind} package: {e!r}")
+
+        search_text = ""
+        if search_text_length:
+            search_text = extract_text(path, kind, search_text_length, max_part_size)
+
+        if thumbnail is None and soffice:
+            thumbnail, extension = render_thumbnail(soffice, path, timeout)
+    return thumbnail, extension, text, search_text
+
+
+def read_xml(package, name, max_part_size):
+    with package.open(name) as part:
+        return ElementTree.parse(LimitedReader(part, max_part_size)).getroot()
+
+
+def iterparse_xml(package, name, max_part_size):
+    # streamed, so only the start of a large part is read
+    with package.open(name) as part:
+        yield from ElementTree.iterparse(LimitedReader(part, max_part_size))
+
+
+def get_relationship_targets(package, part_name, max_part_size):
+    """{relationship id: (type, part name)} of ``part_name``'s relationships."""
+    directory, base_name = posixpath.split(part_name)
+    rels_name = posixpath.join(directory, "_rels", f"{base_name}.rels")
+    root = read_xml(package, rels_name, max_part_size)
+
+    targets = {}
+    for relationship in root.iter(f"{{{RELATIONSHIPS_NS}}}Relationship"):
+        target = relationship.get("Target", "")
+        if target.startswith("/"):
+            target = target[1:]
+        else:
+            target = posixpath.normpath(posixpath.join(directory, target))
+        targets[relationship.get("Id")] = (relationship.get("Type"), target)
+    return targets
+
+
+def get_embedded_thumbnail(package, max_part_size):
+    try:
+        targets = get_relationship_targets(package, "", max_part_size)
+    except KeyError:
+        return None, ""
+
+    for relationship_type, target in targets.values():
+        extension = os.path.splitext(target)[1].lower()
+        if relationship_type != THUMBNAIL_RELATIONSHIP:
+            continue
+        if extension not in THUMBNAIL_EXTENSIONS or target not in package.namelist():
+            break
+        with package.open(target) as part:
+            thumbnail = LimitedReader(part, max_part_size).read()
+        return thumbnail, THUMBNAIL_EXTENSIONS[extension]
+    return None, ""
+
+
+def extract_text(path, kind, max_length, max_part_size):
+    """
+    Text of the whole document at ``path`` (every slide or sheet, in
+    order), read until ``max_length`` characters. Raises PreviewError.
+    """
+    try:
+        with zipfile.ZipFile(path) as package:
+            return join_texts(
+                iter_document_texts(package, kind, max_part_size), max_length
+            )
+    except UNREADABLE_PACKAGE_ERRORS as e:
+        raise PreviewError(f"unreadable {kind} package: {e!r}")
+
+
+def get_text_snippet(package, kind, text_length, max_part_size):
+    return join_texts(
+        iter_document_texts(package, kind, max_part_size, first_only=True),
+        text_length,
+    )
+
+
+def join_texts(texts, max_length):
+    # the parts are parsed lazily, so reading stops at max_length
+    words = []
+    length = 0
+    for text in texts:
+        text = " ".join(text.split())
+        if not text:
+            continue
+        words.append(text)
+        length += len(text) + 1
+        if length > max_length:
+            break
+    return " ".join(words)[:max_length]
+
+
+def iter_document_texts(package, kind, max_part_size, first_only=False):
+    """Text runs of the document, of its first slide or sheet only if asked."""
+    if kind == "docx":
+        yield from iter_element_texts(
+            package, "word/document.xml", f"{{{WORDPROCESSING_NS}}}t", max_part_size
+        )
+    elif kind == "pptx":
+        slide_names = get_slide_names(package, max_part_size)
+        for slide_name in slide_names[:1] if first_only else slide_names:
+            yield from iter_element_texts(
+                package, slide_name, f"{{{DRAWING_NS}}}t", max_part_size
+            )
+    elif kind == "xlsx":
+        sheet_names = get_sheet_names(package, max_part_size)
+        yield from iter_sheet_texts(
+            package, sheet_names[:1] if first_only else sheet_names, max_part_size
+        )
+    else:
+        raise PreviewError(f"no text extraction for {kind} files")
+
+
+def iter_element_texts(package, part_name, tag, max_part_size):
+    for _event, element in iterparse_xml(package, part_name, max_part_size):
+        if element.tag == tag and element.text:
+            yield element.text
+        # drop parsed content so long parts stay small in memory
+        element.clear()
+
+
+def get_part_names(package, part_name, list_tag, item_tag, max_part_size):
+    """Part names of the ``r:id`` items of a list, in document order."""
+    root = read_xml(package, part_name, max_part_size)
+    targets = get_relationship_targets(package, part_name, max_part_size)
+    return [
+        targets[item.get(f"{{{DOCUMENT_RELATIONSHIPS_NS}}}id")][1]
+        for item in root.iterfind(f"{list_tag}/{item_tag}")
+    ]
+
+
+def get_slide_names(package, max_part_size):
+    slide_names = get_part_names(
+        package,
+        "ppt/presentation.xml",
+        f"{{{PRESENTATION_NS}}}sldIdLst",
+        f"{{{PRESENTATION_NS}}}sldId",
+        max_part_size,
+    )
+    if not slide_names:
+        raise PreviewError("presentation has no slides")
+    return slide_names
+
+
+def get_sheet_names(package, max_part_size):
+    sheet_names = get_part_names(
+        package,
+        "xl/workbook.xml",
+        f"{{{SPREADSHEET_NS}}}sheets",
+        f"{{{SPREADSHEET_NS}}}sheet",
+        max_part_size,
+    )
+    if not sheet_names:
+        raise PreviewError("workbook has no sheets")
+    return sheet_names
+
+
+def iter_sheet_texts(package, sheet_names, max_part_size):
+    shared_strings = None
+    for sheet_name in sheet_names:
+        for _event, element in iterparse_xml(package, sheet_name, max_part_size):
+            if element.tag != f"{{{SPREADSHEET_NS}}}c":
+                continue
+            cell_type = element.get("t")
+            if cell_type == "inlineStr":
+                value = "".join(element.itertext())
+            else:
+                value = element.findtext(f"{{{SPREADSHEET_NS}}}v")
+                if value is not None and cell_type == "s":
+                    if shared_strings is None:
+                        shared_strings = read_shared_strings(package, max_part_size)
+                    value = shared_strings[int(value)]
+            element.clear()
+            if value:
+                yield value
+
+
+def read_shared_strings(package, max_part_size):
+    try:
+        root = read_xml(package, "xl/sharedStrings.xml", max_part_size)
+    except KeyError:
+        return []
+    return ["".join(item.itertext()) for item in root.iter(f"{{{SPREADSHEET_NS}}}si")]
+
+
+def render_thumbnail(soffice, path, timeout):
+    """First page as PNG, rendered by a headless LibreOffice (CPU only)."""
+    with tempfile.TemporaryDirectory() as output_dir:
+        # a profile per run, LibreOffice refuses to share one concurrently
+        profile = f"file://{os.path.join(output_dir, 'profile')}"
+        try:
+            subprocess.run(
+                [
+                    soffice,
+                    f"-env:UserInstallation={profile}",
+                    "--headless",
+                    "--norestore",
+                    "--convert-to",
+                    "png",
+                    "--outdir",
+                    output_dir,
+                    path,
+                ],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                timeout=timeout,
+                check=True,
+            )
+        except (OSError, subprocess.SubprocessError) as e:
+            raise PreviewError(f"LibreOffice could not render the document: {e!r}")
+
+        png_name = os.path.splitext(os.path.basename(path))[0] + ".png"
+        try:
+            with open(os.path.join(output_dir, png_name), "rb") as png:
+                return png.read(), ".png"
+        except FileNotFoundError:
+            raise PreviewError("LibreOffice did not write a thumbnail")
@@ -0,0 +1,291 @@
+import asyncio
+import re
+import uuid
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+
+RANGE_HEADER_PATTERN = re.compile(r"^bytes=\s*(.+)$", re.IGNORECASE)
+RANGE_SPEC_PATTERN = re.compile(r"^(\d*)\s*-\s*(\d*)$")
+
+
+def parse_range_header(header, size, max_ranges=16):
+    """
+    Parse a ``Range: bytes=...`` header into sorted, merged (start, end)
+    pairs with an inclusive end.
+
+    Return None when the header should be ignored (missing, malformed or
+    asking for too many ranges) and an empty list when no range overlaps the
+    file, which is a 416.
+    """
+    match = RANGE_HEADER_PATTERN.match(header or "")
+    if not match:
+        return None
+
+    specs = [spec.strip() for spec in match.group(1).split(",") if spec.strip()]
+    if not specs or len(specs) > max_ranges:
+        return None
+
+    ranges = []
+    for spec in specs:
+        spec_match = RANGE_SPEC_PATTERN.match(spec)
+        if not spec_match:
+            return None
+        first, last = spec_match.groups()
+
+        if not first:
+            # suffix range, the last N bytes
+            if not last:
+                return None
+            length = int(last)
+            if length == 0:
+                continue
+            start, end = max(size - length, 0), size - 1
+        else:
+            start = int(first)
+            if last and int(last) < start:
+                return None
+            end = min(int(last), size - 1) if last else size - 1
+
+        if start < size:
+            ranges.append((start, end))
+
+    # merge overlapping and adjacent ranges
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def if_range_passes(request, etag, last_modified):
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if not if_range:
+        return True
+
+    if if_range.startswith(('"', "W/")):
+        # weak validators never match for If-Range
+        return not if_range.startswith("W/") and parse_etags(if_range) == [etag]
+
+    if_range_date = parse_http_date_safe(if_range)
+    return if_range_date is not None and if_range_date == last_modified
+
+
+class RangedFileResponseBuilder:
+    """
+    Download response with validators, conditional GET and byte ranges.
+
+    Works on any Django storage: the file is opened through its FieldFile, so
+    nothing here relies on a local path. ``etag`` must be a strong,
+    already-quoted entity tag and ``last_modified`` a Unix timestamp.
+
+    With ``asynchronous=True`` bodies are async iterators for ASGI: each
+    block is read in a worker thread, so a slow client holds no thread
+    between reads.
+    """
+
+    block_size = 64 * 1024
+
+    def __init__(
+        self,
+        field_file,
+        etag,
+        last_modified,
+        content_type,
+        disposition,
+        asynchronous=False,
+    ):
+        self.field_file = field_file
+        self.etag = etag
+        self.last_modified = int(last_modified)
+        self.content_type = content_type
+        self.disposition = disposition
+        self.asynchronous = asynchronous
+
+    def get_response(self, request, full_response_factory, allow_ranges=True):
+        """
+        ``full_response_factory`` builds the 200 response. With
+        ``allow_ranges=False`` Range is left to whoever sends the body (e.g.
+        nginx after an X-Accel-Redirect).
+        """
+        not_modified_response = get_conditional_response(
+            request, etag=self.etag, last_modified=self.last_modified
+        )
+        if not_modified_response is not None:
+            return self.add_validators(not_modified_response)
+
+        ranges = None
+        if (
+            allow_ranges
+            and request.method in ("GET", "HEAD")
+            and "HTTP_RANGE" in request.META
+            and if_range_passes(request, self.etag, self.last_modified)
+        ):
+            size = self.field_file.size
+            ranges = parse_range_header(request.META["HTTP_RANGE"], size)
+
+        if ranges is None:
+            response = full_response_factory()
+            if not allow_ranges:
+                return self.add_validators(response)
+        elif not ranges:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+        elif len(ranges) == 1:
+            response = self.get_single_range_response(ranges[0], size)
+        else:
+            response = self.get_multi_range_response(ranges, size)
+
+        response["Accept-Ranges"] = "bytes"
+        return self.add_validators(response)
+
+    def add_validators(self, response):
+        response["ETag"] = self.etag
+        response["Last-Modified"] = http_date(self.last_modified)
+        return response
+
+    def get_full_response(self):
+        # what FileResponse sends, with a body that can be async
+        size = self.field_file.size
+        response = StreamingHttpResponse(
+            self.stream([(b"", (0, size - 1))]),
+            content_type=self.content_type,
+        )
+        response["Content-Length"] = str(size)
+        response["Content-Disposition"] = self.disposition
+        return response
+
+    def get_single_range_response(self, byte_range, size):
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            self.stream([(b"", byte_range)]),
+            status=206,
+            content_type=self.content_type,
+        )
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response["Content-Length"] = str(end - start + 1)
+        response["Content-Disposition"] = self.disposition
+        return response
+
+    def get_multi_range_response(self, ranges, size):
+        boundary = uuid.uuid4().hex
+        parts = []
+        for index, (start, end) in enumerate(ranges):
+            part_header = (
+                # every part but the first starts on a new line
+                ("\r\n" if index else "") + f"--{boundary}\r\n"
+                f"Content-Type: {self.content_type}\r\n"
+                f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+            ).encode()
+            parts.append((part_header, (start, end)))
+        closing = f"\r\n--{boundary}--\r\n".encode()
+
+        content_length = len(closing) + sum(
+            len(header) + (end - start + 1) for header, (start, end) in parts
+        )
+
+        response = StreamingHttpResponse(
+            self.stream(parts, closing),
+            status=206,
+            content_type=f"multipart/byteranges; boundary={boundary}",
+        )
+        response["Content-Length"] = str(content_length)
+        response["Content-Disposition"] = self.disposition
+        return response
+
+    def stream(self, parts, closing=b""):
+        """Body made of (prefix, byte range) parts followed by ``closing``."""
+        if self.asynchronous:
+            return self.aiter_parts(parts, closing)
+        return self.iter_parts(parts, closing)
+
+    def iter_parts(self, parts, closing):
+        with self.field_file.storage.open(self.field_file.name, "rb") as file_obj:
+            for prefix, byte_range in parts:
+                if prefix:
+                    yield prefix
+                yield from self.read_range(file_obj, byte_range)
+        if closing:
+            yield closing
+
+    async def aiter_parts(self, parts, closing):
+        file_obj = await asyncio.to_thread(
+            self.field_file.storage.open, self.field_file.name, "rb"
+        )
+        try:
+            for prefix, byte_range in parts:
+                if prefix:
+                    yield prefix
+                blocks = self.read_range(file_obj, byte_range)
+                while True:
+                    data = await asyncio.to_thread(next, blocks, None)
+                    if data is None:
+                        break
+                    yield data
+        finally:
+            await asyncio.to_thread(file_obj.close)
+        if closing:
+            yield closing
+
+    def read_range(self, file_obj, byte_range):
+        start, end = byte_range
+        file_obj.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = file_obj.read(min(self.block_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+class ClosingStream:
+    """
+    Streaming body that calls ``on_close`` once when it is closed: a
+    response closes its streaming content when the server closes the
+    response, after the last byte or when the client went away.
+    """
+
+    def __init__(self, content, on_close):
+        self.content = content
+        self.on_close = on_close
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.content)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.on_close()
+
+
+class AsyncClosingStream(ClosingStream):
+    """:class:`ClosingStream` of an asynchronous body."""
+
+    __iter__ = None
+
+    def __aiter__(self):
+        return self.content.__aiter__()
+
+
+def call_on_close(response, func):
+    """
+    Call ``func()`` once ``response`` has been sent: when the server closes
+    it for a streaming response, at once for others, whose body is already
+    complete. Returns the response.
+    """
+    if not response.streaming:
+        func()
+        return response
+
+    # a FileResponse's file is still handed to wsgi.file_wrapper (sendfile)
+    file_to_stream = getattr(response, "file_to_stream", None)
+    stream_class = AsyncClosingStream if response.is_async else ClosingStream
+    response.streaming_content = stream_class(response.streaming_content, func)
+    if file_to_stream is not None:
+        response.file_to_stream = file_to_stream
+    return response
@@ -0,0 +1,204 @@
+import logging
+import os
+import re
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import NotSupportedError, connection
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+
+from .models import File, FileSearchDocument
+from .preview_jobs import get_local_copy, get_process_pool
+from .previews import PreviewError, extract_text
+
+logger = logging.getLogger(__name__)
+
+# PostgreSQL text search configuration of the search_vector column; the
+# SQLite index uses the matching porter stemmer
+SEARCH_CONFIG = "english"
+FTS_TABLE = "file_search_fts"
+# title matches count ten times as much as body matches
+TITLE_WEIGHT = 10.0
+
+SEARCH_WORD_PATTERN = re.compile(r"\w+")
+
+
+def get_search_title(file_obj):
+    return " ".join(filter(None, [file_obj.file_name, file_obj.original_name]))
+
+
+def get_kind(field_file):
+    return os.path.splitext(field_file.name)[1].lower().lstrip(".")
+
+
+def index_file(file_obj):
+    """
+    Add a new File to the search index. Nothing is parsed here: the body is
+    the text already indexed for another File with the same content, or
+    empty until the preview job of the content (queued with the File, see
+    ``file.preview_jobs``) extracts it under FILE_PREVIEW_TIMEOUT.
+    """
+    return index_files([file_obj])[0]
+
+
+def index_files(file_objs):
+    """:func:`index_file` of several new Files in two queries."""
+    sha256s = {file_obj.content_sha256 for file_obj in file_objs} - {""}
+    bodies = {}
+    if sha256s:
+        for sha256, body in FileSearchDocument.objects.filter(
+            file__content_sha256__in=sha256s
+        ).values_list("file__content_sha256", "body"):
+            bodies.setdefault(sha256, body)
+
+    search_documents = [
+        FileSearchDocument(
+            file=file_obj,
+            title=get_search_title(file_obj),
+            body=bodies.get(file_obj.content_sha256, ""),
+        )
+        for file_obj in file_objs
+    ]
+
+    return FileSearchDocument.objects.bulk_create(
+        search_documents,
+        update_conflicts=True,
+        unique_fields=["file"],
+        update_fields=["title", "body", "indexed_at"],
+    )
+
+
+def update_search_title(file_obj):
+    """Index the current names of a File that was renamed."""
+    FileSearchDocument.objects.filter(file=file_obj).update(
+        title=get_search_title(file_obj)
+    )
+
+
+def search_files(query):
+    """
+    FileSearchDocuments matching ``query``, best first, with their File
+    selected and a ``rank`` attribute (higher is better).
+    """
+    if connection.vendor == "postgresql":
+        # needs psycopg, only installed with PostgreSQL
+        from django.contrib.postgres.search import (
+            SearchQuery,
+            SearchRank,
+            SearchVectorField,
+        )
+
+        # the generated column is not a model field, see migration 0007
+        search_vector = RawSQL(
+            f"{FileSearchDocument._meta.db_table}.search_vector",
+            [],
+            output_field=SearchVectorField(),
+        )
+        search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type="websearch")
+        documents = (
+            FileSearchDocument.objects.alias(search_vector=search_vector)
+            .filter(search_vector=search_query)
+            .annotate(rank=SearchRank(search_vector, search_query, cover_density=True))
+        )
+    elif connection.vendor == "sqlite":
+        match = get_fts_query(query)
+        if not match:
+            return FileSearchDocument.objects.none()
+        # FTS5 rowids are the file_ids (content_rowid)
+        file_id_column = (
+            f"{FileSearchDocument._meta.db_table}."
+            f"{FileSearchDocument._meta.pk.column}"
+        )
+        documents = FileSearchDocument.objects.filter(
+            pk__in=RawSQL(
+                f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match]
+            )
+        ).annotate(
+            rank=RawSQL(
+                f"SELECT -bm25({FTS_TABLE}, {TITLE_WEIGHT}, 1.0) FROM {FTS_TABLE} "
+                f"WHERE {FTS_TABLE} MATCH %s AND rowid = {file_id_column}",
+                [match],
+                output_field=FloatField(),
+            )
+        )
+    else:
+        raise NotSupportedError(f"no full-text search on {connection.vendor}")
+
+    return documents.select_related("file").order_by("-rank", "-file_id")
+
+
+def get_fts_query(query):
+    # every word must match; quoting keeps FTS5 syntax out of user input
+    return " ".join(f'"{word}"' for word in SEARCH_WORD_PATTERN.findall(query))
+
+
+def reindex_files(batch_size=None, workers=None):
+    """
+    Rebuild the search document of every File, extracting text in a pool
+    of ``workers`` processes, ``batch_size`` files at a time. Each stored
+    document is parsed once however many Files share it. Returns the
+    number of Files indexed.
+    """
+    batch_size = batch_size or settings.FILE_SEARCH_REINDEX_BATCH_SIZE
+    workers = workers or settings.FILE_SEARCH_REINDEX_WORKERS
+    indexed = 0
+    last_id = 0
+
+    with get_process_pool(workers) as pool:
+        while True:
+            file_objs = list(
+                File.objects.filter(id__gt=last_id).order_by("id")[:batch_size]
+            )
+            if not file_objs:
+                break
+            last_id = file_objs[-1].id
+
+            # one parse per stored document
+            files_by_name = defaultdict(list)
+            for file_obj in file_objs:
+                files_by_name[file_obj.file_content.name].append(file_obj)
+
+            with ExitStack() as stack:
+                jobs = {}
+                for name, same_files in files_by_name.items():
+                    field_file = same_files[0].file_content
+                    if not name:
+                        continue
+                    # S3 documents are copied to temporary files for the batch
+                    path = stack.enter_context(get_local_copy(field_file))
+                    jobs[name] = pool.submit(
+                        extract_text,
+                        path,
+                        get_kind(field_file),
+                        settings.FILE_SEARCH_MAX_TEXT_LENGTH,
+                        settings.FILE_PREVIEW_MAX_PART_SIZE,
+                    )
+                bodies = {name: get_job_text(job, name) for name, job in jobs.items()}
+            bodies.setdefault("", "")
+
+            FileSearchDocument.objects.bulk_create(
+                [
+                    FileSearchDocument(
+                        file=file_obj,
+                        title=get_search_title(file_obj),
+                        body=bodies[file_obj.file_content.name],
+                    )
+                    for file_obj in file_objs
+                ],
+                update_conflicts=True,
+                unique_fields=["file"],
+                update_fields=["title", "body", "indexed_at"],
+            )
+            indexed += len(file_objs)
+
+    return indexed
+
+
+def get_job_text(job, name):
+    try:
+        return job.result()
+    except (PreviewError, OSError) as e:
+        logger.warning("could not extract text of %s: %r", name, e)
+        return ""
@@ -1,10 +1,39 @@
-import boto3
+import hashlib
+import json
+import mimetypes
+import os
+import sys
+import uuid
+from collections import Counter
+from urllib.parse import quote
+
 from django.conf import settings
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.http import FileResponse, HttpResponse
+from django.utils import timezone
+from django.utils.http import content_disposition_header
 
-from .models import File
+from .list_cache import file_list_cache
+from .models import File, FileBlob, FileBundle
+from .presigned_urls import presigned_url_cache
+from .preview_jobs import (
+    delete_file_preview,
+    queue_file_preview,
+    queue_file_previews,
+)
+from .responses import RangedFileResponseBuilder
+from .search import index_file, index_files
 
 
 class FilePreSignedUrlService:
+    """
+    Time-limited download URL from the file's storage backend: a presigned
+    GET URL on S3 (valid for AWS_QUERYSTRING_EXPIRE seconds, reused from
+    presigned_url_cache while enough of that is left), the media URL on
+    local disk.
+    """
+
     class UnsupportedTypeException(Exception):
         pass
 
@@ -12,7 +41,7 @@ class FilePreSignedUrlService:
         self,
         file_obj: File,
     ):
-        if file_obj.file_content is None:
+        if not file_obj.file_content:
             raise self.UnsupportedTypeException("UnsupportedMediaTypeException")
 
         file_format = file_obj.file_content.name.split(".")[-1]
@@ -21,16 +50,380 @@ class FilePreSignedUrlService:
         if file_format.lower() not in allowed_extensions:
             raise self.UnsupportedTypeException("UnsupportedMediaTypeException")
 
-        self.file_name = f"/media/private/uploads/f{file_obj.id}.{file_format}"
+        self.file_content = file_obj.file_content
 
     def generate_presigned_download_url_config(self):
-        s3 = boto3.client("s3")
+        storage = self.file_content.storage
+        expire = getattr(storage, "querystring_expire", None)
+        if expire is None:
+            # unsigned (local media) URLs cost nothing to build
+            return self.file_content.url
+        return presigned_url_cache.get_url(storage, self.file_content.name, expire)
+
+
+class FileDownloadService:
+    """
+    Builds the download response for a file.
+
+    In the default "django" mode the worker streams the file itself, with
+    Range support. In the "x-accel-redirect" (nginx) and "x-sendfile"
+    (Apache, lighttpd) modes the response only carries an internal redirect
+    header and the front proxy sends the file (and handles Range) with
+    sendfile(2), so the worker is free right away.
+
+    Every mode sends ETag / Last-Modified and answers If-None-Match /
+    If-Modified-Since with a 304 before touching the file. Files on a
+    storage without local paths (S3) are always streamed by the worker.
+    """
+
+    DJANGO = "django"
+    X_ACCEL_REDIRECT = "x-accel-redirect"
+    X_SENDFILE = "x-sendfile"
+
+    def __init__(self, file_obj: File):
+        self.file_obj = file_obj
+        # blobs are stored under their hash, the name comes from the upload
+        self.filename = file_obj.original_name or os.path.basename(
+            file_obj.file_content.name
+        )
+
+        content_type, encoding = mimetypes.guess_type(self.filename)
+        if not content_type or encoding:
+            content_type = "application/octet-stream"
+        self.content_type = content_type
+
+    def get_etag(self):
+        if self.file_obj.content_sha256:
+            return f'"{self.file_obj.content_sha256}"'
+
+        # older rows have no stored hash, fall back to size + mtime
+        field_file = self.file_obj.file_content
+        try:
+            modified_time = field_file.storage.get_modified_time(field_file.name)
+        except NotImplementedError:
+            modified_time = self.file_obj.upload_timestamp
+        return f'"{field_file.size:x}-{int(modified_time.timestamp()):x}"'
+
+    def get_mode(self):
+        # the front proxy can only send files it can read from local disk
+        try:
+            self.file_obj.file_content.path
+        except NotImplementedError:
+            return self.DJANGO
+        return settings.FILE_DOWNLOAD_MODE
+
+    def get_response(self, request, asynchronous=False):
+        """
+        With ``asynchronous=True`` the body is an async iterator (for ASGI);
+        building the response still stats the file, so call it from a
+        worker thread.
+        """
+        mode = self.get_mode()
+
+        builder = RangedFileResponseBuilder(
+            self.file_obj.file_content,
+            etag=self.get_etag(),
+            last_modified=self.file_obj.upload_timestamp.timestamp(),
+            content_type=self.content_type,
+            disposition=content_disposition_header(False, self.filename),
+            asynchronous=asynchronous,
+        )
+        return builder.get_response(
+            request,
+            lambda: self.get_full_response(mode, builder),
+            allow_ranges=mode == self.DJANGO,
+        )
+
+    def get_full_response(self, mode, builder):
+        if mode == self.X_ACCEL_REDIRECT:
+            location = settings.FILE_DOWNLOAD_ACCEL_PREFIX.rstrip("/") + "/"
+            return self.get_internal_redirect_response(
+                "X-Accel-Redirect", location + quote(self.file_obj.file_content.name)
+            )
+
+        if mode == self.X_SENDFILE:
+            # a filesystem path, not a URI: sent as its raw bytes (Django
+            # would MIME-encode a str that is not latin-1)
+            return self.get_internal_redirect_response(
+                "X-Sendfile", os.fsencode(self.file_obj.file_content.path)
+            )
+
+        if builder.asynchronous:
+            return builder.get_full_response()
+        return FileResponse(
+            self.file_obj.file_content.open("rb"), filename=self.filename
+        )
+
+    def get_internal_redirect_response(self, header, value):
+        # same Content-Type / Content-Disposition FileResponse would send; the
+        # proxy keeps them and adds the body, length and range handling
+        response = HttpResponse(content_type=self.content_type)
+        response[header] = value
+        response["Content-Disposition"] = content_disposition_header(
+            False, self.filename
+        )
+        return response
+
+
+def get_sha256(file_obj):
+    # hash in chunks, the file may be far larger than memory
+    sha256 = hashlib.sha256()
+    file_obj.seek(0)
+    for chunk in iter(lambda: file_obj.read(64 * 1024), b""):
+        sha256.update(chunk)
+    file_obj.seek(0)
+    return sha256.hexdigest()
+
+
+def acquire_file_blob(file_content, sha256):
+    """
+    Take a reference on the blob holding these bytes, storing them first if
+    no File has uploaded them yet. Returns the FileBlob.
+    """
+    with transaction.atomic():
+        # the UPDATE also locks the row against a concurrent release
+        if FileBlob.objects.filter(sha256=sha256).update(ref_count=F("ref_count") + 1):
+            return FileBlob.objects.get(sha256=sha256)
+
+        blob = FileBlob(sha256=sha256, size=file_content.size, ref_count=1)
+        blob.content.save(file_content.name, file_content, save=False)
+        try:
+            with transaction.atomic():
+                blob.save()
+        except IntegrityError:
+            # stored by a concurrent upload of the same bytes in the meantime
+            blob.content.delete(save=False)
+            FileBlob.objects.filter(sha256=sha256).update(ref_count=F("ref_count") + 1)
+            return FileBlob.objects.get(sha256=sha256)
+        return blob
 
-        # Generate presigned URL for video download
-        presigned_url_config = s3.generate_presigned_url(
-            ClientMethod="get_object",
-            Params={"Bucket": settings.AWS_STORAGE_BUCKET_NAME, "Key": self.file_name},
-            ExpiresIn=3600,  # URL will expire in 1 hour (3600 seconds)
+
+def acquire_file_blobs(uploads):
+    """
+    :func:`acquire_file_blob` of a list of (file_content, sha256) uploads in
+    a few queries whatever their number. Returns the FileBlobs by hash.
+    """
+    reference_counts = Counter(sha256 for _file_content, sha256 in uploads)
+    with transaction.atomic():
+        FileBlob.objects.filter(sha256__in=reference_counts).update(
+            ref_count=F("ref_count")
+            + Case(
+                *[
+                    When(sha256=sha256, then=Value(count))
+                    for sha256, count in reference_counts.items()
+                ],
+                default=Value(0),
+            )
+        )
+        blobs = FileBlob.objects.in_bulk(list(reference_counts), field_name="sha256")
+
+        new_blobs = {}
+        for file_content, sha256 in uploads:
+            if sha256 in blobs or sha256 in new_blobs:
+                continue
+            blob = FileBlob(
+                sha256=sha256,
+                size=file_content.size,
+                ref_count=reference_counts[sha256],
+            )
+            blob.content.save(file_content.name, file_content, save=False)
+            new_blobs[sha256] = blob
+        if not new_blobs:
+            return blobs
+
+        try:
+            with transaction.atomic():
+                FileBlob.objects.bulk_create(new_blobs.values())
+        except IntegrityError:
+            # some were stored by concurrent uploads in the meantime, take
+            # them one at a time
+            for blob in new_blobs.values():
+                blob.content.delete(save=False)
+            for file_content, sha256 in uploads:
+                if sha256 not in blobs:
+                    blobs[sha256] = acquire_file_blob(file_content, sha256)
+                    FileBlob.objects.filter(sha256=sha256).update(
+                        ref_count=F("ref_count") + reference_counts[sha256] - 1
+                    )
+            return blobs
+
+        if not connection_returns_ids(FileBlob):
+            blob_ids = dict(
+                FileBlob.objects.filter(sha256__in=new_blobs).values_list(
+                    "sha256", "id"
+                )
+            )
+            for sha256, blob in new_blobs.items():
+                blob.id = blob_ids[sha256]
+        return {**blobs, **new_blobs}
+
+
+def release_file_blob(blob_id):
+    """
+    Drop a reference on a blob; the last one deletes the row and, once the
+    transaction commits, the stored file.
+    """
+    FileBlob.objects.filter(id=blob_id).update(ref_count=F("ref_count") - 1)
+    blob = FileBlob.objects.filter(id=blob_id, ref_count=0).first()
+    if blob is None:
+        return
+
+    storage, name = blob.content.storage, blob.content.name
+    blob.delete()
+    transaction.on_commit(lambda: storage.delete(name))
+    delete_file_preview(blob.sha256)
+
+
+def adopt_file_blob(name, sha256, size):
+    """
+    Like :func:`acquire_file_blob` for bytes already written to storage
+    under ``name`` (a direct upload). If the same bytes were stored before,
+    the new copy is deleted once the transaction commits.
+    """
+    with transaction.atomic():
+        if not FileBlob.objects.filter(sha256=sha256).update(
+            ref_count=F("ref_count") + 1
+        ):
+            blob = FileBlob(sha256=sha256, size=size, ref_count=1)
+            blob.content.name = name
+            try:
+                with transaction.atomic():
+                    blob.save()
+                return blob
+            except IntegrityError:
+                FileBlob.objects.filter(sha256=sha256).update(
+                    ref_count=F("ref_count") + 1
+                )
+
+        blob = FileBlob.objects.get(sha256=sha256)
+        if blob.content.name != name:
+            storage = blob.content.storage
+            transaction.on_commit(lambda: storage.delete(name))
+        return blob
+
+
+def create_blob_file(user_id, file_name, blob, original_name, file_identifier=None):
+    file_obj = File.objects.create(
+        user_id=user_id,
+        file_name=file_name,
+        file_content=blob.content.name,
+        file_identifier=file_identifier or str(uuid.uuid4()),
+        content_sha256=blob.sha256,
+        blob=blob,
+        original_name=original_name,
+    )
+    queue_file_preview(blob.sha256)
+    index_file(file_obj)
+    return file_obj
+
+
+def create_deduplicated_file(user_id, file_name, file_content, sha256):
+    """Create a File whose bytes are shared with earlier identical uploads."""
+    with transaction.atomic():
+        blob = acquire_file_blob(file_content, sha256)
+        return create_blob_file(
+            user_id, file_name, blob, os.path.basename(file_content.name)
+        )
+
+
+def create_deduplicated_files(user_id, uploads):
+    """
+    :func:`create_deduplicated_file` of a list of (file_name, file_content,
+    sha256) uploads in one transaction, with a constant number of queries:
+    the blobs and the Files are inserted with one ``bulk_create`` each.
+    Returns the Files, in upload order.
+    """
+    with transaction.atomic():
+        blobs = acquire_file_blobs(
+            [(file_content, sha256) for _file_name, file_content, sha256 in uploads]
         )
+        file_objs = [
+            File(
+                user_id=user_id,
+                file_name=file_name,
+                file_content=blobs[sha256].content.name,
+                file_identifier=str(uuid.uuid4()),
+                content_sha256=sha256,
+                blob=blobs[sha256],
+                original_name=os.path.basename(file_content.name),
+            )
+            for file_name, file_content, sha256 in uploads
+        ]
+        File.objects.bulk_create(file_objs)
+        # bulk_create sends no post_save
+        file_list_cache.invalidate()
+        if not connection_returns_ids(File):
+            file_ids = dict(
+                File.objects.filter(
+                    file_identifier__in=[
+                        file_obj.file_identifier for file_obj in file_objs
+                    ]
+                ).values_list("file_identifier", "id")
+            )
+            for file_obj in file_objs:
+                file_obj.id = file_ids[file_obj.file_identifier]
+
+        queue_file_previews(blobs)
+        index_files(file_objs)
+        return file_objs
+
+
+def get_file_bundle(file_identifiers):
+    """
+    The FileBundle of these identifiers, in this order; identical lists
+    share one bundle. A bundle past half of FILE_BUNDLE_EXPIRY is renewed,
+    so a link to it stays valid for at least half of that.
+    """
+    file_identifiers = list(file_identifiers)
+    bundle_obj, created = FileBundle.objects.get_or_create(
+        identifiers_sha256=hashlib.sha256(
+            json.dumps(file_identifiers).encode()
+        ).hexdigest(),
+        defaults={"file_identifiers": file_identifiers},
+    )
+    now = timezone.now()
+    if not created and bundle_obj.created_at < now - settings.FILE_BUNDLE_EXPIRY / 2:
+        FileBundle.objects.filter(id=bundle_obj.id).update(created_at=now)
+    return bundle_obj
+
+
+def connection_returns_ids(model):
+    # bulk_create sets primary keys where the backend returns them (not MySQL)
+    return connections[
+        router.db_for_write(model)
+    ].features.can_return_rows_from_bulk_insert
+
+
+def get_name_prefix_filter(prefix):
+    """
+    ``file_name`` starts with ``prefix`` (case sensitive). The range lets a
+    plain b-tree index on file_name find the rows; a LIKE alone can only use
+    PostgreSQL pattern-ops indexes.
+    """
+    name_filter = Q(file_name__startswith=prefix, file_name__gte=prefix)
+    if ord(prefix[-1]) < sys.maxunicode:
+        name_filter &= Q(file_name__lt=prefix[:-1] + chr(ord(prefix[-1]) + 1))
+    return name_filter
+
+
+def filter_files(
+    queryset, user=None, uploaded_after=None, uploaded_before=None, name_prefix=None
+):
+    """
+    Listing filters; each one is served by an index on File (see its Meta),
+    alone or together with ``user``.
+    """
+    if user is not None:
+        queryset = queryset.filter(user_id=user)
+    if uploaded_after is not None:
+        queryset = queryset.filter(upload_timestamp__gte=uploaded_after)
+    if uploaded_before is not None:
+        queryset = queryset.filter(upload_timestamp__lt=uploaded_before)
+    if name_prefix:
+        queryset = queryset.filter(get_name_prefix_filter(name_prefix))
+    return queryset
+
 
-        return presigned_url_config
+def is_date_range(filters):
+    # see FILE_LIST_DATE_RANGE_ORDERINGS
+    return bool({"uploaded_after", "uploaded_before"} & filters.keys())
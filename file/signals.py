@@ -0,0 +1,32 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .list_cache import file_list_cache
+from .models import File
+from .search import update_search_title
+from .services import release_file_blob
+
+
+@receiver(post_delete, sender=File)
+def release_deleted_file_blob(sender, instance, **kwargs):
+    # also runs for queryset deletes and cascades (e.g. a deleted user)
+    if instance.blob_id is not None:
+        release_file_blob(instance.blob_id)
+
+
+@receiver(post_save, sender=File)
+def update_renamed_file_search_title(
+    sender, instance, created, update_fields, **kwargs
+):
+    # new Files are indexed by their creator (see file.search.index_files)
+    if created:
+        return
+    if update_fields is None or {"file_name", "original_name"} & set(update_fields):
+        update_search_title(instance)
+
+
+@receiver(post_save, sender=File)
+@receiver(post_delete, sender=File)
+def invalidate_file_list_cache(sender, **kwargs):
+    # bulk_create sends no signal, its callers invalidate themselves
+    file_list_cache.invalidate()
@@ -0,0 +1,264 @@
+import base64
+import mimetypes
+import posixpath
+import threading
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.core.files.base import File
+from django.core.files.storage import FileSystemStorage, Storage
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+from standard.timing import timed
+
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+
+def get_s3_client():
+    """
+    Process-wide S3 client. Creating a client is costly (it loads the
+    service model and resolves credentials) and clients are thread safe, so
+    every request shares one, and with it one connection pool. It is built
+    on first use, i.e. after the worker has forked.
+    """
+    global _s3_client
+    if _s3_client is None:
+        with _s3_client_lock:
+            if _s3_client is None:
+                _s3_client = boto3.session.Session().client(
+                    "s3",
+                    endpoint_url=settings.AWS_S3_ENDPOINT_URL,
+                    region_name=settings.AWS_S3_REGION_NAME,
+                    config=Config(
+                        max_pool_connections=settings.AWS_S3_MAX_POOL_CONNECTIONS
+                    ),
+                )
+    return _s3_client
+
+
+class S3File(File):
+    """
+    Read-only, seekable file object over an S3 object.
+
+    Sequential reads share one GET; a seek starts a new ranged GET on the
+    next read, so byte-range downloads only fetch what they send.
+    """
+
+    def __init__(self, storage, name):
+        self.storage = storage
+        self.name = name
+        self.file = None
+        self.position = 0
+        self._closed = False
+
+    @property
+    def size(self):
+        if not hasattr(self, "_size"):
+            self._size = self.storage.size(self.name)
+        return self._size
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def open(self, mode=None):
+        self._closed = False
+        self.seek(0)
+        return self
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.position
+        elif whence == 2:
+            offset += self.size
+        if offset != self.position:
+            self.close_body()
+            self.position = offset
+        return self.position
+
+    def read(self, size=-1):
+        if self.file is None:
+            if self.position >= self.size:
+                return b""
+            extra_args = {}
+            if self.position:
+                extra_args["Range"] = f"bytes={self.position}-"
+            self.file = self.storage.get_object(self.name, **extra_args)["Body"]
+
+        data = self.file.read() if size is None or size < 0 else self.file.read(size)
+        self.position += len(data)
+        return data
+
+    def close_body(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def close(self):
+        self.close_body()
+        self._closed = True
+
+
+@deconstructible
+class S3Storage(Storage):
+    """
+    Storage backend for S3 and S3-compatible object stores (MinIO, Ceph...).
+
+    ``url()`` returns a presigned GET URL valid for ``querystring_expire``
+    seconds. There is no local ``path()``, so downloads are streamed from
+    the bucket through the worker.
+    """
+
+    def __init__(
+        self, bucket_name=None, location=None, querystring_expire=None, client=None
+    ):
+        self.bucket_name = bucket_name or settings.AWS_STORAGE_BUCKET_NAME
+        self.location = settings.AWS_LOCATION if location is None else location
+        self.querystring_expire = querystring_expire or settings.AWS_QUERYSTRING_EXPIRE
+        self._client = client
+
+    @property
+    def client(self):
+        return self._client or get_s3_client()
+
+    def get_key(self, name):
+        return posixpath.join(self.location, name) if self.location else name
+
+    # every call that reaches S3 is added to the request's storage timing;
+    # reading an object's body is not (it is streamed after the response)
+    def get_object(self, name, **extra_args):
+        with timed("storage"):
+            return self.client.get_object(
+                Bucket=self.bucket_name, Key=self.get_key(name), **extra_args
+            )
+
+    def head_object(self, name, **extra_args):
+        with timed("storage"):
+            return self.client.head_object(
+                Bucket=self.bucket_name, Key=self.get_key(name), **extra_args
+            )
+
+    def _open(self, name, mode="rb"):
+        if "w" in mode or "a" in mode or "+" in mode:
+            raise ValueError("S3 files can only be written with save().")
+        return S3File(self, name)
+
+    def _save(self, name, content):
+        if hasattr(content, "seek"):
+            content.seek(0)
+        content_type = (
+            getattr(content, "content_type", None)
+            or mimetypes.guess_type(name)[0]
+            or "application/octet-stream"
+        )
+        with timed("storage"):
+            self.client.upload_fileobj(
+                content,
+                self.bucket_name,
+                self.get_key(name),
+                ExtraArgs={"ContentType": content_type},
+            )
+        return name
+
+    def delete(self, name):
+        with timed("storage"):
+            self.client.delete_object(Bucket=self.bucket_name, Key=self.get_key(name))
+
+    def exists(self, name):
+        try:
+            self.head_object(name)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    def size(self, name):
+        return self.head_object(name)["ContentLength"]
+
+    def get_modified_time(self, name):
+        modified_time = self.head_object(name)["LastModified"]
+        if settings.USE_TZ:
+            return modified_time
+        return timezone.make_naive(modified_time)
+
+    def url(self, name, expire=None):
+        return self.client.generate_presigned_url(
+            ClientMethod="get_object",
+            Params={"Bucket": self.bucket_name, "Key": self.get_key(name)},
+            ExpiresIn=expire or self.querystring_expire,
+        )
+
+    def get_presigned_post(self, name, content_type, size, sha256, expire=None):
+        """
+        Presigned POST policy for a direct browser/client upload of exactly
+        ``size`` bytes of ``content_type`` to ``name``. S3 rejects the upload
+        unless its SHA-256 matches the hex digest ``sha256``. Returns
+        ``{"url": ..., "fields": {...}}``.
+        """
+        fields = {
+            "Content-Type": content_type,
+            "x-amz-checksum-algorithm": "SHA256",
+            "x-amz-checksum-sha256": base64.b64encode(bytes.fromhex(sha256)).decode(),
+        }
+        conditions = [{field: value} for field, value in fields.items()]
+        conditions.append(["content-length-range", size, size])
+        return self.client.generate_presigned_post(
+            Bucket=self.bucket_name,
+            Key=self.get_key(name),
+            Fields=fields,
+            Conditions=conditions,
+            ExpiresIn=expire or self.querystring_expire,
+        )
+
+    def get_sha256(self, name):
+        """
+        Hex SHA-256 that S3 verified when the object was uploaded, None if
+        it was stored without one (or as a multipart composite checksum).
+        """
+        head = self.head_object(name, ChecksumMode="ENABLED")
+        checksum = head.get("ChecksumSHA256")
+        if not checksum or "-" in checksum:
+            return None
+        return base64.b64decode(checksum).hex()
+
+
+class TimedFileSystemStorage(FileSystemStorage):
+    """FileSystemStorage whose calls are added to the request's storage timing."""
+
+    def _open(self, name, mode="rb"):
+        with timed("storage"):
+            return super()._open(name, mode)
+
+    def _save(self, name, content):
+        with timed("storage"):
+            return super()._save(name, content)
+
+    def delete(self, name):
+        with timed("storage"):
+            return super().delete(name)
+
+    def exists(self, name):
+        with timed("storage"):
+            return super().exists(name)
+
+    def size(self, name):
+        with timed("storage"):
+            return super().size(name)
+
+    def get_modified_time(self, name):
+        with timed("storage"):
+            return super().get_modified_time(name)
@@ -0,0 +1,224 @@
+import io
+import os
+import zipfile
+
+from django.core.files.storage import FileSystemStorage
+from django.db import models
+from django.utils import timezone
+from django.utils.encoding import filepath_to_uri
+from rest_framework import ISO_8601, serializers
+from rest_framework.compat import LONG_SEPARATORS, SHORT_SEPARATORS
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils import encoders
+
+
+class FileListJSONStream:
+    """
+    Serializer-free JSON encoder for large file listings.
+
+    Rows are read with ``values_list().iterator()`` and encoded one at a time,
+    so memory stays bounded no matter how many rows are exported. The output
+    is byte for byte what ``JSONRenderer`` produces for
+    ``serializer_class(queryset, many=True).data`` (without a request in the
+    serializer context).
+    """
+
+    def __init__(
+        self, queryset, serializer_class, chunk_size=2000, buffer_size=64 * 1024
+    ):
+        self.queryset = queryset
+        self.chunk_size = chunk_size
+        self.buffer_size = buffer_size
+        self.encoder = encoders.JSONEncoder(
+            ensure_ascii=JSONRenderer.ensure_ascii,
+            allow_nan=not JSONRenderer.strict,
+            separators=SHORT_SEPARATORS if JSONRenderer.compact else LONG_SEPARATORS,
+        )
+
+        # keep the same keys and key order as the serializer
+        model = queryset.model
+        self.columns = []
+        self.converters = []
+        for field_name in serializer_class().fields:
+            model_field = model._meta.get_field(field_name)
+            self.columns.append(model_field.attname)
+            self.converters.append((field_name, self.get_converter(model_field)))
+
+    @classmethod
+    def get_converter(cls, model_field):
+        if isinstance(model_field, models.FileField):
+            return cls.get_file_url_converter(model_field.storage)
+        if isinstance(model_field, models.DateTimeField):
+            return cls.get_datetime_converter()
+        if isinstance(model_field, models.DateField):
+            return serializers.DateField().to_representation
+        return None
+
+    @staticmethod
+    def get_file_url_converter(storage):
+        # __class__ (unlike type()) sees through the default_storage proxy
+        if storage.__class__.url is not FileSystemStorage.url:
+            return storage.url
+
+        # FileSystemStorage.url() is urljoin(base_url, filepath_to_uri(name));
+        # stored names are relative paths, so plain concatenation is the same
+        # string without parsing base_url once per row.
+        base_url = storage.base_url
+        return lambda name: base_url + filepath_to_uri(name).lstrip("/")
+
+    @staticmethod
+    def get_datetime_converter():
+        field = serializers.DateTimeField()
+        field_timezone = field.default_timezone()
+        output_format = api_settings.DATETIME_FORMAT
+        if (
+            field_timezone is None
+            or output_format is None
+            or output_format.lower() != ISO_8601
+        ):
+            return field.to_representation
+
+        # DateTimeField.to_representation() with the current timezone looked
+        # up once per export instead of once per row
+        def to_representation(value):
+            if timezone.is_naive(value):
+                return field.to_representation(value)
+            value = value.astimezone(field_timezone).isoformat()
+            if value.endswith("+00:00"):
+                value = value[:-6] + "Z"
+            return value
+
+        return to_representation
+
+    def encode_row(self, row):
+        data = {}
+        for (field_name, converter), value in zip(self.converters, row):
+            if converter is not None and value is not None:
+                value = converter(value)
+            data[field_name] = value
+
+        ret = self.encoder.encode(data)
+        # same escaping as JSONRenderer (U+2028/U+2029 are invalid in JS)
+        ret = ret.replace("\u2028", "\\u2028").replace("\u2029", "\\u2029")
+        return ret.encode()
+
+    def __iter__(self):
+        rows = self.queryset.values_list(*self.columns).iterator(
+            chunk_size=self.chunk_size
+        )
+
+        # group rows into buffer_size pieces instead of one write per row
+        buffer = bytearray(b"[")
+        separator = b""
+        for row in rows:
+            buffer += separator
+            buffer += self.encode_row(row)
+            separator = b","
+            if len(buffer) >= self.buffer_size:
+                yield bytes(buffer)
+                buffer.clear()
+        buffer += b"]"
+        yield bytes(buffer)
+
+    async def aiter_chunks(self):
+        # same output as __iter__ with rows fetched by the async ORM, for
+        # ASGI. Not __aiter__: StreamingHttpResponse would prefer it to
+        # __iter__ under WSGI as well. values() rather than values_list():
+        # Django 4.2's values_list().aiterator() runs its query in the event
+        # loop and fails.
+        rows = self.queryset.values(*self.columns).aiterator(chunk_size=self.chunk_size)
+
+        buffer = bytearray(b"[")
+        separator = b""
+        async for row in rows:
+            buffer += separator
+            buffer += self.encode_row(row.values())
+            separator = b","
+            if len(buffer) >= self.buffer_size:
+                yield bytes(buffer)
+                buffer.clear()
+        buffer += b"]"
+        yield bytes(buffer)
+
+
+class UnseekableWriteBuffer(io.RawIOBase):
+    """
+    Write target for ``zipfile.ZipFile`` that is drained after every write.
+    It is not seekable, so zipfile streams: sizes and CRCs go in data
+    descriptors after each entry instead of being patched into its header.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+class FileBundleZipStream:
+    """
+    ZIP archive of ``file_objs`` generated while it is sent.
+
+    Each document is read from its storage in ``block_size`` pieces and
+    written as a STORED entry (pptx/docx/xlsx are zip packages already, so
+    deflating them again costs CPU for nothing). Nothing is buffered beyond
+    one block and the central directory, so memory does not grow with the
+    size of the bundle. Zip64 is used where sizes or offsets need it.
+    """
+
+    def __init__(self, file_objs, block_size=64 * 1024):
+        self.file_objs = file_objs
+        self.block_size = block_size
+
+    @staticmethod
+    def get_entry_names(file_objs):
+        names = []
+        seen = set()
+        for file_obj in file_objs:
+            name = file_obj.original_name or os.path.basename(
+                file_obj.file_content.name
+            )
+            name = name.replace("/", "_").replace("\\", "_")
+            stem, extension = os.path.splitext(name)
+            unique_name, counter = name, 1
+            while unique_name in seen:
+                counter += 1
+                unique_name = f"{stem} ({counter}){extension}"
+            seen.add(unique_name)
+            names.append(unique_name)
+        return names
+
+    def __iter__(self):
+        buffer = UnseekableWriteBuffer()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+            file_objs = list(self.file_objs)
+            for file_obj, name in zip(file_objs, self.get_entry_names(file_objs)):
+                field_file = file_obj.file_content
+                modified = timezone.localtime(file_obj.upload_timestamp)
+                entry_info = zipfile.ZipInfo(name, date_time=modified.timetuple()[:6])
+                entry_info.compress_type = zipfile.ZIP_STORED
+                # lets zipfile decide up front whether the entry needs zip64
+                entry_info.file_size = field_file.size
+
+                with field_file.storage.open(field_file.name, "rb") as source:
+                    with archive.open(entry_info, "w") as entry:
+                        for block in iter(lambda: source.read(self.block_size), b""):
+                            entry.write(block)
+                            yield buffer.drain()
+                yield buffer.drain()
+        yield buffer.drain()
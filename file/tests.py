@@ -0,0 +1,2767 @@
+import base64
+import email
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+import zipfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from urllib.parse import urlencode
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from botocore.exceptions import ClientError
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.conf import settings
+from django.db import connection
+from django.http import FileResponse, HttpResponse
+from django.test import LiveServerTestCase, SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework import status
+from itsdangerous import URLSafeSerializer
+from rest_framework.renderers import JSONRenderer
+
+from account.jwt import CustomTokenObtainPairSerializer
+from account.permissions import CLIENT_USER_ROLE, OPS_USER_ROLE, ROLE_CLAIM
+from account.models import UserDetails
+from account.tests import TestSetUp, User
+from standard import metrics
+from standard.response import ErrorMessage, MessageCode
+
+from .benchmark import (
+    SCENARIOS,
+    BenchmarkClient,
+    Sample,
+    compare_results,
+    load_mix,
+    seed,
+    summarize,
+)
+from .models import File, FileBlob, FileBundle, FilePreview, UploadSession
+from .preview_jobs import generate_pending_previews
+from .previews import PreviewError, PreviewTimeout, generate_preview, time_limit
+from .pagination import FILE_LIST_ORDERINGS, FileCursorPagination
+from .list_cache import file_list_cache
+from .presigned_urls import PresignedUrlCache, presigned_url_cache
+from . import storage
+from .search import reindex_files
+from .services import (
+    FileDownloadService,
+    FilePreSignedUrlService,
+    create_deduplicated_files,
+    filter_files,
+    is_date_range,
+)
+from .streaming import FileListJSONStream
+from .responses import call_on_close
+from .throttling import RateLimiter, rate_limiter
+from .upload_handlers import OfficeDocumentSniffer, detect_office_document_type
+from .views import FileMultiView
+
+OFFICE_MAIN_PARTS = {
+    "pptx": ("ppt/presentation.xml", "presentationml.presentation"),
+    "docx": ("word/document.xml", "wordprocessingml.document"),
+    "xlsx": ("xl/workbook.xml", "spreadsheetml.sheet"),
+}
+
+
+def write_zip_entry(archive, name, data):
+    # a fixed timestamp: documents built with the same parts are the same
+    # bytes (and hash) whenever they are built
+    info = zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0))
+    info.compress_type = zipfile.ZIP_DEFLATED
+    archive.writestr(info, data)
+
+
+def make_office_document(kind="pptx", content_types_first=True, payload=b""):
+    """Smallest OOXML package the upload checks accept."""
+    part_name, content_type = OFFICE_MAIN_PARTS[kind]
+    content_types = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        f'<Override PartName="/{part_name}" ContentType="application/'
+        f'vnd.openxmlformats-officedocument.{content_type}.main+xml"/>'
+        "</Types>"
+    )
+    parts = [("[Content_Types].xml", content_types), (part_name, "<root/>")]
+    if payload:
+        parts.append(("docProps/payload.bin", payload))
+    if not content_types_first:
+        parts.reverse()
+
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in parts:
+            write_zip_entry(archive, name, data)
+    return buffer.getvalue()
+
+
+PREVIEW_TEXT_PARTS = {
+    "docx": (
+        "word/document.xml",
+        "http://schemas.openxmlformats.org/wordprocessingml/2006/main",
+        '<w:document xmlns:w="{ns}"><w:body>{body}</w:body></w:document>',
+        "<w:p><w:r><w:t>{text}</w:t></w:r></w:p>",
+    ),
+    "pptx": (
+        "ppt/slides/slide1.xml",
+        "http://schemas.openxmlformats.org/drawingml/2006/main",
+        '<p:sld xmlns:p="p" xmlns:a="{ns}"><p:cSld>{body}</p:cSld></p:sld>',
+        "<p:sp><a:p><a:r><a:t>{text}</a:t></a:r></a:p></p:sp>",
+    ),
+    "xlsx": (
+        "xl/worksheets/sheet1.xml",
+        "http://schemas.openxmlformats.org/spreadsheetml/2006/main",
+        '<worksheet xmlns="{ns}"><sheetData><row>{body}</row></sheetData></worksheet>',
+        '<c t="inlineStr"><is><t>{text}</t></is></c>',
+    ),
+}
+RELATIONSHIPS = (
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/'
+    'relationships">{}</Relationships>'
+)
+RELATIONSHIP = (
+    '<Relationship Id="{}" Target="{}" Type="http://schemas.openxmlformats.org/' '{}"/>'
+)
+
+
+def make_previewable_document(kind="docx", texts=(), thumbnail=None):
+    """OOXML package with the given texts on its first page, slide or sheet."""
+    part_name, namespace, template, item = PREVIEW_TEXT_PARTS[kind]
+    body = "".join(item.format(text=text) for text in texts)
+    parts = {part_name: template.format(ns=namespace, body=body)}
+
+    if kind == "pptx":
+        parts["ppt/presentation.xml"] = (
+            '<p:presentation xmlns:p="http://schemas.openxmlformats.org/'
+            'presentationml/2006/main" xmlns:r="http://schemas.openxmlformats.org/'
+            'officeDocument/2006/relationships"><p:sldIdLst>'
+            '<p:sldId id="256" r:id="rId2"/></p:sldIdLst></p:presentation>'
+        )
+        parts["ppt/_rels/presentation.xml.rels"] = RELATIONSHIPS.format(
+            RELATIONSHIP.format("rId2", "slides/slide1.xml", "officeDocument/slide")
+        )
+    elif kind == "xlsx":
+        parts["xl/workbook.xml"] = (
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/'
+            'main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/'
+            'relationships"><sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/>'
+            "</sheets></workbook>"
+        )
+        parts["xl/_rels/workbook.xml.rels"] = RELATIONSHIPS.format(
+            RELATIONSHIP.format("rId1", "worksheets/sheet1.xml", "officeDocument/sheet")
+        )
+
+    if thumbnail is not None:
+        parts["docProps/thumbnail.jpeg"] = thumbnail
+        parts["_rels/.rels"] = RELATIONSHIPS.format(
+            RELATIONSHIP.format(
+                "rId1",
+                "docProps/thumbnail.jpeg",
+                "package/2006/relationships/metadata/thumbnail",
+            )
+        )
+
+    with zipfile.ZipFile(BytesIO(make_office_document(kind))) as archive:
+        content_types = archive.read("[Content_Types].xml")
+
+    document = BytesIO()
+    with zipfile.ZipFile(document, "w", zipfile.ZIP_DEFLATED) as archive:
+        write_zip_entry(archive, "[Content_Types].xml", content_types)
+        for name, data in parts.items():
+            write_zip_entry(archive, name, data)
+    return document.getvalue()
+
+
+class FileTestSetUp(TestSetUp):
+    """Keeps uploaded and temporary files out of the project's media folder."""
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir, ignore_errors=True)
+
+        settings_override = override_settings(
+            MEDIA_ROOT=os.path.join(self.temp_dir, "media"),
+            CHUNKED_UPLOAD_DIR=os.path.join(self.temp_dir, "chunks"),
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class TestFileListPagination(TestSetUp):
+    def setUp(self):
+        super().setUp()
+        File.objects.bulk_create(
+            File(
+                user=self.ops_user_obj,
+                file_name=f"file {i}",
+                file_content=f"uploads/file_{i}.pptx",
+                file_identifier=f"identifier-{i}",
+            )
+            for i in range(300)
+        )
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.clinet_token}")
+
+    def test_pages_are_newest_first_and_complete(self):
+        url = reverse("file_multi_view") + "?page_size=40"
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen.extend(row["id"] for row in response.data["results"])
+            url = response.data["next"]
+
+        self.assertEqual(
+            seen, list(File.objects.order_by("-id").values_list("id", flat=True))
+        )
+
+    def test_previous_cursor(self):
+        url = reverse("file_multi_view") + "?page_size=10"
+        first = self.client.get(url)
+        second = self.client.get(first.data["next"])
+        back = self.client.get(second.data["previous"])
+
+        self.assertEqual(back.data["results"], first.data["results"])
+
+    def test_page_size_is_capped(self):
+        with self.settings(FILE_LIST_MAX_PAGE_SIZE=25):
+            response = self.client.get(
+                reverse("file_multi_view") + "?page_size=100000"
+            )
+        self.assertEqual(len(response.data["results"]), 25)
+
+    def test_cost_is_flat_at_large_offsets(self):
+        url = reverse("file_multi_view") + "?page_size=10"
+        page_queries = []
+        while url:
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url)
+            page_queries.append([q["sql"] for q in ctx.captured_queries])
+            url = response.data["next"]
+
+        self.assertEqual(len(page_queries), 30)
+        # the deepest page runs the same number of queries as the first one
+        self.assertEqual({len(queries) for queries in page_queries}, {1})
+        for queries in page_queries:
+            file_query = queries[-1]
+            self.assertNotIn("OFFSET", file_query.upper())
+            self.assertIn("LIMIT 11", file_query.upper())
+        self.assertIn('"file_file"."id" <', page_queries[-1][-1])
+
+
+@override_settings(FILE_LIST_CACHE_ALIAS="default")
+class TestFileListCache(FileTestSetUp):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.file_objs = [
+            File.objects.create(
+                user=self.ops_user_obj,
+                file_name=f"file {i}",
+                file_content=f"uploads/file_{i}.pptx",
+                file_identifier=f"identifier-{i}",
+            )
+            for i in range(3)
+        ]
+        self.url = reverse("file_multi_view") + "?page_size=2"
+        # ops users list and upload
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.ops_token}")
+
+    def list_ids(self, url=None):
+        response = self.client.get(url or self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [row["id"] for row in response.data["results"]]
+
+    def test_repeated_listing_skips_the_database(self):
+        with self.assertNumQueries(1):
+            first = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second["ETag"], first["ETag"])
+
+        # other pages and filters are cached apart
+        with self.assertNumQueries(1):
+            self.assertEqual(self.list_ids(first.data["next"]), [self.file_objs[0].id])
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                self.list_ids(self.url + "&ordering=upload_timestamp"),
+                [self.file_objs[0].id, self.file_objs[1].id],
+            )
+
+    def test_etag_revalidation(self):
+        etag = self.client.get(self.url)["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(response.content, b"")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.file_objs[0].delete()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_uploads_are_listed_once_committed(self):
+        self.assertEqual(self.list_ids(), [self.file_objs[2].id, self.file_objs[1].id])
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(
+                reverse("file_multi_view"),
+                {
+                    "file_name": "report",
+                    "file_content": SimpleUploadedFile(
+                        "report.docx", make_office_document("docx")
+                    ),
+                },
+                format="multipart",
+            )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            # not committed yet: the generation is unchanged
+            self.assertEqual(
+                self.list_ids(), [self.file_objs[2].id, self.file_objs[1].id]
+            )
+        self.assertTrue(callbacks)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.list_ids(), [response.data["id"], self.file_objs[2].id])
+
+        # bulk_create sends no post_save
+        content = make_office_document("docx", payload=b"minutes")
+        with self.captureOnCommitCallbacks(execute=True):
+            (file_obj,) = create_deduplicated_files(
+                self.ops_user_obj.id,
+                [
+                    (
+                        "minutes",
+                        ContentFile(content, name="minutes.docx"),
+                        hashlib.sha256(content).hexdigest(),
+                    )
+                ],
+            )
+        self.assertEqual(self.list_ids(), [file_obj.id, response.data["id"]])
+
+    async def test_async_listing_is_cached(self):
+        url = reverse("async_file_list_view") + "?page_size=2"
+        headers = {"authorization": f"Bearer {self.clinet_token}"}
+        first = await self.async_client.get(url, headers=headers)
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+
+        with mock.patch.object(FileMultiView, "get_page_data") as get_page_data:
+            second = await self.async_client.get(url, headers=headers)
+            self.assertEqual(second.content, first.content)
+            response = await self.async_client.get(
+                url, headers={**headers, "if-none-match": first["ETag"]}
+            )
+        get_page_data.assert_not_called()
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_caching_is_off_without_a_cache(self):
+        with self.settings(FILE_LIST_CACHE_ALIAS=None):
+            self.assertIsNone(file_list_cache.get_generation())
+            with self.assertNumQueries(1):
+                response = self.client.get(self.url)
+            with self.assertNumQueries(1):
+                self.client.get(self.url)
+        self.assertNotIn("ETag", response)
+
+    def test_evicted_generation_starts_over(self):
+        generation = file_list_cache.get_generation()
+        file_list_cache.bump_generation()
+        self.assertEqual(file_list_cache.get_generation(), generation + 1)
+
+        cache.clear()
+        file_list_cache.bump_generation()
+        self.assertGreater(file_list_cache.get_generation(), generation + 1)
+
+
+class TestFileListFilters(TestSetUp):
+    def setUp(self):
+        super().setUp()
+        self.start = timezone.now() - timedelta(days=10)
+        names = ["report b", "Report a", "budget", "report a", "slides"]
+        for day, file_name in enumerate(names):
+            file_obj = File.objects.create(
+                user=self.client_user_obj if day % 2 else self.ops_user_obj,
+                file_name=file_name,
+                file_content=f"uploads/file_{day}.pptx",
+                file_identifier=f"identifier-{day}",
+            )
+            File.objects.filter(id=file_obj.id).update(
+                upload_timestamp=self.start + timedelta(days=day)
+            )
+        self.ids = {
+            file_name: file_id
+            for file_name, file_id in File.objects.values_list("file_name", "id")
+        }
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.clinet_token}")
+
+    def list_names(self, **params):
+        url = reverse("file_multi_view") + "?" + urlencode({"page_size": 2, **params})
+        names = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            names.extend(row["file_name"] for row in response.data["results"])
+            url = response.data["next"]
+        return names
+
+    def test_filters(self):
+        self.assertEqual(
+            self.list_names(user=self.ops_user_obj.id),
+            ["slides", "budget", "report b"],
+        )
+        self.assertEqual(
+            self.list_names(
+                uploaded_after=(self.start + timedelta(days=1)).isoformat(),
+                uploaded_before=(self.start + timedelta(days=3)).isoformat(),
+            ),
+            ["budget", "Report a"],
+        )
+        # prefixes are case sensitive
+        self.assertEqual(
+            self.list_names(name_prefix="report"), ["report a", "report b"]
+        )
+        self.assertEqual(
+            self.list_names(user=self.client_user_obj.id, name_prefix="report"),
+            ["report a"],
+        )
+
+    def test_orderings(self):
+        self.assertEqual(
+            self.list_names(ordering="file_name"),
+            ["Report a", "budget", "report a", "report b", "slides"],
+        )
+        self.assertEqual(
+            self.list_names(ordering="-file_name", name_prefix="rep"),
+            ["report b", "report a"],
+        )
+        self.assertEqual(
+            self.list_names(
+                ordering="upload_timestamp",
+                uploaded_after=self.start.isoformat(),
+            ),
+            ["report b", "Report a", "budget", "report a", "slides"],
+        )
+        self.assertEqual(
+            self.list_names(ordering="upload_timestamp"),
+            ["report b", "Report a", "budget", "report a", "slides"],
+        )
+
+        for params in ({"ordering": "size"}, {"user": "me"}, {"uploaded_after": "x"}):
+            response = self.client.get(reverse("file_multi_view"), data=params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_every_filter_and_sort_is_served_by_an_index(self):
+        filter_sets = [
+            {},
+            {"user": 1},
+            {"uploaded_after": self.start},
+            {"uploaded_before": self.start},
+            {"uploaded_after": self.start, "uploaded_before": self.start},
+            {"name_prefix": "rep"},
+            {"user": 1, "uploaded_after": self.start},
+            {"user": 1, "name_prefix": "rep"},
+        ]
+        for ordering in FILE_LIST_ORDERINGS:
+            for filters in filter_sets:
+                paginator = FileCursorPagination(ordering, is_date_range(filters))
+                queryset = filter_files(File.objects.all(), **filters)
+                plan = queryset.order_by(*paginator.ordering)[:11].explain()
+
+                with self.subTest(ordering=ordering, filters=list(filters)):
+                    if filters:
+                        # SQLite: "SEARCH file_file USING INDEX ...", never a
+                        # "SCAN file_file" through every row
+                        self.assertIn("SEARCH file_file USING", plan)
+                        self.assertNotIn("SCAN file_file", plan)
+                    else:
+                        # a walk of the primary key or file_name index
+                        self.assertNotIn("TEMP B-TREE", plan)
+
+                    # a filter on the sort's own field returns rows in order
+                    sort_field = ordering.lstrip("-")
+                    if sort_field == "upload_timestamp" and is_date_range(filters):
+                        self.assertNotIn("TEMP B-TREE", plan)
+                    if sort_field == "file_name" and "name_prefix" in filters:
+                        self.assertNotIn("TEMP B-TREE", plan)
+
+
+class TestFileExport(TestSetUp):
+    def setUp(self):
+        super().setUp()
+        File.objects.bulk_create(
+            File(
+                user=self.ops_user_obj if i % 2 else self.client_user_obj,
+                file_name=f"fichier {i}   \"quoted\" é",
+                file_content=f"uploads/file {i}.docx",
+                file_identifier=f"identifier-{i}",
+            )
+            for i in range(25)
+        )
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.clinet_token}")
+
+    def test_export_matches_serializer_output(self):
+        response = self.client.get(reverse("file_export_view"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+
+        expected = JSONRenderer().render(
+            FileMultiView.FileModelSerializer(
+                File.objects.order_by("-id"), many=True
+            ).data
+        )
+        self.assertEqual(b"".join(response.streaming_content), expected)
+
+    def test_export_is_flushed_in_pieces(self):
+        stream = FileListJSONStream(
+            File.objects.order_by("-id"),
+            FileMultiView.FileModelSerializer,
+            chunk_size=5,
+            buffer_size=512,
+        )
+        pieces = list(stream)
+        self.assertGreater(len(pieces), 1)
+        self.assertEqual(len(json.loads(b"".join(pieces))), 25)
+
+    def test_export_of_empty_table(self):
+        File.objects.all().delete()
+        response = self.client.get(reverse("file_export_view"))
+        self.assertEqual(b"".join(response.streaming_content), b"[]")
+
+
+class TestBulkUpload(FileTestSetUp):
+    def setUp(self):
+        super().setUp()
+        self.url = reverse("file_bulk_upload_view")
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.ops_token}")
+
+    def upload(self, files, **data):
+        return self.client.post(
+            self.url,
+            data={
+                "file_content": [
+                    SimpleUploadedFile(file_name, content)
+                    for file_name, content in files
+                ],
+                **data,
+            },
+            format="multipart",
+        )
+
+    def test_valid_files_are_created_invalid_ones_reported(self):
+        docx = make_office_document("docx", payload=os.urandom(5000))
+        xlsx = make_office_document("xlsx")
+        # on disk (not in memory), so a skipped file could close its neighbours
+        with self.settings(FILE_UPLOAD_MAX_MEMORY_SIZE=1000):
+            response = self.upload(
+                [
+                    ("report.docx", docx),
+                    ("notes.txt", os.urandom(5000)),
+                    ("sheet.xlsx", xlsx),
+                    ("renamed.pptx", docx),
+                    ("empty.txt", b""),
+                    ("copy.docx", docx),
+                ]
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(list(response.data["files"]), [0, 2, 5])
+        self.assertEqual(
+            {
+                index: error["errors"]
+                for index, error in response.data["errors"].items()
+            },
+            {
+                1: {"file_type": ErrorMessage.INVALID_FILE_TYPE},
+                3: {"file_type": ErrorMessage.INVALID_FILE_CONTENT},
+                4: {"file_type": ErrorMessage.INVALID_FILE_TYPE},
+            },
+        )
+
+        file_objs = File.objects.order_by("id")
+        self.assertEqual(
+            [(file_obj.file_name, file_obj.original_name) for file_obj in file_objs],
+            [("report", "report.docx"), ("sheet", "sheet.xlsx"), ("copy", "copy.docx")],
+        )
+        self.assertEqual(response.data["files"][5]["id"], file_objs[2].id)
+        for file_obj, content in zip(file_objs, (docx, xlsx, docx)):
+            with file_obj.file_content.open("rb") as stored:
+                self.assertEqual(stored.read(), content)
+            self.assertEqual(file_obj.user, self.ops_user_obj)
+
+        # identical uploads share one blob, one preview job and one parse
+        self.assertEqual(file_objs[0].blob, file_objs[2].blob)
+        self.assertEqual(FileBlob.objects.get(id=file_objs[0].blob_id).ref_count, 2)
+        self.assertEqual(FilePreview.objects.count(), 2)
+        self.assertEqual(
+            set(File.objects.values_list("search_document__title", flat=True)),
+            {"report report.docx", "sheet sheet.xlsx", "copy copy.docx"},
+        )
+
+    def test_queries_do_not_grow_with_the_batch(self):
+        def count_queries(files):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.upload(files)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            return len(queries)
+
+        few = count_queries(
+            [(f"deck{index}.pptx", make_office_document("pptx")) for index in range(2)]
+        )
+        many = count_queries(
+            [
+                (
+                    f"deck{index}.pptx",
+                    make_office_document("pptx", payload=bytes([index])),
+                )
+                for index in range(8)
+            ]
+        )
+        self.assertEqual(few, many)
+        self.assertEqual(File.objects.count(), 10)
+        # existing blobs are counted up in the same queries
+        count_queries([("deck.pptx", make_office_document("pptx"))] * 3)
+        sha256 = hashlib.sha256(make_office_document("pptx")).hexdigest()
+        self.assertEqual(FileBlob.objects.get(sha256=sha256).ref_count, 5)
+
+    def test_file_names(self):
+        files = [("a.docx", make_office_document("docx")), ("b.txt", b"text")]
+        response = self.upload(files, file_name=["first", "second"])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["files"][0]["file_name"], "first")
+
+        response = self.upload(files, file_name=["first"])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            response.data["errors"]["file_name"], ErrorMessage.FILE_NAME_COUNT
+        )
+
+    def test_request_limits(self):
+        content = make_office_document("pptx")
+        files = [("deck.pptx", content)] * 3
+        with self.settings(FILE_BULK_UPLOAD_MAX_FILES=2):
+            response = self.upload(files)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["code"], MessageCode.TOO_MANY_FILES)
+
+        with self.settings(FILE_BULK_UPLOAD_MAX_SIZE=len(content) * 2):
+            response = self.upload(files)
+        self.assertEqual(response.data["code"], MessageCode.FILE_TOO_LARGE)
+
+        with self.settings(FILE_UPLOAD_MAX_SIZE=100):
+            response = self.upload(files)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(response.data["errors"]), 3)
+        self.assertFalse(File.objects.exists())
+
+        response = self.client.post(self.url, {}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.clinet_token}")
+        response = self.upload(files)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            response.data["errors"]["operation_user"],
+            ErrorMessage.ACCESS_DENIED_UPLOAD,
+        )
+
+
+class TestChunkedUpload(FileTestSetUp):
+    def setUp(self):
+        super().setUp()
+        self.content = make_office_document(payload=os.urandom(1000))
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.ops_token}")
+
+    def create_session(self, original_name="deck.pptx"):
+        return self.client.post(
+            reverse("upload_session_view"),
+            data={
+                "file_name": "deck",
+                "original_name": original_name,
+                "total_size": len(self.content),
+            },
+            format="json",
+        )
+
+    def put_chunk(self, session_id, offset, chunk):
+        url = reverse("upload_session_detail_view", args=[session_id])
+        return self.client.put(
+            f"{url}?offset={offset}",
+            data=chunk,
+            content_type="application/octet-stream",
+        )
+
+    def test_resumable_upload(self):
+        response = self.create_session()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        session_id = response.data["id"]
+        self.assertEqual(response.data["offset"], 0)
+
+        response = self.put_chunk(session_id, 0, self.content[:400])
+        self.assertEqual(response.data["offset"], 400)
+
+        # a retried chunk at a stale offset is refused with the current offset
+        response = self.put_chunk(session_id, 0, self.content[:400])
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data["errors"]["current_offset"], 400)
+
+        response = self.client.get(
+            reverse("upload_session_detail_view", args=[session_id])
+        )
+        self.assertEqual(response.data["offset"], 400)
+
+        finalize_url = reverse("upload_session_finalize_view", args=[session_id])
+        response = self.client.post(finalize_url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.put_chunk(session_id, 400, self.content[400:])
+        self.assertEqual(response.data["offset"], len(self.content))
+
+        response = self.client.post(finalize_url)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        file_obj = File.objects.get(id=response.data["id"])
+        self.assertEqual(file_obj.user, self.ops_user_obj)
+        with file_obj.file_content.open("rb") as stored:
+            self.assertEqual(stored.read(), self.content)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(self.temp_dir, "chunks")), [])
+
+    def test_chunk_past_total_size(self):
+        session_id = self.create_session().data["id"]
+        response = self.put_chunk(session_id, 0, self.content + b"extra")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_chunk_without_content_length(self):
+        session_id = self.create_session().data["id"]
+        url = reverse("upload_session_detail_view", args=[session_id])
+        for content_length in ("", "many", "-1"):
+            response = self.client.put(
+                f"{url}?offset=0",
+                data=self.content[:400],
+                content_type="application/octet-stream",
+                CONTENT_LENGTH=content_length,
+            )
+            self.assertEqual(response.status_code, status.HTTP_411_LENGTH_REQUIRED)
+            self.assertEqual(
+                response.data["errors"]["chunk"], ErrorMessage.CHUNK_LENGTH_REQUIRED
+            )
+        self.assertEqual(UploadSession.objects.get(id=session_id).offset, 0)
+
+    def test_invalid_extension_and_client_user(self):
+        response = self.create_session(original_name="deck.ppt")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["code"], MessageCode.INVALID_FILE_TYPE)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.clinet_token}")
+        response = self.create_session()
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["code"], MessageCode.ACCESS_DENIED)
+
+
+class TestUploadTypeChecks(FileTestSetUp):
+    def setUp(self):
+        super().setUp()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.ops_token}")
+
+    def upload(self, file_name, content):
+        return self.client.post(
+            reverse("file_multi_view"),
+            data={
+                "file_name": "document",
+                "file_content": SimpleUploadedFile(file_name, content),
+            },
+            format="multipart",
+        )
+
+    def test_valid_documents_are_stored(self):
+        for kind in ("pptx", "docx", "xlsx"):
+            content = make_office_document(kind)
+            response = self.upload(f"document.{kind}", content)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+            file_obj = File.objects.get(id=response.data["id"])
+            with file_obj.file_content.open("rb") as stored:
+                self.assertEqual(stored.read(), content)
+            self.assertEqual(
+                file_obj.content_sha256, hashlib.sha256(content).hexdigest()
+            )
+
+    def test_content_types_at_the_end_of_the_archive(self):
+        content = make_office_document("xlsx", content_types_first=False)
+        response = self.upload("sheet.xlsx", content)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_renamed_files_are_rejected(self):
+        for file_name, content in (
+            ("deck.pptx", make_office_document("docx")),
+            ("deck.pptx", b"GIF89a" + os.urandom(2000)),
+            ("deck.pptx", b"PK\x03\x04"),
+        ):
+            response = self.upload(file_name, content)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(
+                response.data["errors"]["file_type"],
+                ErrorMessage.INVALID_FILE_CONTENT,
+            )
+        self.assertFalse(File.objects.exists())
+
+    def test_payload_over_size_limit(self):
+        content = make_office_document(payload=os.urandom(5000))
+        with self.settings(FILE_UPLOAD_MAX_SIZE=4000):
+            response = self.upload("deck.pptx", content)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["code"], MessageCode.FILE_TOO_LARGE)
+
+    def test_request_over_size_limit(self):
+        # the file fits, the whole multipart body does not
+        content = make_office_document(payload=os.urandom(1000))
+        with self.settings(FILE_UPLOAD_MAX_SIZE=len(content) + 1000):
+            response = self.client.post(
+                reverse("file_multi_view"),
+                data={
+                    "file_name": "x" * 2000,
+                    "file_content": SimpleUploadedFile("deck.pptx", content),
+                },
+                format="multipart",
+            )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["code"], MessageCode.FILE_TOO_LARGE)
+        self.assertFalse(File.objects.exists())
+
+    def test_sniffer_decides_from_the_first_bytes(self):
+        sniffer = OfficeDocumentSniffer()
+        self.assertEqual(sniffer.feed(b"%PDF-1.7\n"), OfficeDocumentSniffer.INVALID)
+
+        content = make_office_document("docx", payload=os.urandom(200000))
+        sniffer = OfficeDocumentSniffer()
+        self.assertEqual(sniffer.feed(content[:1024]), "docx")
+
+        self.assertEqual(detect_office_document_type(BytesIO(content)), "docx")
+        self.assertIsNone(detect_office_document_type(BytesIO(b"not a zip")))
+
+
+class TestDownloadModes(FileTestSetUp):
+    def setUp(self):
+        super().setUp()
+        self.content = make_office_document("docx")
+        self.file_obj = File.objects.create(
+            user=self.ops_user_obj,
+            file_name="report",
+            file_content=ContentFile(self.content, name="rapport-é.docx"),
+            file_identifier="report-identifier",
+        )
+        signed_identifier = URLSafeSerializer(settings.SECRET_KEY).dumps(
+            self.file_obj.file_identifier
+        )
+        self.url = reverse("download_file_view", args=[signed_identifier])
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.clinet_token}")
+
+    def test_django_mode_streams_the_file(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+        self.assertNotIn("X-Accel-Redirect", response)
+        self.assertNotIn("X-Sendfile", response)
+
+    def test_x_accel_redirect_mode(self):
+        with self.settings(
+            FILE_DOWNLOAD_MODE=FileDownloadService.X_ACCEL_REDIRECT,
+            FILE_DOWNLOAD_ACCEL_PREFIX="/protected",
+        ):
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response["X-Accel-Redirect"], "/protected/uploads/rapport-%C3%A9.docx"
+        )
+        self.assertEqual(response.content, b"")
+        self.assertEqual(
+            response["Content-Type"],
+            "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        )
+        self.assertEqual(
+            response["Content-Disposition"],
+            "inline; filename*=utf-8''rapport-%C3%A9.docx",
+        )
+
+    def test_x_sendfile_mode(self):
+        with self.settings(FILE_DOWNLOAD_MODE=FileDownloadService.X_SENDFILE):
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # the raw UTF-8 path, as the server sends latin-1 header strings
+        self.assertEqual(
+            response["X-Sendfile"].encode("latin-1"),
+            os.fsencode(self.file_obj.file_content.path),
+        )
+        self.assertEqual(response.content, b"")
+
+
+class TestDownloadValidatorsAndRanges(FileTestSetUp):
+    def setUp(self):
+        super().setUp()
+        self.content = bytes(range(256)) * 40
+        self.sha256 = hashlib.sha256(self.content).hexdigest()
+        self.file_obj = File.objects.create(
+            user=self.ops_user_obj,
+            file_name="sheet",
+            file_content=ContentFile(self.content, name="sheet.xlsx"),
+            file_identifier="sheet-identifier",
+            content_sha256=self.sha256,
+        )
+        signed_identifier = URLSafeSerializer(settings.SECRET_KEY).dumps(
+            self.file_obj.file_identifier
+        )
+        self.url = reverse("download_file_view", args=[signed_identifier])
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.clinet_token}")
+
+    def test_full_response_has_validators(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["ETag"], f'"{self.sha256}"')
+        self.assertEqual(
+            response["Last-Modified"],
+            http_date(self.file_obj.upload_timestamp.timestamp()),
+        )
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+
+    def test_single_ranges(self):
+        size = len(self.content)
+        for header, start, end in (
+            ("bytes=0-9", 0, 9),
+            ("bytes=100-", 100, size - 1),
+            ("bytes=-5", size - 5, size - 1),
+            ("bytes=10000-20000", 10000, size - 1),
+        ):
+            response = self.client.get(self.url, HTTP_RANGE=header)
+            self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+            self.assertEqual(response["Content-Range"], f"bytes {start}-{end}/{size}")
+            body = b"".join(response.streaming_content)
+            self.assertEqual(body, self.content[start : end + 1])
+            self.assertEqual(int(response["Content-Length"]), len(body))
+
+    def test_multiple_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=0-4, 20-29, 25-40")
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertTrue(response["Content-Type"].startswith("multipart/byteranges"))
+
+        body = b"".join(response.streaming_content)
+        self.assertEqual(int(response["Content-Length"]), len(body))
+
+        message = email.message_from_bytes(
+            b"Content-Type: " + response["Content-Type"].encode() + b"\r\n\r\n" + body
+        )
+        parts = message.get_payload()
+        self.assertEqual(len(parts), 2)  # overlapping ranges are merged
+        self.assertEqual(parts[0]["Content-Range"], "bytes 0-4/10240")
+        self.assertEqual(parts[0].get_payload(decode=True), self.content[0:5])
+        self.assertEqual(parts[1]["Content-Range"], "bytes 20-40/10240")
+        self.assertEqual(parts[1].get_payload(decode=True), self.content[20:41])
+
+    def test_unsatisfiable_and_invalid_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=20000-")
+        self.assertEqual(
+            response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+        )
+        self.assertEqual(response["Content-Range"], "bytes */10240")
+
+        # malformed headers are ignored
+        response = self.client.get(self.url, HTTP_RANGE="bytes=9-2")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_conditional_get(self):
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=f'"{self.sha256}"')
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["ETag"], f'"{self.sha256}"')
+
+        response = self.client.get(
+            self.url,
+            HTTP_IF_MODIFIED_SINCE=http_date(
+                self.file_obj.upload_timestamp.timestamp()
+            ),
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH='"something-else"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        with self.settings(FILE_DOWNLOAD_MODE=FileDownloadService.X_ACCEL_REDIRECT):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=f'"{self.sha256}"')
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertNotIn("X-Accel-Redirect", response)
+
+    def test_if_range(self):
+        response = self.client.get(
+            self.url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE=f'"{self.sha256}"'
+        )
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+
+        # the file changed since the client's copy, send it whole
+        response = self.client.get(
+            self.url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"old-version"'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_etag_without_stored_hash(self):
+        File.objects.filter(id=self.file_obj.id).update(content_sha256="")
+        response = self.client.get(self.url)
+
+        modified_time = os.path.getmtime(self.file_obj.file_content.path)
+        self.assertEqual(
+            response["ETag"], f'"{len(self.content):x}-{int(modified_time):x}"'
+        )
+
+
+class TestRoleClaims(FileTestSetUp):
+    def setUp(self):
+        super().setUp()
+        self.file_obj = File.objects.create(
+            user=self.ops_user_obj,
+            file_name="report",
+            file_content=ContentFile(make_office_document("docx"), name="report.docx"),
+            file_identifier="report-identifier",
+            content_sha256="0" * 64,
+        )
+        signed_identifier = URLSafeSerializer(settings.SECRET_KEY).dumps(
+            self.file_obj.file_identifier
+        )
+        self.url = reverse("download_file_view", args=[signed_identifier])
+
+    def test_token_carries_the_role(self):
+        ops_token = CustomTokenObtainPairSerializer.get_token(self.ops_user_obj)
+        client_token = CustomTokenObtainPairSerializer.get_token(self.client_user_obj)
+        self.assertEqual(ops_token.access_token[ROLE_CLAIM], OPS_USER_ROLE)
+        self.assertEqual(client_token.access_token[ROLE_CLAIM], CLIENT_USER_ROLE)
+
+    def test_download_only_queries_the_file(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.clinet_token}")
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_token_without_role_falls_back_to_user_details(self):
+        access_token = CustomTokenObtainPairSerializer.get_token(
+            self.client_user_obj
+        ).access_token
+        del access_token[ROLE_CLAIM]
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {access_token}")
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_roles_are_still_enforced(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.ops_token}")
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["code"], MessageCode.ACCESS_DENIED)
+        self.assertEqual(
+            response.data["errors"]["operation_user"],
+            ErrorMessage.ACCESS_DENIED_DOWNLOAD,
+        )
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.clinet_token}")
+        response = self.client.post(
+            reverse("file_multi_view"),
+            {"file_name": "deck", "file_content": SimpleUploadedFile("d.pptx", b"")},
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            response.data["errors"]["operation_user"],
+            ErrorMessage.ACCESS_DENIED_UPLOAD,
+        )
+        self.assertFalse(File.objects.filter(user=self.client_user_obj).exists())
+
+    def test_deactivated_users_only_keep_stateless_views(self):
+        self.ops_user_obj.is_active = False
+        self.ops_user_obj.save()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.ops_token}")
+
+        response = self.client.post(
+            reverse("file_multi_view"),
+            {
+                "file_name": "deck",
+                "file_content": SimpleUploadedFile("deck.pptx", make_office_document()),
+            },
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertFalse(File.objects.filter(file_name="deck").exists())
+
+        # the listing trusts the token until it expires
+        response = self.client.get(reverse("file_multi_view"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class TestBulkDownloadLinks(TestSetUp):
+    def setUp(self):
+        super().setUp()
+        self.file_objs = [
+            File.objects.create(
+                user=self.ops_user_obj,
+                file_name=f"file {index}",
+                file_content=f"uploads/file_{index}.pptx",
+                file_identifier=f"identifier-{index}",
+            )
+            for index in range(5)
+        ]
+        self.url = reverse("generate_download_links_view")
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.clinet_token}")
+
+    def test_links_match_the_single_link_view(self):
+        file_ids = [file_obj.id for file_obj in self.file_objs]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, {"file_ids": file_ids}, format="json")
+        # one query for the files, the bundle link is stored apart
+        file_queries, bundle_queries = split_bundle_queries(queries)
+        self.assertEqual(len(file_queries), 1)
+        self.assertEqual(len(bundle_queries), 2)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["errors"], {})
+        self.assertEqual(list(response.data["download_links"]), file_ids)
+        for file_obj in self.file_objs:
+            # both link routes share the name "download_file_view"
+            single = self.client.post(f"/api/genarate_link/{file_obj.id}/")
+            self.assertEqual(
+                response.data["download_links"][file_obj.id],
+                single.data["download_link"],
+            )
+
+    def test_missing_ids_are_reported_per_id(self):
+        missing_id = self.file_objs[-1].id + 100
+        response = self.client.post(
+            self.url,
+            {"file_ids": [self.file_objs[0].id, missing_id, self.file_objs[0].id]},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(response.data["download_links"]), [self.file_objs[0].id])
+        self.assertEqual(response.data["errors"], {missing_id: ErrorMessage.INVALID_ID})
+
+    def test_invalid_body(self):
+        for data in ({}, {"file_ids": []}, {"file_ids": ["abc"]}):
+            response = self.client.post(self.url, data, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestDeduplicatedStorage(FileTestSetUp):
+    def setUp(self):
+        super().setUp()
+        self.content = make_office_document("docx", payload=os.urandom(1000))
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.ops_token}")
+
+    def upload(self, file_name):
+        response = self.client.post(
+            reverse("file_multi_view"),
+            data={
+                "file_name": "document",
+                "file_content": SimpleUploadedFile(file_name, self.content),
+            },
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return File.objects.get(id=response.data["id"])
+
+    def stored_paths(self):
+        media_root = os.path.join(self.temp_dir, "media")
+        return [
+            os.path.join(root, name)
+            for root, _dirs, names in os.walk(media_root)
+            for name in names
+        ]
+
+    def test_identical_uploads_share_one_blob(self):
+        first = self.upload("template.docx")
+        second = self.upload("copy of template.docx")
+
+        blob = FileBlob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(blob.sha256, hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(first.file_content.name, second.file_content.name)
+        self.assertEqual(
+            first.file_content.name, f"blobs/{blob.sha256[:2]}/{blob.sha256}.docx"
+        )
+        self.assertNotEqual(first.file_identifier, second.file_identifier)
+        self.assertEqual(len(self.stored_paths()), 1)
+
+    def test_download_uses_the_uploaded_name(self):
+        file_obj = self.upload("template.docx")
+        signed_identifier = URLSafeSerializer(settings.SECRET_KEY).dumps(
+            file_obj.file_identifier
+        )
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.clinet_token}")
+        response = self.client.get(
+            reverse("download_file_view", args=[signed_identifier])
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response["Content-Disposition"], 'inline; filename="template.docx"'
+        )
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+
+    def test_chunked_upload_reuses_the_blob(self):
+        self.upload("template.docx")
+
+        response = self.client.post(
+            reverse("upload_session_view"),
+            data={
+                "file_name": "deck",
+                "original_name": "again.docx",
+                "total_size": len(self.content),
+            },
+            format="json",
+        )
+        session_id = response.data["id"]
+        self.client.put(
+            reverse("upload_session_detail_view", args=[session_id]) + "?offset=0",
+            data=self.content,
+            content_type="application/octet-stream",
+        )
+        response = self.client.post(
+            reverse("upload_session_finalize_view", args=[session_id])
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.assertEqual(FileBlob.objects.get().ref_count, 2)
+        self.assertEqual(len(self.stored_paths()), 1)
+        self.assertEqual(os.listdir(os.path.join(self.temp_dir, "chunks")), [])
+
+    def test_blob_is_removed_with_the_last_reference(self):
+        first = self.upload("template.docx")
+        second = self.upload("template.docx")
+        (stored_path,) = self.stored_paths()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(FileBlob.objects.get().ref_count, 1)
+        self.assertTrue(os.path.exists(stored_path))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            File.objects.filter(id=second.id).delete()
+        self.assertFalse(FileBlob.objects.exists())
+        self.assertFalse(os.path.exists(stored_path))
+
+
+class FakeS3Client:
+    """In-process stand-in for the boto3 S3 client calls S3Storage makes."""
+
+    class Body(BytesIO):
+        pass
+
+    def __init__(self):
+        self.objects = {}
+        self.checksums = {}
+        self.policies = {}
+        self.calls = []
+
+    def not_found(self, operation):
+        return ClientError({"Error": {"Code": "404"}}, operation)
+
+    def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None):
+        self.calls.append("upload_fileobj")
+        self.objects[(bucket, key)] = (fileobj.read(), timezone.now())
+
+    def head_object(self, Bucket, Key, ChecksumMode=None):
+        self.calls.append("head_object")
+        if (Bucket, Key) not in self.objects:
+            raise self.not_found("HeadObject")
+        data, modified_time = self.objects[(Bucket, Key)]
+        head = {"ContentLength": len(data), "LastModified": modified_time}
+        if ChecksumMode == "ENABLED" and (Bucket, Key) in self.checksums:
+            head["ChecksumSHA256"] = self.checksums[(Bucket, Key)]
+        return head
+
+    def get_object(self, Bucket, Key, Range=None):
+        self.calls.append(f"get_object {Range}")
+        data, _modified_time = self.objects[(Bucket, Key)]
+        if Range:
+            data = data[int(Range[len("bytes=") : -1]) :]
+        return {"Body": self.Body(data)}
+
+    def delete_object(self, Bucket, Key):
+        self.calls.append("delete_object")
+        self.objects.pop((Bucket, Key), None)
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn):
+        return f"https://{Params['Bucket']}.s3/{Params['Key']}?expires={ExpiresIn}"
+
+    def generate_presigned_post(self, Bucket, Key, Fields, Conditions, ExpiresIn):
+        self.policies[(Bucket, Key)] = Conditions
+        return {
+            "url": f"https://{Bucket}.s3/",
+            "fields": {**Fields, "key": Key, "policy": "signed-policy"},
+        }
+
+    def post_object(self, presigned_post, data):
+        """What S3 does with a client's form POST of ``data``."""
+        bucket = presigned_post["url"][len("https://") : -len(".s3/")]
+        fields = presigned_post["fields"]
+        key = fields["key"]
+        for condition in self.policies[(bucket, key)]:
+            if isinstance(condition, list):
+                _name, minimum, maximum = condition
+                if not minimum <= len(data) <= maximum:
+                    raise ClientError({"Error": {"Code": "EntityTooLarge"}}, "Post")
+        checksum = base64.b64encode(hashlib.sha256(data).digest()).decode()
+        if fields["x-amz-checksum-sha256"] != checksum:
+            raise ClientError({"Error": {"Code": "BadDigest"}}, "Post")
+        self.objects[(bucket, key)] = (data, timezone.now())
+        self.checksums[(bucket, key)] = checksum
+
+
+@override_settings(
+    STORAGES={
+        "default": {"BACKEND": "file.storage.S3Storage"},
+        "staticfiles": {
+            "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"
+        },
+    },
+    AWS_STORAGE_BUCKET_NAME="documents",
+    AWS_LOCATION="private",
+)
+class TestS3Storage(FileTestSetUp):
+    def setUp(self):
+        super().setUp()
+        self.s3_client = FakeS3Client()
+        self.get_s3_client = storage.get_s3_client
+        client_patch = mock.patch.object(
+            storage, "get_s3_client", return_value=self.s3_client
+        )
+        client_patch.start()
+        self.addCleanup(client_patch.stop)
+        presigned_url_cache.clear()
+        self.content = make_office_document("xlsx", payload=os.urandom(1000))
+
+    def upload(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.ops_token}")
+        response = self.client.post(
+            reverse("file_multi_view"),
+            data={
+                "file_name": "sheet",
+                "file_content": SimpleUploadedFile("sheet.xlsx", self.content),
+            },
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return File.objects.get(id=response.data["id"])
+
+    def test_upload_and_download_go_through_the_bucket(self):
+        file_obj = self.upload()
+        key = f"private/{file_obj.file_content.name}"
+        self.assertEqual(self.s3_client.objects[("documents", key)][0], self.content)
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, "media")))
+
+        signed_identifier = URLSafeSerializer(settings.SECRET_KEY).dumps(
+            file_obj.file_identifier
+        )
+        url = reverse("download_file_view", args=[signed_identifier])
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.clinet_token}")
+
+        # no local path, so even x-sendfile mode streams from the bucket
+        with self.settings(FILE_DOWNLOAD_MODE=FileDownloadService.X_SENDFILE):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("X-Sendfile", response)
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+
+        self.s3_client.calls.clear()
+        response = self.client.get(url, HTTP_RANGE="bytes=100-")
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b"".join(response.streaming_content), self.content[100:])
+        # one ranged GET, not the whole object
+        self.assertIn("get_object bytes=100-", self.s3_client.calls)
+        self.assertNotIn("get_object None", self.s3_client.calls)
+
+    def test_presigned_url_and_delete(self):
+        file_obj = self.upload()
+        key = f"private/{file_obj.file_content.name}"
+
+        url = FilePreSignedUrlService(file_obj).generate_presigned_download_url_config()
+        self.assertEqual(url, f"https://documents.s3/{key}?expires=3600")
+        self.assertEqual(
+            FilePreSignedUrlService(file_obj).generate_presigned_download_url_config(),
+            url,
+        )
+        self.assertEqual(presigned_url_cache.get_stats()["hits"], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            file_obj.delete()
+        self.assertEqual(self.s3_client.objects, {})
+
+    def test_client_is_shared(self):
+        self.assertIs(default_storage.__class__, storage.S3Storage)
+        with mock.patch.object(storage, "_s3_client", None), mock.patch.object(
+            storage.boto3.session, "Session"
+        ) as session:
+            first = self.get_s3_client()
+            second = self.get_s3_client()
+        self.assertIs(first, second)
+        session.assert_called_once()
+
+
+class TestPresignedUrlCache(SimpleTestCase):
+    class Storage:
+        def __init__(self):
+            self.signed = 0
+
+        def url(self, name):
+            self.signed += 1
+            return f"https://bucket.s3/{name}?signature={self.signed}"
+
+    def setUp(self):
+        self.now = 1_000_000.0
+        self.storage = self.Storage()
+
+    def make_cache(self, **kwargs):
+        kwargs.setdefault("max_size", 100)
+        kwargs.setdefault("min_remaining", 900)
+        return PresignedUrlCache(clock=lambda: self.now, **kwargs)
+
+    def test_url_is_reused_while_enough_lifetime_is_left(self):
+        url_cache = self.make_cache()
+        issued = {}
+        # one hour URLs, over three hours of requests
+        for _second in range(0, 3 * 3600, 60):
+            url = url_cache.get_url(self.storage, "a.docx", 3600)
+            issued.setdefault(url, self.now)
+            # every URL handed out is valid for at least 15 more minutes
+            self.assertGreaterEqual(issued[url] + 3600 - self.now, 900)
+            self.now += 60
+
+        self.assertLessEqual(self.storage.signed, 5)
+        self.assertEqual(url_cache.get_stats()["misses"], self.storage.signed)
+        self.assertEqual(url_cache.get_stats()["hits"], 180 - self.storage.signed)
+
+    def test_files_are_cached_separately_and_evicted_lru(self):
+        url_cache = self.make_cache(max_size=2)
+        url_cache.get_url(self.storage, "a.docx", 3600)
+        url_cache.get_url(self.storage, "b.docx", 3600)
+        url_cache.get_url(self.storage, "a.docx", 3600)
+        url_cache.get_url(self.storage, "c.docx", 3600)  # evicts b
+        self.assertEqual(self.storage.signed, 3)
+
+        url_cache.get_url(self.storage, "a.docx", 3600)
+        self.assertEqual(self.storage.signed, 3)
+        url_cache.get_url(self.storage, "b.docx", 3600)
+        self.assertEqual(self.storage.signed, 4)
+        self.assertEqual(url_cache.get_stats()["size"], 2)
+
+    def test_shared_cache_backend(self):
+        self.addCleanup(cache.clear)
+        first = self.make_cache(cache_alias="default")
+        second = self.make_cache(cache_alias="default")
+        url = first.get_url(self.storage, "shared.docx", 3600)
+        self.assertEqual(second.get_url(self.storage, "shared.docx", 3600), url)
+        self.assertEqual(self.storage.signed, 1)
+        self.assertEqual(second.get_stats(), {"hits": 1, "misses": 0, "size": 1})
+
+
+@override_settings(
+    STORAGES={
+        "default": {"BACKEND": "file.storage.S3Storage"},
+        "staticfiles": {
+            "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"
+        },
+    },
+    AWS_STORAGE_BUCKET_NAME="documents",
+)
+class TestDirectUpload(FileTestSetUp):
+    def setUp(self):
+        super().setUp()
+        self.s3_client = FakeS3Client()
+        client_patch = mock.patch.object(
+            storage, "get_s3_client", return_value=self.s3_client
+        )
+        client_patch.start()
+        self.addCleanup(client_patch.stop)
+        self.content = make_office_document("pptx", payload=os.urandom(1000))
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.ops_token}")
+
+    def initiate(self, content=None, original_name="deck.pptx"):
+        content = self.content if content is None else content
+        return self.client.post(
+            reverse("direct_upload_view"),
+            {
+                "file_name": "deck",
+                "original_name": original_name,
+                "size": len(content),
+                "sha256": hashlib.sha256(content).hexdigest(),
+            },
+            format="json",
+        )
+
+    def finalize(self, upload_token):
+        return self.client.post(
+            reverse("direct_upload_finalize_view"),
+            {"upload_token": upload_token},
+            format="json",
+        )
+
+    def test_upload_goes_straight_to_the_bucket(self):
+        response = self.initiate()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        fields = response.data["fields"]
+        self.assertEqual(
+            fields["Content-Type"],
+            "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+        )
+        self.assertEqual(
+            self.s3_client.policies[("documents", fields["key"])][-1],
+            ["content-length-range", len(self.content), len(self.content)],
+        )
+
+        # the worker never sees the bytes
+        self.s3_client.post_object(response.data, self.content)
+        self.s3_client.calls.clear()
+        response = self.finalize(response.data["upload_token"])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        file_obj = File.objects.get(id=response.data["id"])
+        self.assertEqual(file_obj.user, self.ops_user_obj)
+        self.assertEqual(file_obj.original_name, "deck.pptx")
+        self.assertEqual(file_obj.file_content.name, fields["key"])
+        self.assertEqual(
+            file_obj.content_sha256, hashlib.sha256(self.content).hexdigest()
+        )
+        # the checksum came from S3, only the sniffed prefix was read
+        self.assertEqual(self.s3_client.calls.count("get_object None"), 1)
+
+    def test_finalize_checks_the_token_and_the_object(self):
+        response = self.initiate()
+        upload_token = response.data["upload_token"]
+
+        # not uploaded yet
+        response = self.finalize(upload_token)
+        self.assertEqual(response.data["code"], MessageCode.UPLOAD_NOT_FOUND)
+
+        response = self.finalize(upload_token + "x")
+        self.assertEqual(response.data["code"], MessageCode.INVALID_UPLOAD_TOKEN)
+
+        # only the ops user that asked for the upload can finalize it
+        other_ops_user = User.objects.create(
+            email="other@ops.com", username="other@ops.com"
+        )
+        UserDetails.objects.create(user=other_ops_user, is_ops_user=True)
+        self.client.credentials(
+            HTTP_AUTHORIZATION="Bearer "
+            f"{CustomTokenObtainPairSerializer.get_token(other_ops_user).access_token}"
+        )
+        response = self.finalize(upload_token)
+        self.assertEqual(response.data["code"], MessageCode.INVALID_UPLOAD_TOKEN)
+        self.assertFalse(File.objects.exists())
+
+    def test_finalize_twice_and_duplicates(self):
+        first = self.initiate()
+        self.s3_client.post_object(first.data, self.content)
+        self.assertEqual(
+            self.finalize(first.data["upload_token"]).status_code,
+            status.HTTP_201_CREATED,
+        )
+        response = self.finalize(first.data["upload_token"])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        second = self.initiate()
+        self.s3_client.post_object(second.data, self.content)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.finalize(second.data["upload_token"])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # the second copy is dropped, both files share the first one
+        self.assertEqual(FileBlob.objects.get().ref_count, 2)
+        self.assertEqual(len(self.s3_client.objects), 1)
+
+    def test_content_that_is_not_an_office_document_is_deleted(self):
+        content = b"%PDF-1.7\n" + os.urandom(100)
+        response = self.initiate(content)
+        self.s3_client.post_object(response.data, content)
+
+        response = self.finalize(response.data["upload_token"])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            response.data["errors"]["file_type"], ErrorMessage.INVALID_FILE_CONTENT
+        )
+        self.assertEqual(self.s3_client.objects, {})
+
+    def test_storage_rejects_other_bytes(self):
+        response = self.initiate()
+        with self.assertRaises(ClientError):
+            self.s3_client.post_object(response.data, self.content[:-1] + b"!")
+        with self.assertRaises(ClientError):
+            self.s3_client.post_object(response.data, self.content + b"!")
+
+    @override_settings(
+        STORAGES={
+            "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+            "staticfiles": {
+                "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"
+            },
+        }
+    )
+    def test_local_storage_has_no_direct_uploads(self):
+        response = self.initiate()
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["code"], MessageCode.DIRECT_UPLOAD_UNAVAILABLE)
+
+
+class TestAsyncViews(FileTestSetUp):
+    def setUp(self):
+        super().setUp()
+        self.content = bytes(range(256)) * 1000
+        self.file_obj = File.objects.create(
+            user=self.ops_user_obj,
+            file_name="sheet",
+            file_content=ContentFile(self.content, name="sheet.xlsx"),
+            file_identifier="sheet-identifier",
+            content_sha256=hashlib.sha256(self.content).hexdigest(),
+        )
+        for index in range(15):
+            File.objects.create(
+                user=self.ops_user_obj,
+                file_name=f"file {index}",
+                file_content=f"uploads/file_{index}.pptx",
+                file_identifier=f"identifier-{index}",
+            )
+        signed_identifier = URLSafeSerializer(settings.SECRET_KEY).dumps(
+            self.file_obj.file_identifier
+        )
+        self.download_urls = (
+            reverse("download_file_view", args=[signed_identifier]),
+            reverse("async_download_file_view", args=[signed_identifier]),
+        )
+        self.client_headers = {"authorization": f"Bearer {self.clinet_token}"}
+
+    async def read(self, response):
+        self.assertTrue(response.is_async)
+        return b"".join([chunk async for chunk in response.streaming_content])
+
+    async def test_download_matches_the_sync_view(self):
+        sync_url, async_url = self.download_urls
+        for extra in ({}, {"range": "bytes=100-199"}, {"range": "bytes=0-9,-10"}):
+            headers = {**self.client_headers, **extra}
+            response = await self.async_client.get(async_url, headers=headers)
+            expected = await sync_to_async(self.client.get)(sync_url, headers=headers)
+
+            self.assertEqual(response.status_code, expected.status_code)
+            for header in ("Content-Length", "Content-Disposition", "ETag"):
+                self.assertEqual(response[header], expected[header])
+            body = await self.read(response)
+            expected_body = b"".join(expected.streaming_content)
+            if "multipart" in response["Content-Type"]:
+                # only the random boundary differs
+                boundary = response["Content-Type"].split("boundary=")[1]
+                expected_boundary = expected["Content-Type"].split("boundary=")[1]
+                body = body.replace(boundary.encode(), expected_boundary.encode())
+            self.assertEqual(body, expected_body)
+
+        response = await self.async_client.get(
+            async_url,
+            headers={**self.client_headers, "if-none-match": response["ETag"]},
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    async def test_download_checks_token_and_role(self):
+        _sync_url, async_url = self.download_urls
+        response = await self.async_client.get(async_url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        response = await self.async_client.get(
+            async_url, headers={"authorization": "Bearer not-a-token"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        response = await self.async_client.get(
+            async_url, headers={"authorization": f"Bearer {self.ops_token}"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            json.loads(response.content)["code"], MessageCode.ACCESS_DENIED
+        )
+
+        response = await self.async_client.get(
+            reverse("async_download_file_view", args=["bad-signature"]),
+            headers=self.client_headers,
+        )
+        self.assertEqual(json.loads(response.content)["code"], MessageCode.INVALID_ID)
+
+    async def test_listing_and_export_match_the_sync_views(self):
+        url = reverse("async_file_list_view") + "?page_size=10"
+        pages = []
+        while url:
+            response = await self.async_client.get(url, headers=self.client_headers)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            page = json.loads(response.content)
+            pages.extend(row["id"] for row in page["results"])
+            url = page["next"]
+        expected_ids = await sync_to_async(list)(
+            File.objects.order_by("-id").values_list("id", flat=True)
+        )
+        self.assertEqual(pages, expected_ids)
+
+        response = await self.async_client.get(
+            reverse("async_file_export_view"), headers=self.client_headers
+        )
+        expected = await sync_to_async(self.client.get)(
+            reverse("file_export_view"), headers=self.client_headers
+        )
+        expected_body = await sync_to_async(b"".join)(expected.streaming_content)
+        self.assertEqual(await self.read(response), expected_body)
+
+
+def split_bundle_queries(queries):
+    """(other, FileBundle) SQL of captured queries, without savepoints."""
+    statements = [
+        query["sql"]
+        for query in queries.captured_queries
+        if "SAVEPOINT" not in query["sql"]
+    ]
+    return (
+        [sql for sql in statements if "file_filebundle" not in sql],
+        [sql for sql in statements if "file_filebundle" in sql],
+    )
+
+
+class TestBundleDownload(FileTestSetUp):
+    def setUp(self):
+        super().setUp()
+        self.contents = [os.urandom(150 * 1024), b"second", b"third"]
+        self.file_objs = [
+            File.objects.create(
+                user=self.ops_user_obj,
+                file_name=file_name,
+                file_content=ContentFile(content, name=f"file_{index}.bin"),
+                file_identifier=f"identifier-{index}",
+                original_name=file_name,
+            )
+            for index, (file_name, content) in enumerate(
+                zip(["report.docx", "report.docx", "../sheet.xlsx"], self.contents)
+            )
+        ]
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.clinet_token}")
+
+    def get_bundle_link(self, file_objs):
+        response = self.client.post(
+            reverse("generate_download_links_view"),
+            {"file_ids": [file_obj.id for file_obj in file_objs]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data["bundle_link"].split("/api")[1]
+
+    def test_bundle_contains_every_file_stored(self):
+        response = self.client.get("/api" + self.get_bundle_link(self.file_objs))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "application/zip")
+        self.assertIn("documents.zip", response["Content-Disposition"])
+        chunks = list(response.streaming_content)
+        # the archive is sent block by block, never built in memory
+        self.assertLess(max(len(chunk) for chunk in chunks), 80 * 1024)
+
+        with zipfile.ZipFile(BytesIO(b"".join(chunks))) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(
+                archive.namelist(), ["report.docx", "report (2).docx", ".._sheet.xlsx"]
+            )
+            for info, content in zip(archive.infolist(), self.contents):
+                self.assertEqual(info.compress_type, zipfile.ZIP_STORED)
+                self.assertEqual(archive.read(info), content)
+
+    def test_bundle_link_is_client_only_and_signed(self):
+        bundle_url = "/api" + self.get_bundle_link(self.file_objs[:1])
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.ops_token}")
+        response = self.client.get(bundle_url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["code"], MessageCode.ACCESS_DENIED)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.clinet_token}")
+        response = self.client.get(reverse("download_bundle_view", args=["bad"]))
+        self.assertEqual(response.data["code"], MessageCode.INVALID_ID)
+
+        # a file deleted after the link was made
+        self.file_objs[0].delete()
+        response = self.client.get(bundle_url)
+        self.assertEqual(response.data["code"], MessageCode.INVALID_ID)
+
+    @override_settings(FILE_BUNDLE_MAX_FILES=100)
+    def test_bundle_link_stays_short_at_the_cap(self):
+        file_objs = File.objects.bulk_create(
+            File(
+                user=self.ops_user_obj,
+                file_name=f"file {index}",
+                file_content=f"uploads/file_{index}.bin",
+                file_identifier=f"{'x' * 200}-{index}",
+            )
+            for index in range(100)
+        )
+
+        bundle_link = self.get_bundle_link(file_objs)
+        # the identifiers stay on the server, the link only signs a token
+        self.assertLess(len(bundle_link), 200)
+        self.assertEqual(
+            FileBundle.objects.get().file_identifiers,
+            [file_obj.file_identifier for file_obj in file_objs],
+        )
+
+        response = self.client.post(
+            reverse("generate_download_links_view"),
+            {"file_ids": [file_obj.id for file_obj in file_objs + self.file_objs[:1]]},
+            format="json",
+        )
+        self.assertEqual(len(response.data["download_links"]), 101)
+        self.assertIsNone(response.data["bundle_link"])
+
+    def test_identical_bundles_are_reused_and_expire(self):
+        bundle_url = "/api" + self.get_bundle_link(self.file_objs)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual("/api" + self.get_bundle_link(self.file_objs), bundle_url)
+        self.assertEqual(len(split_bundle_queries(queries)[1]), 1)
+        # another order is another archive
+        self.assertNotEqual(
+            "/api" + self.get_bundle_link(self.file_objs[::-1]), bundle_url
+        )
+        self.assertEqual(FileBundle.objects.count(), 2)
+
+        # reused past half its life, a bundle is renewed
+        FileBundle.objects.update(
+            created_at=timezone.now() - settings.FILE_BUNDLE_EXPIRY * 3 / 4
+        )
+        self.assertEqual("/api" + self.get_bundle_link(self.file_objs), bundle_url)
+        self.assertEqual(
+            FileBundle.objects.filter(
+                created_at__gt=timezone.now() - timedelta(minutes=1)
+            ).count(),
+            1,
+        )
+
+        FileBundle.objects.update(
+            created_at=timezone.now() - settings.FILE_BUNDLE_EXPIRY * 2
+        )
+        response = self.client.get(bundle_url)
+        self.assertEqual(response.data["code"], MessageCode.INVALID_ID)
+
+        out = StringIO()
+        call_command("clear_file_bundles", stdout=out)
+        self.assertIn("deleted 2 expired bundles", out.getvalue())
+        self.assertFalse(FileBundle.objects.exists())
+
+
+class TestPreviewExtraction(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir, ignore_errors=True)
+
+    def preview(self, kind, document, text_length=50, max_part_size=1024 * 1024):
+        path = os.path.join(self.temp_dir, f"document.{kind}")
+        with open(path, "wb") as document_file:
+            document_file.write(document)
+        return generate_preview(path, kind, 10, text_length, max_part_size)
+
+    def test_first_page_text_and_embedded_thumbnail(self):
+        for kind in ("docx", "pptx", "xlsx"):
+            with self.subTest(kind=kind):
+                document = make_previewable_document(
+                    kind, ["Quarterly  report", "Revenue\nup"] + ["filler"] * 100
+                )
+                thumbnail, extension, text, search_text = self.preview(kind, document)
+                self.assertIsNone(thumbnail)
+                self.assertEqual(search_text, "")
+                self.assertTrue(text.startswith("Quarterly report Revenue up filler"))
+                self.assertEqual(len(text), 50)
+
+        document = make_previewable_document("docx", ["a"], thumbnail=b"jpeg bytes")
+        self.assertEqual(
+            self.preview("docx", document), (b"jpeg bytes", ".jpeg", "a", "")
+        )
+
+    def test_search_text_of_the_whole_document(self):
+        path = os.path.join(self.temp_dir, "document.pptx")
+        with open(path, "wb") as document_file:
+            document_file.write(
+                make_previewable_document("pptx", ["Roadmap", "2025", "hiring"])
+            )
+        _thumbnail, _extension, text, search_text = generate_preview(
+            path, "pptx", 10, 7, 1024 * 1024, search_text_length=100
+        )
+        self.assertEqual(text, "Roadmap")
+        self.assertEqual(search_text, "Roadmap 2025 hiring")
+
+    def test_limits(self):
+        document = make_previewable_document("docx", ["word"] * 1000)
+        with self.assertRaises(PreviewError):
+            self.preview("docx", document, max_part_size=1000)
+        with self.assertRaises(PreviewError):
+            self.preview("docx", b"not a zip file")
+
+        with self.assertRaises(PreviewTimeout):
+            with time_limit(0.05):
+                while True:
+                    pass
+
+
+class TestFilePreviews(FileTestSetUp):
+    def setUp(self):
+        super().setUp()
+        self.content = make_previewable_document(
+            "pptx", ["Roadmap", "2025"], thumbnail=b"jpeg bytes"
+        )
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.ops_token}")
+
+    def upload(self, file_name="roadmap.pptx"):
+        response = self.client.post(
+            reverse("file_multi_view"),
+            data={
+                "file_name": "document",
+                "file_content": SimpleUploadedFile(file_name, self.content),
+            },
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data["id"]
+
+    def test_identical_uploads_share_one_preview_job(self):
+        file_id = self.upload()
+        self.upload("copy.pptx")
+
+        preview = FilePreview.objects.get()
+        self.assertEqual(preview.status, FilePreview.STATUS_PENDING)
+        response = self.client.get(reverse("file_preview_view", args=[file_id]))
+        self.assertEqual(response.data["status"], FilePreview.STATUS_PENDING)
+        response = self.client.get(
+            reverse("file_preview_thumbnail_view", args=[file_id])
+        )
+        self.assertEqual(response.data["code"], MessageCode.PREVIEW_NOT_READY)
+
+        self.assertEqual(generate_pending_previews(workers=1), (1, 0))
+        # a generated preview is not queued again
+        self.upload("third copy.pptx")
+        self.assertEqual(generate_pending_previews(workers=1), (0, 0))
+
+    def test_preview_endpoints_serve_the_generated_preview(self):
+        file_id = self.upload()
+        call_command("generate_file_previews", "--workers=1", stdout=StringIO())
+
+        response = self.client.get(reverse("file_preview_view", args=[file_id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["status"], FilePreview.STATUS_READY)
+        self.assertEqual(response.data["text"], "Roadmap 2025")
+        self.assertTrue(
+            response.data["thumbnail_link"].endswith(
+                f"/api/file/{file_id}/preview/thumbnail/"
+            )
+        )
+
+        thumbnail_url = reverse("file_preview_thumbnail_view", args=[file_id])
+        response = self.client.get(thumbnail_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        self.assertEqual(b"".join(response.streaming_content), b"jpeg bytes")
+        response = self.client.get(thumbnail_url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = self.client.get(reverse("file_preview_view", args=[file_id + 1]))
+        self.assertEqual(response.data["code"], MessageCode.INVALID_ID)
+
+    def test_failed_jobs_are_retried_then_marked_failed(self):
+        self.upload()
+        with self.settings(FILE_PREVIEW_MAX_PART_SIZE=10, FILE_PREVIEW_MAX_ATTEMPTS=2):
+            self.assertEqual(generate_pending_previews(workers=1), (0, 1))
+            preview = FilePreview.objects.get()
+            self.assertEqual(preview.status, FilePreview.STATUS_PENDING)
+            self.assertIn("PreviewError", preview.last_error)
+
+            # not due again until the retry delay has passed
+            self.assertEqual(generate_pending_previews(workers=1), (0, 0))
+            preview.next_attempt_at = timezone.now()
+            preview.save()
+            self.assertEqual(generate_pending_previews(workers=1), (0, 1))
+            preview.refresh_from_db()
+            self.assertEqual(preview.status, FilePreview.STATUS_FAILED)
+
+    def test_preview_is_deleted_with_the_last_file(self):
+        file_id = self.upload()
+        generate_pending_previews(workers=1)
+        thumbnail_path = FilePreview.objects.get().thumbnail.path
+        self.assertTrue(os.path.exists(thumbnail_path))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            File.objects.get(id=file_id).delete()
+        self.assertFalse(FilePreview.objects.exists())
+        self.assertFalse(os.path.exists(thumbnail_path))
+
+
+class TestFileSearch(FileTestSetUp):
+    def setUp(self):
+        super().setUp()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.ops_token}")
+
+    def upload(self, file_name, kind, texts):
+        response = self.client.post(
+            reverse("file_multi_view"),
+            data={
+                "file_name": file_name,
+                "file_content": SimpleUploadedFile(
+                    f"{file_name}.{kind}", make_previewable_document(kind, texts)
+                ),
+            },
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data["id"]
+
+    def search(self, q, **params):
+        response = self.client.get(reverse("file_search_view"), data={"q": q, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def test_uploads_are_searchable_by_name_and_content(self):
+        budget_id = self.upload("budget", "xlsx", ["Marketing", "1200"])
+        plan_id = self.upload("plan", "docx", ["Marketing budgets for spring"])
+        slides_id = self.upload("slides", "pptx", ["Hiring plan"])
+        # names are searchable at once, contents once the preview jobs ran
+        self.assertEqual(self.search("marketing").data["count"], 0)
+        self.assertEqual(generate_pending_previews(workers=1), (3, 0))
+
+        response = self.search("budget")
+        # the title match ranks first, "budgets" matches through stemming
+        self.assertEqual(
+            [hit["id"] for hit in response.data["results"]], [budget_id, plan_id]
+        )
+        self.assertGreater(
+            response.data["results"][0]["rank"], response.data["results"][1]["rank"]
+        )
+        self.assertEqual(response.data["results"][0]["file_name"], "budget")
+
+        self.assertEqual(
+            [hit["id"] for hit in self.search("hiring plan").data["results"]],
+            [slides_id],
+        )
+        self.assertEqual(self.search('"" OR *').data["count"], 0)
+
+        page = self.search("marketing", page_size=1)
+        self.assertEqual(page.data["count"], 2)
+        self.assertEqual(len(page.data["results"]), 1)
+        self.assertIsNotNone(page.data["next"])
+
+        File.objects.get(id=plan_id).delete()
+        self.assertEqual(self.search("marketing").data["count"], 1)
+
+        response = self.client.get(reverse("file_search_view"))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_a_hanging_parser_does_not_block_uploads(self):
+        def hang(*args):
+            time.sleep(10)
+
+        with mock.patch("file.search.extract_text", side_effect=hang) as parser:
+            started = time.monotonic()
+            file_id = self.upload("notes", "docx", ["Meeting notes"])
+        self.assertLess(time.monotonic() - started, 5)
+        parser.assert_not_called()
+        self.assertEqual(
+            [hit["id"] for hit in self.search("notes").data["results"]], [file_id]
+        )
+
+        # a copy reuses the body extracted for the first upload
+        generate_pending_previews(workers=1)
+        copy_id = self.upload("copy", "docx", ["Meeting notes"])
+        self.assertEqual(
+            [hit["id"] for hit in self.search("meeting").data["results"]],
+            [copy_id, file_id],
+        )
+
+    def test_renamed_files_are_found_by_their_new_name(self):
+        file_id = self.upload("draft", "docx", ["Contract"])
+        self.assertEqual(self.search("agreement").data["count"], 0)
+
+        file_obj = File.objects.get(id=file_id)
+        file_obj.file_name = "signed agreement"
+        file_obj.save(update_fields=["file_name"])
+        self.assertEqual(
+            [hit["id"] for hit in self.search("agreement").data["results"]], [file_id]
+        )
+
+    def test_reindex_covers_existing_files(self):
+        document = make_previewable_document("docx", ["Invoice", "overdue"])
+        for index in range(3):
+            File.objects.create(
+                user=self.ops_user_obj,
+                file_name=f"legacy {index}",
+                file_content=ContentFile(document, name=f"legacy_{index}.docx"),
+                file_identifier=f"legacy-{index}",
+            )
+        self.assertEqual(self.search("invoice").data["count"], 0)
+
+        out = StringIO()
+        call_command("reindex_files", "--workers=1", "--batch-size=2", stdout=out)
+        self.assertIn("indexed 3 files", out.getvalue())
+        self.assertEqual(self.search("overdue invoice").data["count"], 3)
+
+        # reindexing replaces, rather than duplicates, search documents
+        self.assertEqual(reindex_files(workers=1), 3)
+        self.assertEqual(self.search("invoice").data["count"], 3)
+
+
+@override_settings(QUERY_COUNT_HEADER=True)
+class TestBenchmark(LiveServerTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.mkdtemp()
+        cls.settings_override = override_settings(
+            MEDIA_ROOT=os.path.join(cls.temp_dir, "media"),
+            CHUNKED_UPLOAD_DIR=os.path.join(cls.temp_dir, "chunks"),
+        )
+        cls.settings_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.settings_override.disable()
+        shutil.rmtree(cls.temp_dir, ignore_errors=True)
+
+    def test_mix_from_postman_collection(self):
+        mix = load_mix(
+            settings.BASE_DIR
+            / "postmancollection"
+            / "ez_assignment.postman_collection.json",
+            {"get_all_files": 5, "client_register": 0},
+        )
+        self.assertEqual(set(mix), set(SCENARIOS) - {"client_register"})
+        self.assertEqual(mix["get_all_files"][0], 5)
+        self.assertIs(mix["upload file"][1], SCENARIOS["upload file"])
+
+        with self.assertRaises(ValueError):
+            load_mix(
+                settings.BASE_DIR
+                / "postmancollection"
+                / "ez_assignment.postman_collection.json",
+                {"no such request": 1},
+            )
+
+    def test_summary_and_comparison(self):
+        samples = [
+            Sample("GET /api/file/", 200, index / 1000, 1, None)
+            for index in range(1, 101)
+        ]
+        samples.append(Sample("POST /api/auth/login/", None, 0.5, None, "refused"))
+        summary = summarize(samples, 2.0)
+
+        listing = summary["routes"]["GET /api/file/"]
+        self.assertEqual(listing["requests"], 100)
+        self.assertEqual(listing["errors"], 0)
+        self.assertEqual(listing["throughput"], 50)
+        self.assertAlmostEqual(listing["latency_ms"]["p50"], 50.5)
+        self.assertAlmostEqual(listing["latency_ms"]["p99"], 99.01)
+        self.assertEqual(listing["queries_per_request"], 1)
+        self.assertEqual(summary["total"]["errors"], 1)
+        self.assertEqual(summary["total"]["statuses"], {"200": 100, "error": 1})
+
+        self.assertEqual(compare_results(summary, summary, 0.1), [])
+        slower = summarize(
+            [sample._replace(seconds=sample.seconds * 2) for sample in samples], 2.0
+        )
+        regressions = compare_results(summary, slower, 0.1)
+        self.assertTrue(
+            any(message.startswith("GET /api/file/: p95") for message in regressions)
+        )
+
+    def assertSuccessful(self, route, statuses):
+        self.assertTrue(
+            all(code[0] in "23" for code in statuses), f"{route}: {statuses}"
+        )
+
+    def test_benchmark_drives_every_route(self):
+        output = os.path.join(self.temp_dir, "results.json")
+        call_command(
+            "benchmark_api",
+            base_url=self.live_server_url,
+            users=2,
+            files=5,
+            concurrency=1,
+            requests=10,
+            seed=1,
+            output=output,
+            stdout=StringIO(),
+        )
+        with open(output) as results_file:
+            results = json.load(results_file)
+
+        self.assertEqual(results["total"]["errors"], 0)
+        self.assertGreaterEqual(results["total"]["requests"], 10)
+        self.assertEqual(results["config"]["database"], "sqlite")
+        for route, stats in results["routes"].items():
+            self.assertIsNotNone(stats["queries_per_request"])
+            self.assertSuccessful(route, stats["statuses"])
+
+        # every scenario once: a route the weighted picks miss must work too
+        fixtures = seed(2, 5)
+        mix = load_mix(
+            settings.BASE_DIR
+            / "postmancollection"
+            / "ez_assignment.postman_collection.json"
+        )
+        client = BenchmarkClient(self.live_server_url, 30)
+        rng = random.Random(1)
+        for _weight, func in mix.values():
+            func(client, fixtures, rng)
+        client.close()
+        summary = summarize(client.samples, 1.0)
+        self.assertGreaterEqual(len(summary["routes"]), len(SCENARIOS))
+        self.assertIn("GET /api/download_bundle/<signed_token>/", summary["routes"])
+        for route, stats in summary["routes"].items():
+            self.assertSuccessful(route, stats["statuses"])
+        seeded_files = File.objects.filter(file_identifier__startswith="benchmark-")
+        self.assertEqual(seeded_files.count(), 5)
+        self.assertEqual(
+            FilePreview.objects.get(sha256=seeded_files[0].content_sha256).status,
+            FilePreview.STATUS_READY,
+        )
+
+        # an identical run is no regression of itself
+        out = StringIO()
+        call_command(
+            "benchmark_api",
+            base_url=self.live_server_url,
+            users=2,
+            files=5,
+            concurrency=1,
+            requests=10,
+            seed=1,
+            compare=output,
+            threshold=100,
+            stdout=out,
+        )
+        self.assertIn("no regressions", out.getvalue())
+
+
+def parse_server_timing(header):
+    """{name: (milliseconds, description)} of a Server-Timing header."""
+    metrics = {}
+    for metric in header.split(", "):
+        name, *params = metric.split(";")
+        params = dict(param.split("=", 1) for param in params)
+        metrics[name] = (float(params["dur"]), params.get("desc", "").strip('"'))
+    return metrics
+
+
+class TestRequestTimings(FileTestSetUp):
+    def setUp(self):
+        super().setUp()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.ops_token}")
+
+    def upload(self):
+        return self.client.post(
+            reverse("file_multi_view"),
+            {
+                "file_name": "roadmap",
+                "file_content": SimpleUploadedFile(
+                    "roadmap.docx", make_office_document("docx")
+                ),
+            },
+            format="multipart",
+        )
+
+    def test_server_timing_header(self):
+        response = self.upload()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        timings = parse_server_timing(response["Server-Timing"])
+        self.assertEqual(set(timings), {"db", "serialize", "storage", "total"})
+        self.assertGreater(int(timings["db"][1].split()[0]), 1)
+        # the stored blob, and the search indexer reading it back
+        self.assertGreaterEqual(int(timings["storage"][1].split()[0]), 2)
+        self.assertLessEqual(timings["db"][0], timings["total"][0])
+        self.assertNotIn("X-DB-Queries", response)
+
+        render = JSONRenderer.render
+
+        def slow_render(renderer, *args, **kwargs):
+            # rendering one file can take less than the 0.1 ms shown
+            time.sleep(0.001)
+            return render(renderer, *args, **kwargs)
+
+        with CaptureQueriesContext(connection) as queries, mock.patch.object(
+            JSONRenderer, "render", slow_render
+        ):
+            response = self.client.get(reverse("file_multi_view"))
+        query_count = len(queries)
+        timings = parse_server_timing(response["Server-Timing"])
+        self.assertEqual(timings["db"][1], f"{query_count} queries")
+        self.assertGreaterEqual(timings["serialize"][0], 1)
+        self.assertEqual(timings["storage"][1], "0 calls")
+
+        with override_settings(QUERY_COUNT_HEADER=True, SERVER_TIMING_HEADER=False):
+            response = self.client.get(reverse("file_multi_view"))
+        self.assertEqual(response["X-DB-Queries"], str(query_count))
+        self.assertNotIn("Server-Timing", response)
+
+    async def test_async_view_queries_are_timed(self):
+        # the test database connection was opened before the middleware was
+        # loaded, a sync request in its thread installs the query timer on it
+        # (a server only opens connections after loading the middleware)
+        await sync_to_async(self.client.get)(reverse("file_multi_view"))
+
+        response = await self.async_client.get(
+            reverse("async_file_list_view"),
+            headers={"authorization": f"Bearer {self.clinet_token}"},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        timings = parse_server_timing(response["Server-Timing"])
+        self.assertEqual(timings["db"][1], "1 queries")
+
+    def test_log_line_and_budgets(self):
+        with self.assertLogs("standard.middleware", "INFO") as logs:
+            self.client.get(reverse("file_multi_view"), {"user": 1})
+        self.assertEqual(logs.records[0].levelname, "INFO")
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line["route"], "api/file/")
+        self.assertEqual(line["status"], 200)
+        self.assertEqual(line["db_queries"], 1)
+        self.assertEqual(line["over_budget"], [])
+        # paths are not logged, they can carry signed download links
+        self.assertNotIn("user=1", logs.output[0])
+
+        with override_settings(PERFORMANCE_QUERY_BUDGET=1), self.assertLogs(
+            "standard.middleware", "WARNING"
+        ) as logs:
+            self.upload()
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line["over_budget"], ["queries"])
+        self.assertGreater(line["storage_calls"], 0)
+
+        with override_settings(PERFORMANCE_LATENCY_BUDGET_MS=0), self.assertLogs(
+            "standard.middleware", "INFO"
+        ) as logs:
+            self.upload()
+        self.assertEqual(logs.records[0].levelname, "INFO")
+
+
+def increment_in_other_process(counter, amount):
+    counter.inc(amount, kind="file")
+
+
+class TestMetrics(FileTestSetUp):
+    def setUp(self):
+        super().setUp()
+        self.content = make_office_document("docx", payload=os.urandom(100_000))
+
+    def get_value(self, sample_name, **labels):
+        return metrics.get_sample_value(sample_name, **labels)
+
+    def test_upload_link_and_download_metrics(self):
+        uploads = self.get_value("file_upload_bytes_count")
+        uploaded = self.get_value("file_upload_bytes_sum")
+        small_uploads = self.get_value("file_upload_bytes_bucket", le="65536")
+        medium_uploads = self.get_value("file_upload_bytes_bucket", le="262144")
+        links = self.get_value("file_download_links_total", kind="file")
+        bundles = self.get_value("file_download_links_total", kind="bundle")
+        downloads = self.get_value("file_download_seconds_count")
+        downloaded = self.get_value("file_download_bytes_sum")
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.ops_token}")
+        response = self.client.post(
+            reverse("file_multi_view"),
+            {
+                "file_name": "roadmap",
+                "file_content": SimpleUploadedFile("roadmap.docx", self.content),
+            },
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.get_value("file_upload_bytes_count"), uploads + 1)
+        self.assertEqual(
+            self.get_value("file_upload_bytes_sum"), uploaded + len(self.content)
+        )
+        # 100 KB is over the 64 KiB bucket, within the 256 KiB one
+        self.assertEqual(
+            self.get_value("file_upload_bytes_bucket", le="65536"), small_uploads
+        )
+        self.assertEqual(
+            self.get_value("file_upload_bytes_bucket", le="262144"),
+            medium_uploads + 1,
+        )
+
+        file_id = response.data["id"]
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.clinet_token}")
+        response = self.client.post(
+            reverse("generate_download_links_view"),
+            {"file_ids": [file_id, 0]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.post(f"/api/genarate_link/{file_id}/")
+        self.assertEqual(
+            self.get_value("file_download_links_total", kind="file"), links + 2
+        )
+        self.assertEqual(
+            self.get_value("file_download_links_total", kind="bundle"), bundles + 1
+        )
+
+        download_url = response.data["download_link"].removeprefix(
+            settings.CLIENT_SIDE_URL
+        )
+        response = self.client.get(download_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # recorded once the body has been sent
+        self.assertEqual(self.get_value("file_download_seconds_count"), downloads)
+        b"".join(response.streaming_content)
+        self.assertEqual(self.get_value("file_download_seconds_count"), downloads + 1)
+        self.assertEqual(
+            self.get_value("file_download_bytes_sum"), downloaded + len(self.content)
+        )
+
+        response = self.client.get(download_url, HTTP_RANGE="bytes=0-99")
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        b"".join(response.streaming_content)
+        self.assertEqual(
+            self.get_value("file_download_bytes_sum"),
+            downloaded + len(self.content) + 100,
+        )
+
+    def test_exposition_format(self):
+        counter = metrics.Counter(
+            "test_exposition", 'Help with "quotes".', labelnames=["kind"]
+        )
+        histogram = metrics.Histogram(
+            "test_exposition_seconds", "Durations.", buckets=[0.5, 1]
+        )
+        self.addCleanup(metrics.REGISTRY.remove, counter)
+        self.addCleanup(metrics.REGISTRY.remove, histogram)
+        counter.inc(kind='a "b"\n')
+        counter.inc(2, kind="c")
+        histogram.observe(0.25)
+        histogram.observe(0.75)
+        histogram.observe(2)
+        with self.assertRaises(ValueError):
+            counter.inc(kind="c", other="d")
+
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], metrics.CONTENT_TYPE)
+        text = response.content.decode()
+        self.assertIn(
+            '# HELP test_exposition Help with "quotes".\n'
+            "# TYPE test_exposition counter\n"
+            'test_exposition_total{kind="a \\"b\\"\\n"} 1\n'
+            'test_exposition_total{kind="c"} 2\n',
+            text,
+        )
+        self.assertIn(
+            "# TYPE test_exposition_seconds histogram\n"
+            'test_exposition_seconds_bucket{le="0.5"} 1\n'
+            'test_exposition_seconds_bucket{le="1"} 2\n'
+            'test_exposition_seconds_bucket{le="+Inf"} 3\n'
+            "test_exposition_seconds_sum 3\n"
+            "test_exposition_seconds_count 3\n",
+            text,
+        )
+        self.assertIn("# TYPE file_upload_bytes histogram\n", text)
+
+    def test_metrics_token(self):
+        with self.settings(METRICS_TOKEN="scrape-token"):
+            response = self.client.get(reverse("metrics"))
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+            response = self.client.get(
+                reverse("metrics"), HTTP_AUTHORIZATION="Bearer scrape-token"
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        with self.settings(METRICS_TOKEN="", DEBUG=False, TESTING=False):
+            response = self.client.get(reverse("metrics"))
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_processes_are_added_up(self):
+        metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, metrics_dir)
+        counter = metrics.Counter("test_workers", "Per worker.", labelnames=["kind"])
+        self.addCleanup(metrics.REGISTRY.remove, counter)
+
+        with self.settings(METRICS_DIR=metrics_dir):
+            counter.inc(1, kind="file")
+            # a "gunicorn worker" writing its own file
+            worker = multiprocessing.get_context("fork").Process(
+                target=increment_in_other_process, args=(counter, 2)
+            )
+            worker.start()
+            worker.join()
+            self.assertEqual(worker.exitcode, 0)
+
+            self.assertEqual(len(os.listdir(metrics_dir)), 2)
+            self.assertEqual(
+                metrics.get_sample_value("test_workers_total", kind="file"), 3
+            )
+            # enough new samples to grow this process's file
+            for index in range(2000):
+                counter.inc(kind=f"kind-{index}")
+            self.assertEqual(
+                metrics.get_sample_value("test_workers_total", kind="kind-1999"), 1
+            )
+            self.assertEqual(
+                metrics.get_sample_value("test_workers_total", kind="file"), 3
+            )
+
+
+class TestCallOnClose(SimpleTestCase):
+    def test_streaming_responses_call_once_closed(self):
+        calls = []
+        document = BytesIO(b"document")
+        response = call_on_close(FileResponse(document), lambda: calls.append(1))
+        # still sent with wsgi.file_wrapper where the server has one
+        self.assertIs(response.file_to_stream, document)
+        self.assertEqual(b"".join(response), b"document")
+        self.assertEqual(calls, [])
+        response.close()
+        response.close()
+        self.assertEqual(calls, [1])
+
+        call_on_close(HttpResponse(b"sent"), lambda: calls.append(2))
+        self.assertEqual(calls, [1, 2])
+
+
+NO_THROTTLE_BUCKETS = dict.fromkeys(settings.THROTTLE_BUCKETS)
+
+
+@override_settings(
+    THROTTLE_ENABLED=True,
+    THROTTLE_BUCKETS=NO_THROTTLE_BUCKETS,
+    DOWNLOAD_MAX_STREAMS_USER=0,
+)
+class TestRateLimiting(FileTestSetUp):
+    def setUp(self):
+        super().setUp()
+        self.now = 1_000_000.0
+        clock_patcher = mock.patch.object(rate_limiter, "clock", lambda: self.now)
+        clock_patcher.start()
+        self.addCleanup(clock_patcher.stop)
+        rate_limiter.clear()
+        self.addCleanup(rate_limiter.clear)
+
+        self.content = os.urandom(1000)
+        self.file_obj = File.objects.create(
+            user=self.ops_user_obj,
+            file_name="report",
+            file_content=ContentFile(self.content, name="report.docx"),
+            file_identifier="report-identifier",
+        )
+        signed_identifier = URLSafeSerializer(settings.SECRET_KEY).dumps(
+            self.file_obj.file_identifier
+        )
+        self.url = reverse("download_file_view", args=[signed_identifier])
+        self.async_url = reverse("async_download_file_view", args=[signed_identifier])
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.clinet_token}")
+
+    def buckets(self, **buckets):
+        return self.settings(THROTTLE_BUCKETS={**NO_THROTTLE_BUCKETS, **buckets})
+
+    def assertThrottled(self, response, retry_after):
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response["Retry-After"], str(retry_after))
+
+    def download(self, url=None):
+        response = self.client.get(url or self.url)
+        if response.status_code == status.HTTP_200_OK:
+            self.assertEqual(b"".join(response.streaming_content), self.content)
+        return response
+
+    def test_token_bucket_refills_over_time(self):
+        limiter = RateLimiter(clock=lambda: self.now)
+        with self.buckets(link_requests_user=(2, 4)):
+            for _request in range(4):
+                self.assertEqual(limiter.take("link_requests_user", 1), 0)
+            self.assertEqual(limiter.take("link_requests_user", 1), 0.5)
+            # other users have their own bucket
+            self.assertEqual(limiter.take("link_requests_user", 2), 0)
+
+            self.now += 1
+            self.assertEqual(limiter.take("link_requests_user", 1), 0)
+            self.assertEqual(limiter.take("link_requests_user", 1), 0)
+            self.assertEqual(limiter.take("link_requests_user", 1), 0.5)
+            # never more than the bucket holds
+            self.now += 60
+            for _request in range(4):
+                self.assertEqual(limiter.take("link_requests_user", 1), 0)
+            self.assertEqual(limiter.take("link_requests_user", 1), 0.5)
+
+    def test_costs_over_the_bucket_size_are_taken_as_debt(self):
+        limiter = RateLimiter(clock=lambda: self.now)
+        with self.buckets(download_bytes_user=(100, 1000)):
+            self.assertEqual(limiter.take("download_bytes_user", 1, 5000), 0)
+            # 4000 bytes of debt plus 1000 to refill
+            self.assertEqual(limiter.take("download_bytes_user", 1, 5000), 50)
+            self.now += 50
+            self.assertEqual(limiter.take("download_bytes_user", 1, 5000), 0)
+
+    def test_global_refusal_gives_back_the_user_tokens(self):
+        limiter = RateLimiter(clock=lambda: self.now)
+        with self.buckets(
+            download_requests_user=(1, 2), download_requests_global=(1, 1)
+        ):
+            self.assertEqual(limiter.take_all(["download_requests"], 1), 0)
+            self.assertEqual(limiter.take_all(["download_requests"], 2), 1)
+            self.now += 1
+            # user 2 still has both tokens
+            self.assertEqual(limiter.take_all(["download_requests"], 2), 0)
+            self.now += 1
+            self.assertEqual(limiter.take_all(["download_requests"], 2), 0)
+
+    def test_download_requests_are_limited(self):
+        with self.buckets(download_requests_user=(0.5, 2)):
+            self.assertEqual(self.download().status_code, status.HTTP_200_OK)
+            self.assertEqual(self.download().status_code, status.HTTP_200_OK)
+            self.assertThrottled(self.download(), 2)
+
+            self.now += 2
+            self.assertEqual(self.download().status_code, status.HTTP_200_OK)
+            self.assertThrottled(self.download(), 2)
+
+    def test_download_bytes_are_limited(self):
+        with self.buckets(download_bytes_user=(100, 1500)):
+            self.assertEqual(self.download().status_code, status.HTTP_200_OK)
+            self.assertThrottled(self.download(), 5)
+            # a conditional request sends no body and costs nothing
+            etag = self.client.head(self.url)["ETag"]
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+            self.now += 5
+            self.assertEqual(self.download().status_code, status.HTTP_200_OK)
+
+    def test_concurrent_streams_are_limited(self):
+        with self.settings(DOWNLOAD_MAX_STREAMS_USER=2):
+            first = self.client.get(self.url)
+            second = self.client.get(self.url)
+            self.assertThrottled(self.client.get(self.url), 1)
+
+            # a slot is given back once a body has been sent
+            self.assertEqual(b"".join(first.streaming_content), self.content)
+            third = self.client.get(self.url)
+            self.assertEqual(third.status_code, status.HTTP_200_OK)
+            self.assertThrottled(self.client.get(self.url), 1)
+            second.close()
+            third.close()
+            self.assertEqual(self.download().status_code, status.HTTP_200_OK)
+
+    def test_bundles_are_charged_the_size_of_their_files(self):
+        response = self.client.post(
+            reverse("generate_download_links_view"),
+            {"file_ids": [self.file_obj.id]},
+            format="json",
+        )
+        bundle_link = response.data["bundle_link"]
+        with self.buckets(download_bytes_user=(100, 1000)):
+            response = self.client.get(bundle_link)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            b"".join(response.streaming_content)
+            self.assertThrottled(self.client.get(bundle_link), 10)
+
+    def test_link_requests_are_limited(self):
+        url = reverse("generate_download_links_view")
+        data = {"file_ids": [self.file_obj.id]}
+        with self.buckets(link_requests_global=(1, 1)):
+            response = self.client.post(url, data, format="json")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertThrottled(self.client.post(url, data, format="json"), 1)
+
+    async def test_async_download_is_limited(self):
+        headers = {"authorization": f"Bearer {self.clinet_token}"}
+        with self.buckets(download_requests_user=(1, 1)):
+            response = await self.async_client.get(self.async_url, headers=headers)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertThrottled(
+                await self.async_client.get(self.async_url, headers=headers), 1
+            )
+
+        self.now += 1
+        with self.buckets(download_bytes_user=(100, 100)):
+            response = await self.async_client.get(self.async_url, headers=headers)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            response = await self.async_client.get(self.async_url, headers=headers)
+            self.assertThrottled(response, 10)
+            self.assertEqual(json.loads(response.content)["detail"][:7], "Request")
+
+    def test_shared_cache_state(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        # two "nodes" sharing the default cache
+        limiters = [
+            RateLimiter(cache_alias="default", clock=lambda: self.now)
+            for _node in range(2)
+        ]
+        with self.buckets(download_requests_global=(1, 3)):
+            for limiter in [*limiters, limiters[0]]:
+                self.assertEqual(limiter.take_all(["download_requests"], 1), 0)
+            # the global bucket refills per 3 second window, this one ends
+            # in 2 seconds
+            self.assertEqual(limiters[1].take_all(["download_requests"], 2), 2)
+            self.assertEqual(limiters[0].states, {})
+
+        with self.settings(DOWNLOAD_MAX_STREAMS_USER=1):
+            self.assertTrue(limiters[0].acquire_stream(1))
+            self.assertFalse(limiters[1].acquire_stream(1))
+            limiters[1].release_stream(1)
+            self.assertTrue(limiters[0].acquire_stream(1))
+
+        with self.settings(THROTTLE_CACHE_ALIAS="default"):
+            with self.buckets(download_requests_user=(1, 1)):
+                self.assertEqual(self.download().status_code, status.HTTP_200_OK)
+                self.assertThrottled(self.download(), 1)
+            self.assertEqual(rate_limiter.states, {})
+
+    def test_shared_global_buckets_take_no_lock(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        limiter = RateLimiter(cache_alias="default", clock=lambda: self.now)
+        # a worker holds the locks of the buckets of user 1 (and of the
+        # global bucket, which is not used)
+        locks = [
+            "throttle:download_bytes_user:1:lock",
+            "throttle:streams:1:lock",
+            "throttle:download_bytes_global:global:lock",
+        ]
+        for lock_key in locks:
+            cache.set(lock_key, "other worker")
+
+        with self.buckets(download_bytes_global=(100, 1000)):
+            # a cost over the bucket size is carried to the next window
+            self.assertEqual(limiter.take("download_bytes_global", "global", 1500), 0)
+            self.assertEqual(limiter.take("download_bytes_global", "global", 1), 10)
+            self.now += 10
+            self.assertEqual(limiter.take("download_bytes_global", "global", 500), 0)
+            self.assertEqual(limiter.take("download_bytes_global", "global", 1), 10)
+
+        limiter.LOCK_TIMEOUT = 0.05
+        with self.buckets(download_bytes_user=(100, 1000)):
+            # let through (and logged) without touching the state, never
+            # takes the lock over
+            with self.assertLogs("file.throttling", "WARNING"):
+                self.assertEqual(limiter.take("download_bytes_user", 1, 10), 0)
+            self.assertIsNone(cache.get("throttle:download_bytes_user:1"))
+            self.assertEqual(limiter.take("download_bytes_user", 2, 10), 0)
+        with self.settings(DOWNLOAD_MAX_STREAMS_USER=1), self.assertLogs(
+            "file.throttling", "WARNING"
+        ):
+            self.assertIsNone(limiter.acquire_stream(1))
+            limiter.release_stream(1)
+        for lock_key in locks:
+            self.assertEqual(cache.get(lock_key), "other worker")
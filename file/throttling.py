@@ -0,0 +1,289 @@
+import logging
+import math
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.exceptions import Throttled
+from rest_framework.throttling import BaseThrottle
+
+from .responses import call_on_close
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_KEY = "global"
+
+
+class RateLimiter:
+    """
+    Token buckets and concurrent stream counts of the download and link
+    endpoints.
+
+    A bucket (see THROTTLE_BUCKETS) holds up to ``size`` tokens and refills
+    at ``rate`` tokens per second. Requests cost one token, downloads their
+    size in bytes. A download only needs the tokens a full bucket could
+    hold, the rest is taken as debt, so a large file is let through and the
+    next downloads wait until the debt is paid off.
+
+    State is kept in this process or, when ``cache_alias`` is set, in that
+    Django cache so all workers and nodes share it; updates of a key are
+    serialized with a short lock in the cache. When the lock cannot be had
+    within LOCK_TIMEOUT the update is skipped and logged and the request let
+    through: a busy cache must not refuse requests. The global buckets, which
+    every request updates, take no lock in the cache: they are counters
+    changed with atomic ``incr``/``decr``, see :meth:`take_shared_global`.
+    ``cache_alias`` defaults to THROTTLE_CACHE_ALIAS, read on every call.
+    """
+
+    LOCK_TIMEOUT = 1
+
+    def __init__(self, cache_alias=None, clock=None):
+        self._cache_alias = cache_alias
+        self.clock = clock or time.time
+        self.states = {}
+        self.lock = threading.Lock()
+
+    @property
+    def shared_cache(self):
+        cache_alias = self._cache_alias or settings.THROTTLE_CACHE_ALIAS
+        return caches[cache_alias] if cache_alias else None
+
+    def update(self, key, func, timeout):
+        """
+        Replace the state of ``key`` by ``func(state)[0]`` (state is None at
+        first) and return ``func(state)[1]``. Shared states expire after
+        ``timeout`` seconds without updates; when the lock of a shared state
+        cannot be taken, nothing is updated and None is returned.
+        """
+        shared_cache = self.shared_cache
+        if shared_cache is None:
+            with self.lock:
+                state, result = func(self.states.get(key))
+                self.states[key] = state
+                return result
+
+        key = f"throttle:{key}"
+        lock_key = f"{key}:lock"
+        lock_token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.LOCK_TIMEOUT
+        # a lock left by a killed worker expires after LOCK_TIMEOUT
+        while not shared_cache.add(lock_key, lock_token, timeout=self.LOCK_TIMEOUT):
+            if time.monotonic() > deadline:
+                logger.warning(
+                    "%s is locked for more than %ss, not updated",
+                    key,
+                    self.LOCK_TIMEOUT,
+                )
+                return None
+            time.sleep(0.001)
+        try:
+            state, result = func(shared_cache.get(key))
+            shared_cache.set(key, state, timeout=max(timeout, 1))
+            return result
+        finally:
+            # once expired, the lock may be another worker's
+            if shared_cache.get(lock_key) == lock_token:
+                shared_cache.delete(lock_key)
+
+    def get_window_key(self, bucket_name, window):
+        return f"throttle:{bucket_name}:{GLOBAL_KEY}:{window}"
+
+    def take_shared_global(self, bucket_name, cost, rate, size):
+        """
+        :meth:`take` from a global bucket kept in the shared cache, as a
+        fixed window: every ``size / rate`` seconds the bucket holds
+        ``size`` tokens again. Tokens are counted with atomic ``incr``, and
+        a cost over what is left of the window is carried to the next one.
+        """
+        shared_cache = self.shared_cache
+        window_seconds = size / rate
+        now = self.clock()
+        window = math.floor(now / window_seconds)
+        key = self.get_window_key(bucket_name, window)
+        timeout = math.ceil(2 * window_seconds) + 1
+
+        shared_cache.add(key, 0, timeout=timeout)
+        taken = shared_cache.incr(key, cost)
+        if taken - cost > size - min(cost, size):
+            shared_cache.decr(key, cost)
+            return (window + 1) * window_seconds - now
+        if taken > size:
+            next_key = self.get_window_key(bucket_name, window + 1)
+            shared_cache.add(next_key, 0, timeout=timeout)
+            shared_cache.incr(next_key, taken - size)
+        return 0
+
+    def take(self, bucket_name, key, cost=1):
+        """
+        Take ``cost`` tokens from the ``bucket_name`` bucket of ``key``.
+        Returns 0 if they were taken, else the seconds until they can be.
+        """
+        bucket = settings.THROTTLE_BUCKETS.get(bucket_name)
+        if not bucket:
+            return 0
+        rate, size = bucket
+        if key == GLOBAL_KEY and self.shared_cache is not None:
+            return self.take_shared_global(bucket_name, cost, rate, size)
+        now = self.clock()
+        needed = min(cost, size)
+
+        def take_tokens(state):
+            tokens, updated_at = state or (size, now)
+            tokens = min(size, tokens + (now - updated_at) * rate)
+            if tokens < needed:
+                return (tokens, now), (needed - tokens) / rate
+            return (tokens - cost, now), 0
+
+        # idle buckets are full again after (size + debt) / rate seconds
+        timeout = (size + max(cost - size, 0)) / rate
+        # a locked state lets the request through
+        return self.update(f"{bucket_name}:{key}", take_tokens, timeout) or 0
+
+    def give_back(self, bucket_name, key, cost=1):
+        """Return tokens taken by :meth:`take` for a request that was refused."""
+        bucket = settings.THROTTLE_BUCKETS.get(bucket_name)
+        if not bucket or not cost:
+            return
+        rate, size = bucket
+        if key == GLOBAL_KEY and self.shared_cache is not None:
+            window = math.floor(self.clock() / (size / rate))
+            try:
+                self.shared_cache.decr(self.get_window_key(bucket_name, window), cost)
+            except ValueError:
+                # the window is over
+                pass
+            return
+
+        def give_tokens(state):
+            if state is None:
+                return None, None
+            tokens, updated_at = state
+            return (min(size, tokens + cost), updated_at), None
+
+        self.update(f"{bucket_name}:{key}", give_tokens, size / rate)
+
+    def take_all(self, bucket_names, key, cost=1):
+        """
+        :meth:`take` from the per-user bucket ``<name>_user`` of ``key`` and
+        the ``<name>_global`` bucket of each name, all or nothing. Returns
+        the wait of the first bucket that refuses.
+        """
+        taken = []
+        for bucket_name in bucket_names:
+            for bucket_key, bucket in (
+                (key, f"{bucket_name}_user"),
+                (GLOBAL_KEY, f"{bucket_name}_global"),
+            ):
+                wait = self.take(bucket, bucket_key, cost)
+                if wait:
+                    for taken_bucket, taken_key in taken:
+                        self.give_back(taken_bucket, taken_key, cost)
+                    return wait
+                taken.append((bucket, bucket_key))
+        return 0
+
+    def acquire_stream(self, key):
+        """
+        Take one of the DOWNLOAD_MAX_STREAMS_USER slots of ``key``. Returns
+        whether one was taken, None when the download is let through without
+        a slot (no limit, or the state was locked).
+        """
+        max_streams = settings.DOWNLOAD_MAX_STREAMS_USER
+        if not max_streams:
+            return None
+
+        def acquire(count):
+            count = count or 0
+            if count >= max_streams:
+                return count, False
+            return count + 1, True
+
+        return self.update(
+            f"streams:{key}", acquire, settings.DOWNLOAD_STREAM_SLOT_TIMEOUT
+        )
+
+    def release_stream(self, key):
+        if not settings.DOWNLOAD_MAX_STREAMS_USER:
+            return
+        self.update(
+            f"streams:{key}",
+            lambda count: (max((count or 0) - 1, 0), None),
+            settings.DOWNLOAD_STREAM_SLOT_TIMEOUT,
+        )
+
+    def clear(self):
+        with self.lock:
+            self.states.clear()
+
+
+rate_limiter = RateLimiter()
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """One token per request from the ``<scope>_user`` and ``<scope>_global`` buckets."""
+
+    scope = None
+
+    def allow_request(self, request, view):
+        if not settings.THROTTLE_ENABLED:
+            return True
+        self.wait_seconds = rate_limiter.take_all(
+            [f"{self.scope}_requests"], request.user.id
+        )
+        return not self.wait_seconds
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class DownloadRequestThrottle(TokenBucketThrottle):
+    scope = "download"
+
+
+class LinkRequestThrottle(TokenBucketThrottle):
+    scope = "link"
+
+
+def get_download_cost(request, response, get_size):
+    # a proxy sends the whole file of an internal redirect; streamed bodies
+    # without a length (bundles) are charged the size of their files
+    if request.method == "HEAD":
+        return 0
+    if "X-Accel-Redirect" in response or "X-Sendfile" in response:
+        return get_size()
+    if response.has_header("Content-Length"):
+        return int(response["Content-Length"])
+    if not response.streaming:
+        return len(response.content)
+    return get_size()
+
+
+def limit_download(request, response, get_size):
+    """
+    Charge a download response to the download byte buckets of the user and
+    take one of their stream slots, given back when the response is closed.
+    ``get_size()`` is the size of the file(s), only called when the response
+    does not tell. Over a limit the response is closed and Throttled raised.
+    """
+    if not settings.THROTTLE_ENABLED:
+        return response
+
+    user_id = request.user.id
+    slot = rate_limiter.acquire_stream(user_id)
+    if slot is False:
+        wait = settings.DOWNLOAD_STREAM_RETRY_AFTER
+    else:
+        wait = rate_limiter.take_all(
+            ["download_bytes"], user_id, get_download_cost(request, response, get_size)
+        )
+        if wait and slot:
+            rate_limiter.release_stream(user_id)
+    if wait:
+        response.close()
+        raise Throttled(wait)
+
+    if not slot:
+        return response
+    return call_on_close(response, lambda: rate_limiter.release_stream(user_id))
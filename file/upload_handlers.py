@@ -0,0 +1,297 @@
+import hashlib
+import re
+import struct
+import zipfile
+import zlib
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile, StopUpload
+
+from standard.response import ErrorMessage, MessageCode
+
+ZIP_LOCAL_FILE_HEADER = struct.Struct("<4sHHHHHIIIHH")
+ZIP_LOCAL_FILE_SIGNATURE = b"PK\x03\x04"
+ZIP_DATA_DESCRIPTOR_FLAG = 0x08
+CONTENT_TYPES_PART = b"[Content_Types].xml"
+
+# content type of the main part of each allowed OOXML package
+OFFICE_MAIN_CONTENT_TYPES = {
+    b"application/vnd.openxmlformats-officedocument.presentationml.presentation.main+xml": "pptx",
+    b"application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml": "docx",
+    b"application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml": "xlsx",
+}
+CONTENT_TYPE_PATTERN = re.compile(rb'ContentType="([^"]+)"')
+
+
+class OfficeDocumentSniffer:
+    """
+    Incremental magic-byte check for OOXML (pptx, docx, xlsx) uploads.
+
+    Feed the first bytes of a file; ``result`` becomes the detected extension,
+    ``INVALID`` once the bytes can't be an allowed document, or ``ZIP`` when
+    the data is a zip archive but ``[Content_Types].xml`` is not within the
+    sniffed prefix (some writers put it last), in which case
+    :func:`detect_office_document_type` has to read the central directory.
+    """
+
+    UNDECIDED = None
+    INVALID = "invalid"
+    ZIP = "zip"
+
+    def __init__(self, limit=64 * 1024):
+        self.limit = limit
+        self.buffer = b""
+        self.result = self.UNDECIDED
+
+    def feed(self, data, complete=False):
+        if self.result is self.UNDECIDED:
+            self.buffer += data[: self.limit - len(self.buffer)]
+            complete = complete or len(self.buffer) >= self.limit
+            self.result = self.sniff(self.buffer, complete)
+            if self.result is not self.UNDECIDED:
+                self.buffer = b""
+        return self.result
+
+    def sniff(self, data, complete):
+        if data[:4] != ZIP_LOCAL_FILE_SIGNATURE[: len(data)]:
+            return self.INVALID
+
+        position = 0
+        while True:
+            header_end = position + ZIP_LOCAL_FILE_HEADER.size
+            if len(data) < header_end:
+                return self.ZIP if complete and position else self.pending(complete)
+
+            (
+                signature,
+                _version,
+                flags,
+                method,
+                _time,
+                _date,
+                _crc,
+                compressed_size,
+                _size,
+                name_length,
+                extra_length,
+            ) = ZIP_LOCAL_FILE_HEADER.unpack_from(data, position)
+            if signature != ZIP_LOCAL_FILE_SIGNATURE:
+                # not a zip at all, or the local headers ended (central directory)
+                return self.ZIP if position else self.INVALID
+
+            data_start = header_end + name_length + extra_length
+            if len(data) < data_start:
+                return self.pending(complete)
+
+            name = data[header_end : header_end + name_length]
+            sizes_known = not flags & ZIP_DATA_DESCRIPTOR_FLAG
+            if name == CONTENT_TYPES_PART:
+                part_end = data_start + compressed_size if sizes_known else None
+                return self.sniff_content_types(
+                    data[data_start:part_end],
+                    method,
+                    part_complete=sizes_known and len(data) >= part_end,
+                    complete=complete,
+                )
+
+            if not sizes_known:
+                # can't skip an entry of unknown length
+                return self.ZIP
+            position = data_start + compressed_size
+
+    def sniff_content_types(self, part, method, part_complete, complete):
+        if method == zipfile.ZIP_DEFLATED:
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            try:
+                xml = decompressor.decompress(part)
+            except zlib.error:
+                return self.INVALID
+            part_complete = part_complete or decompressor.eof
+        elif method == zipfile.ZIP_STORED:
+            xml = part
+        else:
+            return self.INVALID
+
+        for content_type in CONTENT_TYPE_PATTERN.findall(xml):
+            if content_type in OFFICE_MAIN_CONTENT_TYPES:
+                return OFFICE_MAIN_CONTENT_TYPES[content_type]
+
+        if part_complete:
+            return self.INVALID
+        return self.pending(complete)
+
+    def pending(self, complete):
+        return self.INVALID if complete else self.UNDECIDED
+
+
+def detect_office_document_type(file_obj):
+    """
+    Return "pptx", "docx" or "xlsx" for an allowed OOXML document, else None.
+
+    Only the first 64 KiB are read unless ``[Content_Types].xml`` is further
+    into the archive, then the zip central directory is used.
+    """
+    file_obj.seek(0)
+    sniffer = OfficeDocumentSniffer()
+    result = sniffer.feed(file_obj.read(sniffer.limit), complete=True)
+
+    if result == OfficeDocumentSniffer.ZIP:
+        file_obj.seek(0)
+        try:
+            with zipfile.ZipFile(file_obj) as archive:
+                result = sniffer.sniff_content_types(
+                    archive.read(CONTENT_TYPES_PART.decode()),
+                    zipfile.ZIP_STORED,
+                    part_complete=True,
+                    complete=True,
+                )
+        except (zipfile.BadZipFile, KeyError):
+            result = OfficeDocumentSniffer.INVALID
+
+    file_obj.seek(0)
+    if result == OfficeDocumentSniffer.INVALID:
+        return None
+    return result
+
+
+class OfficeDocumentUploadHandler(FileUploadHandler):
+    """
+    Checks uploaded files while the request body is still streaming in.
+
+    The upload is stopped (without reading the rest of the body) as soon as
+    the request is larger than ``FILE_UPLOAD_MAX_SIZE``, the filename has a
+    disallowed extension or the first bytes are not the OOXML package the
+    extension claims. The reason is left on ``request.upload_errors`` as
+    ``get_error_response`` keyword arguments. Files are passed through
+    untouched to the next handler.
+
+    The SHA-256 of each file is computed on the way through. Both it and the
+    detected type are left in ``request.upload_file_info`` (see
+    :func:`get_upload_file_info`); a detected type of
+    ``OfficeDocumentSniffer.ZIP`` means the view still has to call
+    :func:`detect_office_document_type` on the complete file.
+
+    With ``skip_invalid_files`` (bulk uploads) an invalid file is dropped
+    instead of the whole upload: the rest of its bytes are skipped and its
+    ``upload_file_info`` entry carries the ``error_code`` and ``errors``.
+    Only the request size (``FILE_BULK_UPLOAD_MAX_SIZE``) and the number of
+    files (``FILE_BULK_UPLOAD_MAX_FILES``) still stop the upload.
+    """
+
+    def __init__(self, request=None, skip_invalid_files=False):
+        super().__init__(request)
+        self.request.upload_errors = None
+        self.request.upload_file_info = {}
+        # not content_length: new_file() sets that to the file's length
+        self.request_content_length = None
+        self.skip_invalid_files = skip_invalid_files
+        self.file_count = 0
+
+    def handle_raw_input(
+        self, input_data, META, content_length, boundary, encoding=None
+    ):
+        self.request_content_length = content_length
+
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        super().new_file(field_name, file_name, *args, **kwargs)
+        self.received = 0
+        self.sniffer = OfficeDocumentSniffer()
+        self.sha256 = hashlib.sha256()
+        self.file_errors = None
+        self.file_count += 1
+
+        if self.skip_invalid_files:
+            max_request_size = settings.FILE_BULK_UPLOAD_MAX_SIZE
+            if self.file_count > settings.FILE_BULK_UPLOAD_MAX_FILES:
+                self.reject(
+                    MessageCode.TOO_MANY_FILES,
+                    {"file_content": ErrorMessage.TOO_MANY_FILES},
+                )
+        else:
+            max_request_size = settings.FILE_UPLOAD_MAX_SIZE
+        if (
+            self.request_content_length
+            and self.request_content_length > max_request_size
+        ):
+            self.reject(
+                MessageCode.FILE_TOO_LARGE, {"file_size": ErrorMessage.FILE_TOO_LARGE}
+            )
+
+        self.extension = file_name.split(".")[-1].lower()
+        if self.extension not in settings.ALLOWED_FILE_EXTENSIONS:
+            self.reject_file(
+                MessageCode.INVALID_FILE_TYPE,
+                {"file_type": ErrorMessage.INVALID_FILE_TYPE},
+            )
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.FILE_UPLOAD_MAX_SIZE:
+            self.reject_file(
+                MessageCode.FILE_TOO_LARGE, {"file_size": ErrorMessage.FILE_TOO_LARGE}
+            )
+        elif not self.file_errors:
+            self.check_type(self.sniffer.feed(raw_data))
+
+        if self.file_errors:
+            # skipped here rather than in new_file: the parser then closes
+            # this file in every handler, not the previous file
+            self.add_file_info(None, skipped=True)
+            raise SkipFile()
+
+        self.sha256.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        # small files can end before the sniffer has decided
+        result = self.sniffer.feed(b"", complete=True)
+        if not self.file_errors:
+            self.check_type(result)
+
+        self.add_file_info(result)
+        return None
+
+    def add_file_info(self, detected_type, skipped=False):
+        # in upload order; the entries of files that are not skipped are in
+        # the same order as request.FILES.getlist(field_name)
+        file_info = {
+            "file_name": self.file_name,
+            "detected_type": detected_type,
+            "sha256": self.sha256.hexdigest(),
+            "skipped": skipped,
+        }
+        if self.file_errors:
+            file_info.update(self.file_errors)
+        self.request.upload_file_info.setdefault(self.field_name, []).append(file_info)
+
+    def check_type(self, result):
+        if result in (OfficeDocumentSniffer.UNDECIDED, OfficeDocumentSniffer.ZIP):
+            return
+        if result != self.extension:
+            self.reject_file(
+                MessageCode.INVALID_FILE_TYPE,
+                {"file_type": ErrorMessage.INVALID_FILE_CONTENT},
+            )
+
+    def reject_file(self, error_code, errors):
+        if not self.skip_invalid_files:
+            self.reject(error_code, errors)
+        self.file_errors = {"error_code": error_code, "errors": errors}
+
+    def reject(self, error_code, errors):
+        self.request.upload_errors = {"error_code": error_code, "errors": errors}
+        # don't read (and discard) the rest of the body
+        raise StopUpload(connection_reset=True)
+
+
+def get_upload_file_info(request, field_name, index=0):
+    """
+    What OfficeDocumentUploadHandler found out about the index-th file of
+    field_name, or an empty dict (e.g. the body wasn't multipart). Skipped
+    files count too (see ``skip_invalid_files``).
+    """
+    file_info = getattr(request, "upload_file_info", None) or {}
+    try:
+        return file_info[field_name][index]
+    except (KeyError, IndexError):
+        return {}
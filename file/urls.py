@@ -1,7 +1,14 @@
 from django.urls import path
 
-from .views import (DownloadFileView, FileMultiView,
-                    GenerateDownloadFileLinkView)
+from .async_views import (AsyncDownloadFileView, AsyncFileExportView,
+                          AsyncFileListView)
+from .views import (DirectUploadFinalizeView, DirectUploadView,
+                    DownloadBundleView, DownloadFileView, FileBulkUploadView,
+                    FileExportView, FileMultiView, FilePreviewThumbnailView,
+                    FilePreviewView, FileSearchView,
+                    GenerateDownloadFileLinksView,
+                    GenerateDownloadFileLinkView, UploadSessionDetailView,
+                    UploadSessionFinalizeView, UploadSessionView)
 
 # DownloadFileView
 
@@ -13,6 +20,61 @@ urlpatterns = [
         FileMultiView.as_view(),
         name="file_multi_view",
     ),
+    path(
+        "file/bulk/",
+        FileBulkUploadView.as_view(),
+        name="file_bulk_upload_view",
+    ),
+    path(
+        "file/export/",
+        FileExportView.as_view(),
+        name="file_export_view",
+    ),
+    path(
+        "file/search/",
+        FileSearchView.as_view(),
+        name="file_search_view",
+    ),
+    path(
+        "file/<int:file_id>/preview/",
+        FilePreviewView.as_view(),
+        name="file_preview_view",
+    ),
+    path(
+        "file/<int:file_id>/preview/thumbnail/",
+        FilePreviewThumbnailView.as_view(),
+        name="file_preview_thumbnail_view",
+    ),
+    path(
+        "file/upload_session/",
+        UploadSessionView.as_view(),
+        name="upload_session_view",
+    ),
+    path(
+        "file/upload_session/<uuid:session_id>/",
+        UploadSessionDetailView.as_view(),
+        name="upload_session_detail_view",
+    ),
+    path(
+        "file/upload_session/<uuid:session_id>/finalize/",
+        UploadSessionFinalizeView.as_view(),
+        name="upload_session_finalize_view",
+    ),
+    path(
+        "file/direct_upload/",
+        DirectUploadView.as_view(),
+        name="direct_upload_view",
+    ),
+    path(
+        "file/direct_upload/finalize/",
+        DirectUploadFinalizeView.as_view(),
+        name="direct_upload_finalize_view",
+    ),
+    path(
+        "genarate_link/bulk/",
+        GenerateDownloadFileLinksView.as_view(),
+        name="generate_download_links_view",
+    ),
     path(
         "genarate_link/<file_id>/",
         GenerateDownloadFileLinkView.as_view(),
@@ -23,4 +85,25 @@ urlpatterns = [
         DownloadFileView.as_view(),
         name="download_file_view",
     ),
+    path(
+        "download_bundle/<signed_token>/",
+        DownloadBundleView.as_view(),
+        name="download_bundle_view",
+    ),
+    # ASGI versions of the listing, export and download endpoints
+    path(
+        "async/file/",
+        AsyncFileListView.as_view(),
+        name="async_file_list_view",
+    ),
+    path(
+        "async/file/export/",
+        AsyncFileExportView.as_view(),
+        name="async_file_export_view",
+    ),
+    path(
+        "async/download_file/<signed_identifier>/",
+        AsyncDownloadFileView.as_view(),
+        name="async_download_file_view",
+    ),
 ]
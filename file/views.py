@@ -1,34 +1,124 @@
+import mimetypes
+import os
+import time
 import uuid
 
 from django.conf import settings
-from django.db import IntegrityError
-from django.http import FileResponse
+from django.core.files import File as DjangoFile
+from django.db import IntegrityError, transaction
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 from django.utils.encoding import force_bytes
-from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+from django.utils.http import (content_disposition_header,
+                               urlsafe_base64_decode, urlsafe_base64_encode)
 from drf_yasg.utils import no_body, swagger_auto_schema
-from itsdangerous import URLSafeSerializer
+from itsdangerous import BadSignature, URLSafeSerializer, URLSafeTimedSerializer
 from rest_framework import serializers, status
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import \
+    JWTStatelessUserAuthentication
 from drf_yasg import openapi
 
-from account.models import UserDetails
+from account.permissions import IsClientUser, IsOpsUser
 from standard.response import ErrorMessage, MessageCode, get_error_response
 
-from .models import File
+from .list_cache import file_list_cache
+from .metrics import download_link_count, observe_download, upload_bytes
+from .models import File, FileBundle, FilePreview, UploadSession
+from .pagination import (FILE_LIST_ORDERINGS, FileCursorPagination,
+                         FileSearchPagination)
+from .responses import RangedFileResponseBuilder
+from .search import search_files
+from .services import (FileDownloadService, adopt_file_blob, create_blob_file,
+                       create_deduplicated_file, create_deduplicated_files,
+                       filter_files, get_file_bundle, get_sha256,
+                       is_date_range)
+from .streaming import FileBundleZipStream, FileListJSONStream
+from .throttling import (DownloadRequestThrottle, LinkRequestThrottle,
+                         limit_download)
+from .upload_handlers import (OfficeDocumentSniffer, OfficeDocumentUploadHandler,
+                              detect_office_document_type,
+                              get_upload_file_info)
 
 # Create your views here.
 
+# one signer for the process, building it costs more than signing with it
+download_link_signer = URLSafeSerializer(settings.SECRET_KEY)
+direct_upload_signer = URLSafeTimedSerializer(settings.SECRET_KEY, salt="direct-upload")
+bundle_link_signer = URLSafeSerializer(settings.SECRET_KEY, salt="download-bundle")
+
+
+def get_download_link(file_identifier):
+    signed_identifier = download_link_signer.dumps(file_identifier)
+    return f"{settings.CLIENT_SIDE_URL}/api/download_file/{signed_identifier}/"
+
+
+def get_bundle_link(file_identifiers):
+    signed_token = bundle_link_signer.dumps(get_file_bundle(file_identifiers).token)
+    return f"{settings.CLIENT_SIDE_URL}/api/download_bundle/{signed_token}/"
+
+
+def get_invalid_file_type_response(file_name, file_obj=None, detected_type=None):
+    # Check the file type (only allow pptx, docx, and xlsx)
+    file_extension = file_name.split(".")[-1].lower()
+    if file_extension not in settings.ALLOWED_FILE_EXTENSIONS:
+        return Response(
+            get_error_response(
+                error_code=MessageCode.INVALID_FILE_TYPE,
+                errors={"file_type": ErrorMessage.INVALID_FILE_TYPE},
+            ),
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    if file_obj is None:
+        return None
+
+    # don't trust the extension, check the content too
+    if detected_type in (OfficeDocumentSniffer.UNDECIDED, OfficeDocumentSniffer.ZIP):
+        detected_type = detect_office_document_type(file_obj)
+    if detected_type == file_extension:
+        return None
+
+    return Response(
+        get_error_response(
+            error_code=MessageCode.INVALID_FILE_TYPE,
+            errors={"file_type": ErrorMessage.INVALID_FILE_CONTENT},
+        ),
+        status=status.HTTP_400_BAD_REQUEST,
+    )
+
 
 # post a file and get all file
 class FileMultiView(APIView):
     permission_classes = [IsAuthenticated]
 
+    def get_permissions(self):
+        # anyone can list, only ops users can upload
+        if self.request.method == "POST":
+            return [IsAuthenticated(), IsOpsUser()]
+        return super().get_permissions()
+
+    def get_authenticators(self):
+        # listing is a hot read path: trust the token alone; uploads load
+        # the user, so a deactivated one is refused
+        if self.request.method in ("GET", "HEAD"):
+            return [JWTStatelessUserAuthentication()]
+        return super().get_authenticators()
+
     class FileModelSerializer(serializers.ModelSerializer):
         class Meta:
             model = File
-            fields = "__all__"
+            fields = [
+                "id",
+                "file_name",
+                "file_content",
+                "upload_timestamp",
+                "file_identifier",
+                "user",
+            ]
 
     class FilePostSerializer(serializers.ModelSerializer):
         class Meta:
@@ -40,74 +130,845 @@ class FileMultiView(APIView):
             "file_content": {"required": True},
         }
 
+    class QueryValidationSerializer(serializers.Serializer):
+        user = serializers.IntegerField(required=False, min_value=1)
+        uploaded_after = serializers.DateTimeField(required=False)
+        uploaded_before = serializers.DateTimeField(required=False)
+        name_prefix = serializers.CharField(
+            required=False, max_length=255, trim_whitespace=False
+        )
+        ordering = serializers.ChoiceField(
+            choices=list(FILE_LIST_ORDERINGS), default="-upload_timestamp"
+        )
+
     @swagger_auto_schema(
         request_body=no_body,
-        responses={200: FileModelSerializer},
+        query_serializer=QueryValidationSerializer,
+        manual_parameters=[
+            openapi.Parameter("cursor", openapi.IN_QUERY, type=openapi.TYPE_STRING),
+            openapi.Parameter(
+                "page_size", openapi.IN_QUERY, type=openapi.TYPE_INTEGER
+            ),
+        ],
+        responses={200: FileModelSerializer(many=True)},
     )
     def get(self, *args, **kwargs):
-        # Get all uploaded files
-        file_objs = File.objects.all().order_by("-id")
+        # Get uploaded files one page at a time (newest first by default)
+        query_serializer = self.QueryValidationSerializer(
+            data=self.request.query_params
+        )
+        if not query_serializer.is_valid():
+            return Response(
+                query_serializer.errors, status=status.HTTP_400_BAD_REQUEST
+            )
+        filters = dict(query_serializer.validated_data)
 
-        return Response(
-            self.FileModelSerializer(file_objs, many=True).data,
-            status=status.HTTP_200_OK,
+        # pages only change with the files generation, see FileListCache
+        generation = file_list_cache.get_generation()
+        not_modified_response = file_list_cache.get_not_modified_response(
+            self.request, generation
+        )
+        if not_modified_response is not None:
+            return not_modified_response
+
+        data = file_list_cache.get_page(
+            self.request,
+            generation,
+            lambda: self.get_page_data(self.request, filters, self),
+        )
+        return file_list_cache.add_etag(Response(data), generation)
+
+    @classmethod
+    def get_page_data(cls, request, filters, view):
+        paginator = FileCursorPagination(
+            filters.pop("ordering"), date_range=is_date_range(filters)
         )
+        file_objs = paginator.paginate_queryset(
+            filter_files(File.objects.all(), **filters), request, view=view
+        )
+        return paginator.get_paginated_response(
+            cls.FileModelSerializer(file_objs, many=True).data,
+        ).data
 
     @swagger_auto_schema(
         request_body=FilePostSerializer,
         responses={201: FileModelSerializer},
     )
     def post(self, *args, **kwargs):
+        # IsOpsUser has refused non ops users before the body is read;
+        # check type and size while the body streams in
+        self.request.upload_handlers.insert(
+            0, OfficeDocumentUploadHandler(self.request._request)
+        )
+
         serializer = self.FilePostSerializer(data=self.request.data)
+        upload_errors = getattr(self.request, "upload_errors", None)
+        if upload_errors:
+            return Response(
+                get_error_response(**upload_errors),
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        file_content = self.request.FILES.get("file_content")
+        file_info = get_upload_file_info(self.request, "file_content")
+
+        invalid_type_response = get_invalid_file_type_response(
+            file_content.name, file_content, file_info.get("detected_type")
+        )
+        if invalid_type_response is not None:
+            return invalid_type_response
+
+        try:
+            file_obj = create_deduplicated_file(
+                user_id=self.request.user.id,
+                file_name=serializer.validated_data.get("file_name"),
+                file_content=file_content,
+                sha256=file_info.get("sha256") or get_sha256(file_content),
+            )
+        except IntegrityError as e:
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        upload_bytes.observe(file_content.size)
+        return Response(
+            self.FileModelSerializer(file_obj).data,
+            status=status.HTTP_201_CREATED,
+        )
+
+
+class FileBulkUploadView(APIView):
+    permission_classes = [IsAuthenticated, IsOpsUser]
+    parser_classes = [MultiPartParser]
+
+    class RequestValidationSerializer(serializers.Serializer):
+        file_name = serializers.ListField(
+            child=serializers.CharField(max_length=255), required=False
+        )
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                "file_content",
+                openapi.IN_FORM,
+                type=openapi.TYPE_FILE,
+                required=True,
+                description="repeat for every file",
+            ),
+            openapi.Parameter(
+                "file_name",
+                openapi.IN_FORM,
+                type=openapi.TYPE_STRING,
+                description="one per file_content, in the same order; "
+                "defaults to the uploaded name without extension",
+            ),
+        ],
+        responses={
+            201: openapi.Response(
+                description="At least one file was created",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        "files": openapi.Schema(
+                            type=openapi.TYPE_OBJECT,
+                            additional_properties=openapi.Schema(
+                                type=openapi.TYPE_OBJECT
+                            ),
+                        ),
+                        "errors": openapi.Schema(
+                            type=openapi.TYPE_OBJECT,
+                            additional_properties=openapi.Schema(
+                                type=openapi.TYPE_OBJECT
+                            ),
+                        ),
+                        "message": openapi.Schema(type=openapi.TYPE_STRING),
+                    },
+                ),
+            )
+        },
+    )
+    def post(self, *args, **kwargs):
+        # check every file while the body streams in; an invalid file is
+        # skipped and reported, the others are still uploaded
+        self.request.upload_handlers.insert(
+            0,
+            OfficeDocumentUploadHandler(
+                self.request._request, skip_invalid_files=True
+            ),
+        )
+
+        serializer = self.RequestValidationSerializer(data=self.request.data)
+        upload_errors = getattr(self.request, "upload_errors", None)
+        if upload_errors:
+            return Response(
+                get_error_response(**upload_errors),
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-        # check if the user is ops user
-        user_details_obj = UserDetails.objects.get(user=self.request.user)
-        if not user_details_obj.is_ops_user:
+        file_infos = self.request.upload_file_info.get("file_content", [])
+        if not file_infos:
+            return Response(
+                {"file_content": ["This field is required."]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        file_names = serializer.validated_data.get("file_name")
+        if file_names is not None and len(file_names) != len(file_infos):
             return Response(
                 get_error_response(
-                    error_code=MessageCode.ACCESS_DENIED,
-                    errors={"operation_user": ErrorMessage.ACCESS_DENIED_UPLOAD},
+                    error_code=MessageCode.INVALID_DATA,
+                    errors={"file_name": ErrorMessage.FILE_NAME_COUNT},
                 ),
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        file_content = self.request.FILES.get("file_content")
+        # skipped files are not in request.FILES
+        uploaded_files = iter(self.request.FILES.getlist("file_content"))
+        uploads = {}
+        errors = {}
+        for index, file_info in enumerate(file_infos):
+            file_content = None if file_info["skipped"] else next(uploaded_files)
+            if "error_code" in file_info:
+                errors[index] = get_error_response(
+                    file_info["error_code"], file_info["errors"]
+                )
+                continue
+
+            invalid_type_response = get_invalid_file_type_response(
+                file_content.name, file_content, file_info["detected_type"]
+            )
+            if invalid_type_response is not None:
+                errors[index] = invalid_type_response.data
+                continue
+
+            if file_names is not None:
+                file_name = file_names[index]
+            else:
+                file_name = os.path.splitext(file_content.name)[0]
+            uploads[index] = (file_name, file_content, file_info["sha256"])
+
+        if not uploads:
+            return Response(
+                {"files": {}, "errors": errors, "message": "no file uploaded"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            file_objs = create_deduplicated_files(
+                self.request.user.id, list(uploads.values())
+            )
+        except IntegrityError as e:
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        files = {}
+        for index, file_obj in zip(uploads, file_objs):
+            upload_bytes.observe(uploads[index][1].size)
+            files[index] = FileMultiView.FileModelSerializer(file_obj).data
+
+        datas = {"files": files, "errors": errors, "message": "success"}
+        return Response(datas, status=status.HTTP_201_CREATED)
+
+
+class FileExportView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        request_body=no_body,
+        responses={200: FileMultiView.FileModelSerializer(many=True)},
+    )
+    def get(self, *args, **kwargs):
+        # Stream every uploaded file as one JSON array (same rows as
+        # FileMultiView.FileModelSerializer) without building model instances
+        file_stream = FileListJSONStream(
+            File.objects.order_by("-id"),
+            FileMultiView.FileModelSerializer,
+        )
+
+        return StreamingHttpResponse(file_stream, content_type="application/json")
+
+
+class FileSearchView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    class QueryValidationSerializer(serializers.Serializer):
+        q = serializers.CharField(required=True, max_length=255)
+
+    class SearchHitSerializer(FileMultiView.FileModelSerializer):
+        rank = serializers.FloatField(read_only=True)
+
+        class Meta(FileMultiView.FileModelSerializer.Meta):
+            fields = FileMultiView.FileModelSerializer.Meta.fields + ["rank"]
+
+    @swagger_auto_schema(
+        request_body=no_body,
+        query_serializer=QueryValidationSerializer,
+        manual_parameters=[
+            openapi.Parameter("page", openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+            openapi.Parameter(
+                "page_size", openapi.IN_QUERY, type=openapi.TYPE_INTEGER
+            ),
+        ],
+        responses={200: SearchHitSerializer(many=True)},
+    )
+    def get(self, *args, **kwargs):
+        # Files whose name or document text match q, best match first
+        query_serializer = self.QueryValidationSerializer(
+            data=self.request.query_params
+        )
+        if not query_serializer.is_valid():
+            return Response(
+                query_serializer.errors, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        paginator = FileSearchPagination()
+        search_documents = paginator.paginate_queryset(
+            search_files(query_serializer.validated_data["q"]),
+            self.request,
+            view=self,
+        )
+        file_objs = []
+        for search_document in search_documents:
+            search_document.file.rank = search_document.rank
+            file_objs.append(search_document.file)
+
+        return paginator.get_paginated_response(
+            self.SearchHitSerializer(file_objs, many=True).data,
+        )
+
+
+class FilePreviewView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    class FilePreviewSerializer(serializers.ModelSerializer):
+        thumbnail_link = serializers.SerializerMethodField()
+
+        class Meta:
+            model = FilePreview
+            fields = ["status", "text", "thumbnail_link", "generated_at"]
+
+        def get_thumbnail_link(self, preview_obj):
+            if not preview_obj.thumbnail:
+                return None
+            file_id = self.context["file_id"]
+            return f"{settings.CLIENT_SIDE_URL}/api/file/{file_id}/preview/thumbnail/"
+
+    @staticmethod
+    def get_preview(file_id):
+        """FilePreview of the file's content, None if it has none."""
+        sha256 = File.objects.values_list("content_sha256", flat=True).get(id=file_id)
+        return FilePreview.objects.filter(sha256=sha256).first() if sha256 else None
+
+    @staticmethod
+    def get_invalid_id_response():
+        return Response(
+            get_error_response(
+                error_code=MessageCode.INVALID_ID,
+                errors={"file_id": ErrorMessage.INVALID_ID},
+            ),
+            status=status.HTTP_400_BAD_REQUEST,
+        )
 
-        # Check the file type (only allow pptx, docx, and xlsx)
-        allowed_extensions = ["pptx", "docx", "xlsx"]
-        file_extension = file_content.name.split(".")[-1]
-        if file_extension.lower() not in allowed_extensions:
+    @swagger_auto_schema(request_body=no_body, responses={200: FilePreviewSerializer})
+    def get(self, *args, **kwargs):
+        try:
+            preview_obj = self.get_preview(kwargs["file_id"])
+        except File.DoesNotExist:
+            return self.get_invalid_id_response()
+
+        if preview_obj is None:
+            # uploaded before previews were generated
+            datas = {
+                "status": "unavailable",
+                "text": "",
+                "thumbnail_link": None,
+                "generated_at": None,
+            }
+            return Response(datas, status=status.HTTP_200_OK)
+        return Response(
+            self.FilePreviewSerializer(
+                preview_obj, context={"file_id": kwargs["file_id"]}
+            ).data,
+            status=status.HTTP_200_OK,
+        )
+
+
+class FilePreviewThumbnailView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(request_body=no_body, responses={200: "thumbnail image"})
+    def get(self, *args, **kwargs):
+        try:
+            preview_obj = FilePreviewView.get_preview(kwargs["file_id"])
+        except File.DoesNotExist:
+            return FilePreviewView.get_invalid_id_response()
+
+        if preview_obj is None or not preview_obj.thumbnail:
             return Response(
                 get_error_response(
-                    error_code=MessageCode.INVALID_FILE_TYPE,
-                    errors={"file_type": ErrorMessage.INVALID_FILE_TYPE},
+                    error_code=MessageCode.PREVIEW_NOT_READY,
+                    errors={"file_id": ErrorMessage.PREVIEW_NOT_READY},
+                ),
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # previews never change once generated, so they are cached by hash
+        thumbnail = preview_obj.thumbnail
+        builder = RangedFileResponseBuilder(
+            thumbnail,
+            etag=f'"{preview_obj.sha256}"',
+            last_modified=preview_obj.generated_at.timestamp(),
+            content_type=mimetypes.guess_type(thumbnail.name)[0],
+            disposition=content_disposition_header(
+                False, os.path.basename(thumbnail.name)
+            ),
+        )
+        response = builder.get_response(self.request, builder.get_full_response)
+        response["Cache-Control"] = "private, max-age=86400"
+        return response
+
+
+class ChunkedUploadFile(DjangoFile):
+    """
+    Assembled chunked upload. Exposing temporary_file_path() lets
+    FileSystemStorage move the file into place instead of copying it.
+    """
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+# create a resumable upload session
+class UploadSessionView(APIView):
+    permission_classes = [IsAuthenticated, IsOpsUser]
+
+    class UploadSessionSerializer(serializers.ModelSerializer):
+        offset = serializers.IntegerField(read_only=True)
+
+        class Meta:
+            model = UploadSession
+            fields = ["id", "file_name", "original_name", "total_size", "offset"]
+            read_only_fields = ["id"]
+
+    @swagger_auto_schema(
+        request_body=UploadSessionSerializer,
+        responses={201: UploadSessionSerializer},
+    )
+    def post(self, *args, **kwargs):
+        serializer = self.UploadSessionSerializer(data=self.request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        invalid_type_response = get_invalid_file_type_response(
+            serializer.validated_data["original_name"]
+        )
+        if invalid_type_response is not None:
+            return invalid_type_response
+
+        if serializer.validated_data["total_size"] > settings.FILE_UPLOAD_MAX_SIZE:
+            return Response(
+                get_error_response(
+                    error_code=MessageCode.FILE_TOO_LARGE,
+                    errors={"file_size": ErrorMessage.FILE_TOO_LARGE},
+                ),
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        session_obj = serializer.save(user_id=self.request.user.id)
+
+        os.makedirs(settings.CHUNKED_UPLOAD_DIR, exist_ok=True)
+        open(session_obj.temp_path, "wb").close()
+
+        return Response(
+            self.UploadSessionSerializer(session_obj).data,
+            status=status.HTTP_201_CREATED,
+        )
+
+
+# query the offset of a session and append chunks to it
+class UploadSessionDetailView(APIView):
+    permission_classes = [IsAuthenticated, IsOpsUser]
+    copy_buffer_size = 64 * 1024
+
+    class QueryValidationSerializer(serializers.Serializer):
+        offset = serializers.IntegerField(required=True, min_value=0)
+
+    def get_session(self, session_id):
+        try:
+            return UploadSession.objects.get(
+                id=session_id, user_id=self.request.user.id
+            )
+        except UploadSession.DoesNotExist:
+            return None
+
+    def get_invalid_session_response(self):
+        return Response(
+            get_error_response(
+                error_code=MessageCode.INVALID_ID,
+                errors={"session_id": ErrorMessage.INVALID_ID},
+            ),
+            status=status.HTTP_404_NOT_FOUND,
+        )
+
+    @swagger_auto_schema(
+        request_body=no_body,
+        responses={200: UploadSessionView.UploadSessionSerializer},
+    )
+    def get(self, *args, **kwargs):
+        session_obj = self.get_session(kwargs["session_id"])
+        if session_obj is None:
+            return self.get_invalid_session_response()
+
+        return Response(
+            UploadSessionView.UploadSessionSerializer(session_obj).data,
+            status=status.HTTP_200_OK,
+        )
+
+    @swagger_auto_schema(
+        request_body=no_body,
+        query_serializer=QueryValidationSerializer,
+        responses={200: UploadSessionView.UploadSessionSerializer},
+    )
+    def put(self, *args, **kwargs):
+        query_serializer = self.QueryValidationSerializer(
+            data=self.request.query_params
+        )
+        if not query_serializer.is_valid():
+            return Response(
+                query_serializer.errors, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        offset = query_serializer.validated_data["offset"]
+        # a chunked (or malformed) body cannot be checked against the sizes
+        try:
+            chunk_size = int(self.request.META["CONTENT_LENGTH"])
+        except (KeyError, ValueError):
+            chunk_size = -1
+        if chunk_size < 0:
+            return Response(
+                get_error_response(
+                    error_code=MessageCode.INVALID_DATA,
+                    errors={"chunk": ErrorMessage.CHUNK_LENGTH_REQUIRED},
+                ),
+                status=status.HTTP_411_LENGTH_REQUIRED,
+            )
+
+        if chunk_size > settings.CHUNKED_UPLOAD_MAX_CHUNK_SIZE:
+            return Response(
+                get_error_response(
+                    error_code=MessageCode.INVALID_DATA,
+                    errors={"chunk": ErrorMessage.CHUNK_TOO_LARGE},
+                ),
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
+
+        with transaction.atomic():
+            # row lock serialises concurrent PUTs for the same session
+            try:
+                session_obj = UploadSession.objects.select_for_update().get(
+                    id=kwargs["session_id"], user_id=self.request.user.id
+                )
+            except UploadSession.DoesNotExist:
+                return self.get_invalid_session_response()
+
+            if offset != session_obj.offset:
+                return Response(
+                    get_error_response(
+                        error_code=MessageCode.INVALID_OFFSET,
+                        errors={
+                            "offset": ErrorMessage.INVALID_OFFSET,
+                            "current_offset": session_obj.offset,
+                        },
+                    ),
+                    status=status.HTTP_409_CONFLICT,
+                )
+
+            if offset + chunk_size > session_obj.total_size:
+                return Response(
+                    get_error_response(
+                        error_code=MessageCode.INVALID_DATA,
+                        errors={"chunk": ErrorMessage.CHUNK_EXCEEDS_TOTAL_SIZE},
+                    ),
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+            # copy the body straight to disk, never holding the whole chunk
+            stream = self.request.stream
+            with open(session_obj.temp_path, "ab") as temp_file:
+                remaining = chunk_size
+                while remaining > 0 and stream is not None:
+                    data = stream.read(min(self.copy_buffer_size, remaining))
+                    if not data:
+                        break
+                    temp_file.write(data)
+                    remaining -= len(data)
+
+        return Response(
+            UploadSessionView.UploadSessionSerializer(session_obj).data,
+            status=status.HTTP_200_OK,
+        )
+
+
+# turn a completed session into a File
+class UploadSessionFinalizeView(APIView):
+    permission_classes = [IsAuthenticated, IsOpsUser]
+
+    @swagger_auto_schema(
+        request_body=no_body,
+        responses={201: FileMultiView.FileModelSerializer},
+    )
+    def post(self, *args, **kwargs):
+        try:
+            session_obj = UploadSession.objects.get(
+                id=kwargs["session_id"], user_id=self.request.user.id
+            )
+        except UploadSession.DoesNotExist:
+            return Response(
+                get_error_response(
+                    error_code=MessageCode.INVALID_ID,
+                    errors={"session_id": ErrorMessage.INVALID_ID},
+                ),
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        if session_obj.offset != session_obj.total_size:
+            return Response(
+                get_error_response(
+                    error_code=MessageCode.INCOMPLETE_UPLOAD,
+                    errors={
+                        "offset": ErrorMessage.INCOMPLETE_UPLOAD,
+                        "current_offset": session_obj.offset,
+                    },
                 ),
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
         try:
-            file_obj = File.objects.create(
-                user=self.request.user,
-                file_name=serializer.validated_data.get("file_name"),
-                file_content=file_content,
-                file_identifier=str(uuid.uuid4()),
+            with open(session_obj.temp_path, "rb") as temp_file:
+                invalid_type_response = get_invalid_file_type_response(
+                    session_obj.original_name, temp_file
+                )
+                if invalid_type_response is not None:
+                    return invalid_type_response
+
+                file_obj = create_deduplicated_file(
+                    user_id=self.request.user.id,
+                    file_name=session_obj.file_name,
+                    file_content=ChunkedUploadFile(
+                        temp_file, name=session_obj.original_name
+                    ),
+                    sha256=get_sha256(temp_file),
+                )
+        except IntegrityError as e:
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        if os.path.exists(session_obj.temp_path):
+            os.remove(session_obj.temp_path)
+        session_obj.delete()
+
+        return Response(
+            FileMultiView.FileModelSerializer(file_obj).data,
+            status=status.HTTP_201_CREATED,
+        )
+
+
+# ask for a presigned POST to upload straight to object storage
+class DirectUploadView(APIView):
+    permission_classes = [IsAuthenticated, IsOpsUser]
+
+    class DirectUploadSerializer(serializers.Serializer):
+        file_name = serializers.CharField(max_length=255)
+        original_name = serializers.CharField(max_length=255)
+        size = serializers.IntegerField(min_value=1)
+        sha256 = serializers.RegexField(r"^[0-9a-fA-F]{64}$")
+
+    @swagger_auto_schema(
+        request_body=DirectUploadSerializer,
+        responses={
+            201: openapi.Response(
+                description="Success",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        "url": openapi.Schema(type=openapi.TYPE_STRING),
+                        "fields": openapi.Schema(type=openapi.TYPE_OBJECT),
+                        "upload_token": openapi.Schema(type=openapi.TYPE_STRING),
+                        "expires_in": openapi.Schema(type=openapi.TYPE_INTEGER),
+                    },
+                ),
+            )
+        },
+    )
+    def post(self, *args, **kwargs):
+        serializer = self.DirectUploadSerializer(data=self.request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        storage = File._meta.get_field("file_content").storage
+        if not hasattr(storage, "get_presigned_post"):
+            return Response(
+                get_error_response(
+                    error_code=MessageCode.DIRECT_UPLOAD_UNAVAILABLE,
+                    errors={"storage": ErrorMessage.DIRECT_UPLOAD_UNAVAILABLE},
+                ),
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        original_name = serializer.validated_data["original_name"]
+        invalid_type_response = get_invalid_file_type_response(original_name)
+        if invalid_type_response is not None:
+            return invalid_type_response
+
+        size = serializer.validated_data["size"]
+        if size > settings.FILE_UPLOAD_MAX_SIZE:
+            return Response(
+                get_error_response(
+                    error_code=MessageCode.FILE_TOO_LARGE,
+                    errors={"file_size": ErrorMessage.FILE_TOO_LARGE},
+                ),
+                status=status.HTTP_400_BAD_REQUEST,
             )
+
+        extension = original_name.split(".")[-1].lower()
+        name = f"{settings.DIRECT_UPLOAD_PREFIX}{uuid.uuid4().hex}.{extension}"
+        sha256 = serializer.validated_data["sha256"].lower()
+        presigned_post = storage.get_presigned_post(
+            name,
+            content_type=mimetypes.guess_type(original_name)[0],
+            size=size,
+            sha256=sha256,
+            expire=settings.DIRECT_UPLOAD_EXPIRY,
+        )
+
+        # everything finalize needs, so no row is written until then
+        upload_token = direct_upload_signer.dumps(
+            {
+                "user_id": self.request.user.id,
+                "name": name,
+                "file_name": serializer.validated_data["file_name"],
+                "original_name": original_name,
+                "size": size,
+                "sha256": sha256,
+                "file_identifier": str(uuid.uuid4()),
+            }
+        )
+
+        datas = {
+            "url": presigned_post["url"],
+            "fields": presigned_post["fields"],
+            "upload_token": upload_token,
+            "expires_in": settings.DIRECT_UPLOAD_EXPIRY,
+        }
+        return Response(datas, status=status.HTTP_201_CREATED)
+
+
+# create the File for an object uploaded with a presigned POST
+class DirectUploadFinalizeView(APIView):
+    permission_classes = [IsAuthenticated, IsOpsUser]
+
+    class FinalizeSerializer(serializers.Serializer):
+        upload_token = serializers.CharField()
+
+    @swagger_auto_schema(
+        request_body=FinalizeSerializer,
+        responses={201: FileMultiView.FileModelSerializer},
+    )
+    def post(self, *args, **kwargs):
+        serializer = self.FinalizeSerializer(data=self.request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            upload = direct_upload_signer.loads(
+                serializer.validated_data["upload_token"],
+                max_age=settings.CHUNKED_UPLOAD_EXPIRY.total_seconds(),
+            )
+        except BadSignature:
+            upload = None
+        if upload is None or upload["user_id"] != self.request.user.id:
+            return Response(
+                get_error_response(
+                    error_code=MessageCode.INVALID_UPLOAD_TOKEN,
+                    errors={"upload_token": ErrorMessage.INVALID_UPLOAD_TOKEN},
+                ),
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        storage = File._meta.get_field("file_content").storage
+        name = upload["name"]
+        if not storage.exists(name):
+            return Response(
+                get_error_response(
+                    error_code=MessageCode.UPLOAD_NOT_FOUND,
+                    errors={"upload_token": ErrorMessage.UPLOAD_NOT_FOUND},
+                ),
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # S3 has checked the checksum on upload; only stores that don't
+        # keep checksums make us read the object back
+        sha256 = storage.get_sha256(name)
+        if sha256 is None:
+            with storage.open(name) as stored_file:
+                sha256 = get_sha256(stored_file)
+        if sha256 != upload["sha256"] or storage.size(name) != upload["size"]:
+            storage.delete(name)
+            return Response(
+                get_error_response(
+                    error_code=MessageCode.INVALID_FILE_TYPE,
+                    errors={"file_content": ErrorMessage.CHECKSUM_MISMATCH},
+                ),
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # reads the first 64 KiB (and the central directory if needed)
+        with storage.open(name) as stored_file:
+            invalid_type_response = get_invalid_file_type_response(
+                upload["original_name"], stored_file
+            )
+        if invalid_type_response is not None:
+            storage.delete(name)
+            return invalid_type_response
+
+        try:
+            with transaction.atomic():
+                blob = adopt_file_blob(name, sha256, upload["size"])
+                file_obj = create_blob_file(
+                    user_id=self.request.user.id,
+                    file_name=upload["file_name"],
+                    blob=blob,
+                    original_name=upload["original_name"],
+                    file_identifier=upload["file_identifier"],
+                )
         except IntegrityError as e:
+            # the token was finalized already
             return Response(
                 {"error": str(e)},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
         return Response(
-            self.FileModelSerializer(file_obj).data,
+            FileMultiView.FileModelSerializer(file_obj).data,
             status=status.HTTP_201_CREATED,
         )
 
 
 class GenerateDownloadFileLinkView(APIView):
+    authentication_classes = [JWTStatelessUserAuthentication]
     permission_classes = [IsAuthenticated]
+    throttle_classes = [LinkRequestThrottle]
 
     class KwargsValidationSerializer(serializers.Serializer):
         file_id = serializers.IntegerField(required=True)
@@ -152,50 +1013,158 @@ class GenerateDownloadFileLinkView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        # Create a URL-safe serializer with a secret key (keep this secret key secure)
-        serializer = URLSafeSerializer(settings.SECRET_KEY)
-        signed_identifier = serializer.dumps(file_obj.file_identifier)
-
-        domain_url = settings.CLIENT_SIDE_URL
-        download_link = f"{domain_url}/api/download_file/{signed_identifier}/"
+        download_link = get_download_link(file_obj.file_identifier)
+        download_link_count.inc(kind="file")
 
         datas = {"download_link": download_link, "message": "success"}
         return Response(datas, status=status.HTTP_200_OK)
 
 
-class DownloadFileView(APIView):
+class GenerateDownloadFileLinksView(APIView):
+    authentication_classes = [JWTStatelessUserAuthentication]
     permission_classes = [IsAuthenticated]
+    throttle_classes = [LinkRequestThrottle]
+
+    class RequestValidationSerializer(serializers.Serializer):
+        file_ids = serializers.ListField(
+            child=serializers.IntegerField(),
+            allow_empty=False,
+            max_length=settings.FILE_BULK_LINK_MAX_IDS,
+        )
+
+    @swagger_auto_schema(
+        request_body=RequestValidationSerializer,
+        responses={
+            200: openapi.Response(
+                description="Success",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        "download_links": openapi.Schema(
+                            type=openapi.TYPE_OBJECT,
+                            additional_properties=openapi.Schema(
+                                type=openapi.TYPE_STRING
+                            ),
+                        ),
+                        "errors": openapi.Schema(
+                            type=openapi.TYPE_OBJECT,
+                            additional_properties=openapi.Schema(
+                                type=openapi.TYPE_STRING
+                            ),
+                        ),
+                        "bundle_link": openapi.Schema(type=openapi.TYPE_STRING),
+                        "message": openapi.Schema(type=openapi.TYPE_STRING),
+                    },
+                ),
+            )
+        },
+    )
+    def post(self, *args, **kwargs):
+        serializer = self.RequestValidationSerializer(data=self.request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        # keep the request order, drop repeated ids
+        file_ids = list(dict.fromkeys(serializer.validated_data["file_ids"]))
+
+        file_identifiers = dict(
+            File.objects.filter(id__in=file_ids).values_list("id", "file_identifier")
+        )
+
+        download_links = {}
+        errors = {}
+        for file_id in file_ids:
+            if file_id in file_identifiers:
+                download_links[file_id] = get_download_link(file_identifiers[file_id])
+            else:
+                errors[file_id] = ErrorMessage.INVALID_ID
+        download_link_count.inc(len(download_links), kind="file")
+
+        # one ZIP download of every file found, in request order
+        bundle_link = None
+        if download_links and len(download_links) <= settings.FILE_BUNDLE_MAX_FILES:
+            bundle_link = get_bundle_link(
+                file_identifiers[file_id] for file_id in download_links
+            )
+            download_link_count.inc(kind="bundle")
+
+        datas = {
+            "download_links": download_links,
+            "errors": errors,
+            "bundle_link": bundle_link,
+            "message": "success",
+        }
+        return Response(datas, status=status.HTTP_200_OK)
+
+
+class DownloadFileView(APIView):
+    authentication_classes = [JWTStatelessUserAuthentication]
+    permission_classes = [IsAuthenticated, IsClientUser]
+    throttle_classes = [DownloadRequestThrottle]
 
     class KwargsValidationSerializer(serializers.Serializer):
         signed_identifier = serializers.CharField(required=True)
 
     def get(self, *args, **kwargs):
+        started = time.monotonic()
         kwargs_serializer = self.KwargsValidationSerializer(data=kwargs)
         if not kwargs_serializer.is_valid():
             return Response(
                 kwargs_serializer.errors, status=status.HTTP_400_BAD_REQUEST
             )
 
-        # check if the user is client user
-        user_details_obj = UserDetails.objects.get(user=self.request.user)
+        signed_identifier = kwargs_serializer.validated_data.get("signed_identifier")
+
+        file_identifier = download_link_signer.loads(signed_identifier)
 
-        if user_details_obj.is_ops_user:
+        try:
+            file_obj = File.objects.get(file_identifier=file_identifier)
+        except File.DoesNotExist:
             return Response(
                 get_error_response(
-                    error_code=MessageCode.ACCESS_DENIED,
-                    errors={"operation_user": ErrorMessage.ACCESS_DENIED_DOWNLOAD},
+                    error_code=MessageCode.INVALID_ID,
+                    errors={"file_id": ErrorMessage.INVALID_ID},
                 ),
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        signed_identifier = kwargs_serializer.validated_data.get("signed_identifier")
+        response = FileDownloadService(file_obj).get_response(self.request)
+        response = limit_download(
+            self.request, response, lambda: file_obj.file_content.size
+        )
+        return observe_download(response, started)
 
-        serializer = URLSafeSerializer(settings.SECRET_KEY)
-        file_identifier = serializer.loads(signed_identifier)
 
+class DownloadBundleView(APIView):
+    authentication_classes = [JWTStatelessUserAuthentication]
+    permission_classes = [IsAuthenticated, IsClientUser]
+    throttle_classes = [DownloadRequestThrottle]
+
+    @swagger_auto_schema(request_body=no_body, responses={200: "ZIP archive"})
+    def get(self, *args, **kwargs):
         try:
-            file_obj = File.objects.get(file_identifier=file_identifier)
-        except File.DoesNotExist:
+            token = bundle_link_signer.loads(kwargs["signed_token"])
+        except BadSignature:
+            file_identifiers = []
+        else:
+            file_identifiers = (
+                FileBundle.objects.filter(
+                    token=token,
+                    created_at__gte=timezone.now() - settings.FILE_BUNDLE_EXPIRY,
+                )
+                .values_list("file_identifiers", flat=True)
+                .first()
+            ) or []
+
+        file_objs = File.objects.filter(
+            file_identifier__in=file_identifiers
+        ).select_related("blob")
+        file_objs_by_identifier = {
+            file_obj.file_identifier: file_obj for file_obj in file_objs
+        }
+        if not file_identifiers or len(file_objs_by_identifier) != len(
+            set(file_identifiers)
+        ):
             return Response(
                 get_error_response(
                     error_code=MessageCode.INVALID_ID,
@@ -204,6 +1173,19 @@ class DownloadFileView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        file_path = file_obj.file_content.path
-
-        return FileResponse(open(file_path, "rb"))
+        bundle_stream = FileBundleZipStream(
+            file_objs_by_identifier[file_identifier]
+            for file_identifier in dict.fromkeys(file_identifiers)
+        )
+        response = StreamingHttpResponse(bundle_stream, content_type="application/zip")
+        response["Content-Disposition"] = content_disposition_header(
+            True, settings.FILE_BUNDLE_NAME
+        )
+        return limit_download(
+            self.request,
+            response,
+            lambda: sum(
+                file_obj.blob.size if file_obj.blob else file_obj.file_content.size
+                for file_obj in file_objs_by_identifier.values()
+            ),
+        )
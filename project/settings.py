@@ -15,6 +15,7 @@ from datetime import timedelta
 from dotenv import load_dotenv
 import os
 import sys
+import tempfile
 
 
 load_dotenv()
@@ -54,12 +55,19 @@ INSTALLED_APPS = [
 ]
 
 REST_FRAMEWORK = {
+    # loads the User on every request: deactivated or deleted users are
+    # refused at once. The file list, link and download views authenticate
+    # statelessly instead (JWTStatelessUserAuthentication, no query; use
+    # request.user.id for FKs), so there a token keeps working until its
+    # ACCESS_TOKEN_LIFETIME runs out.
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     )
 }
 
 MIDDLEWARE = [
+    # first, so it times every other middleware too
+    'standard.middleware.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -111,10 +119,11 @@ DATABASES = {
     }
 }
 
-#using sql_lite for test database
-if (
-    "test" in sys.argv or "test_coverage" in sys.argv
-):  # Covers regular testing and django-coverage
+# Covers regular testing and django-coverage
+TESTING = "test" in sys.argv or "test_coverage" in sys.argv
+
+#using sql_lite for test database, and for local benchmarks with DB_ENGINE=sqlite
+if TESTING or os.getenv("DB_ENGINE") == "sqlite":
     DATABASES = {
         "default": {
             "ENGINE": "django.db.backends.sqlite3",
@@ -199,4 +208,195 @@ EMAIL_USE_TLS = os.getenv("EMAIL_USE_TLS", "TRUE") == "TRUE"
 CLIENT_SIDE_URL = "http://127.0.0.1:8000"
 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')  # Specify the absolute path to your media directory
\ No newline at end of file
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')  # Specify the absolute path to your media directory
+
+# Where uploaded documents are stored: "local" (MEDIA_ROOT) or "s3" (any
+# S3-compatible object store). Every FileField goes through default_storage.
+FILE_STORAGE_BACKEND = os.getenv("FILE_STORAGE_BACKEND", "local")
+STORAGES = {
+    "default": {
+        "BACKEND": {
+            "local": "file.storage.TimedFileSystemStorage",
+            "s3": "file.storage.S3Storage",
+        }[FILE_STORAGE_BACKEND],
+    },
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+}
+AWS_STORAGE_BUCKET_NAME = os.getenv("AWS_STORAGE_BUCKET_NAME")
+AWS_LOCATION = os.getenv("AWS_LOCATION", "")
+AWS_S3_ENDPOINT_URL = os.getenv("AWS_S3_ENDPOINT_URL")  # e.g. a MinIO server
+AWS_S3_REGION_NAME = os.getenv("AWS_S3_REGION_NAME")
+AWS_S3_MAX_POOL_CONNECTIONS = int(os.getenv("AWS_S3_MAX_POOL_CONNECTIONS", 50))
+AWS_QUERYSTRING_EXPIRE = int(os.getenv("AWS_QUERYSTRING_EXPIRE", 3600))
+
+# File listing (cursor pagination)
+FILE_LIST_PAGE_SIZE = int(os.getenv("FILE_LIST_PAGE_SIZE", 50))
+FILE_LIST_MAX_PAGE_SIZE = int(os.getenv("FILE_LIST_MAX_PAGE_SIZE", 500))
+# Listing pages are cached for FILE_LIST_CACHE_TIMEOUT seconds in the
+# FILE_LIST_CACHE_ALIAS cache, under a generation bumped whenever a File is
+# saved or deleted (also sent as the ETag). Every worker must read the same
+# generation: use a cache shared by all of them, unset turns caching off.
+FILE_LIST_CACHE_ALIAS = os.getenv("FILE_LIST_CACHE_ALIAS") or None
+FILE_LIST_CACHE_TIMEOUT = int(os.getenv("FILE_LIST_CACHE_TIMEOUT", 300))
+
+# Uploads
+ALLOWED_FILE_EXTENSIONS = ["pptx", "docx", "xlsx"]
+FILE_UPLOAD_MAX_SIZE = int(os.getenv("FILE_UPLOAD_MAX_SIZE", 250 * 1024 * 1024))
+# Bulk uploads: most files and bytes per request, each file is still limited
+# to FILE_UPLOAD_MAX_SIZE (Django refuses more than DATA_UPLOAD_MAX_NUMBER_FILES)
+FILE_BULK_UPLOAD_MAX_FILES = int(os.getenv("FILE_BULK_UPLOAD_MAX_FILES", 50))
+FILE_BULK_UPLOAD_MAX_SIZE = int(
+    os.getenv("FILE_BULK_UPLOAD_MAX_SIZE", 1024 * 1024 * 1024)
+)
+
+# Resumable chunked uploads (kept outside MEDIA_ROOT, which is publicly served)
+CHUNKED_UPLOAD_DIR = os.getenv(
+    "CHUNKED_UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "ez_task_uploads")
+)
+CHUNKED_UPLOAD_MAX_CHUNK_SIZE = int(
+    os.getenv("CHUNKED_UPLOAD_MAX_CHUNK_SIZE", 16 * 1024 * 1024)
+)
+CHUNKED_UPLOAD_EXPIRY = timedelta(hours=int(os.getenv("CHUNKED_UPLOAD_EXPIRY_HOURS", 24)))
+
+# Downloads: "django" streams the file from the worker, "x-accel-redirect"
+# hands it to nginx (location FILE_DOWNLOAD_ACCEL_PREFIX { internal; alias
+# MEDIA_ROOT/; }) and "x-sendfile" to Apache mod_xsendfile / lighttpd.
+FILE_DOWNLOAD_MODE = os.getenv("FILE_DOWNLOAD_MODE", "django")
+FILE_DOWNLOAD_ACCEL_PREFIX = os.getenv("FILE_DOWNLOAD_ACCEL_PREFIX", "/protected/")
+
+# Most file ids accepted by one bulk download-link request
+FILE_BULK_LINK_MAX_IDS = int(os.getenv("FILE_BULK_LINK_MAX_IDS", 1000))
+
+# Rate limits of the download and download-link endpoints (file.throttling),
+# answered with 429 and Retry-After. Every bucket is (tokens per second,
+# most tokens), or None for no limit: a request takes one token, a download
+# its size in bytes. Buckets are per user (_user) or shared by everyone
+# (_global). A user streams at most DOWNLOAD_MAX_STREAMS_USER downloads at a
+# time (0: no limit); a slot left by a killed worker is freed after
+# DOWNLOAD_STREAM_SLOT_TIMEOUT seconds. State is per process unless
+# THROTTLE_CACHE_ALIAS names a cache shared by every worker and node; the
+# shared _global buckets then hold "most tokens" per window of
+# most / (tokens per second) seconds.
+THROTTLE_ENABLED = os.getenv("THROTTLE_ENABLED", "FALSE" if TESTING else "TRUE") == "TRUE"
+THROTTLE_CACHE_ALIAS = os.getenv("THROTTLE_CACHE_ALIAS") or None
+THROTTLE_BUCKETS = {
+    "download_requests_user": (2, 20),
+    "download_requests_global": (200, 1000),
+    "download_bytes_user": (10 * 1024 * 1024, 100 * 1024 * 1024),
+    "download_bytes_global": (200 * 1024 * 1024, 1024 * 1024 * 1024),
+    "link_requests_user": (5, 50),
+    "link_requests_global": (500, 2000),
+}
+DOWNLOAD_MAX_STREAMS_USER = int(os.getenv("DOWNLOAD_MAX_STREAMS_USER", 4))
+DOWNLOAD_STREAM_SLOT_TIMEOUT = int(os.getenv("DOWNLOAD_STREAM_SLOT_TIMEOUT", 3600))
+DOWNLOAD_STREAM_RETRY_AFTER = 1
+
+# Bulk user provisioning (`manage.py provision_users`, POST
+# /api/auth/users/bulk/ for staff): passwords are hashed in
+# USER_PROVISIONING_WORKERS processes, users inserted
+# USER_PROVISIONING_BATCH_SIZE at a time. The API takes at most
+# USER_PROVISIONING_MAX_ROWS users per request.
+USER_PROVISIONING_WORKERS = int(
+    os.getenv("USER_PROVISIONING_WORKERS", os.cpu_count() or 1)
+)
+USER_PROVISIONING_BATCH_SIZE = int(os.getenv("USER_PROVISIONING_BATCH_SIZE", 500))
+USER_PROVISIONING_MAX_ROWS = int(os.getenv("USER_PROVISIONING_MAX_ROWS", 10000))
+
+# Email outbox (drained by `manage.py send_outbox_emails`)
+EMAIL_OUTBOX_BATCH_SIZE = int(os.getenv("EMAIL_OUTBOX_BATCH_SIZE", 100))
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv("EMAIL_OUTBOX_MAX_ATTEMPTS", 5))
+EMAIL_OUTBOX_RETRY_DELAY = timedelta(
+    seconds=int(os.getenv("EMAIL_OUTBOX_RETRY_DELAY_SECONDS", 30))
+)
+# a worker has this long to send the batch it claimed before other workers
+# may pick the mails up again
+EMAIL_OUTBOX_LEASE = timedelta(
+    seconds=int(os.getenv("EMAIL_OUTBOX_LEASE_SECONDS", 600))
+)
+
+# Presigned URL reuse: at most this many URLs are kept per process, and a
+# URL is only handed out while it has PRESIGNED_URL_CACHE_MIN_REMAINING
+# seconds of validity left. Set the alias to share URLs across workers.
+PRESIGNED_URL_CACHE_SIZE = int(os.getenv("PRESIGNED_URL_CACHE_SIZE", 10000))
+PRESIGNED_URL_CACHE_MIN_REMAINING = int(
+    os.getenv("PRESIGNED_URL_CACHE_MIN_REMAINING", 900)
+)
+PRESIGNED_URL_CACHE_ALIAS = os.getenv("PRESIGNED_URL_CACHE_ALIAS") or None
+
+# Direct-to-storage uploads: the presigned POST is valid for this many
+# seconds, and the upload has to be finalized within CHUNKED_UPLOAD_EXPIRY.
+# Objects under DIRECT_UPLOAD_PREFIX that were never finalized should be
+# removed by a bucket lifecycle rule.
+DIRECT_UPLOAD_EXPIRY = int(os.getenv("DIRECT_UPLOAD_EXPIRY", 3600))
+DIRECT_UPLOAD_PREFIX = "direct_uploads/"
+
+# ZIP bundle downloads (see GenerateDownloadFileLinksView's bundle_link):
+# requests for more files than FILE_BUNDLE_MAX_FILES get no bundle link.
+# Links expire after FILE_BUNDLE_EXPIRY; `manage.py clear_file_bundles`
+# deletes the expired bundles.
+FILE_BUNDLE_NAME = "documents.zip"
+FILE_BUNDLE_MAX_FILES = int(os.getenv("FILE_BUNDLE_MAX_FILES", 100))
+FILE_BUNDLE_EXPIRY = timedelta(hours=int(os.getenv("FILE_BUNDLE_EXPIRY_HOURS", 24)))
+
+# Document previews (generated by `manage.py generate_file_previews`): every
+# job gets FILE_PREVIEW_TIMEOUT seconds in one of FILE_PREVIEW_WORKERS
+# processes. Set FILE_PREVIEW_SOFFICE to a LibreOffice binary to render
+# documents that carry no embedded thumbnail.
+FILE_PREVIEW_WORKERS = int(os.getenv("FILE_PREVIEW_WORKERS", 2))
+FILE_PREVIEW_BATCH_SIZE = int(os.getenv("FILE_PREVIEW_BATCH_SIZE", 10))
+FILE_PREVIEW_TIMEOUT = int(os.getenv("FILE_PREVIEW_TIMEOUT", 60))
+FILE_PREVIEW_MAX_ATTEMPTS = int(os.getenv("FILE_PREVIEW_MAX_ATTEMPTS", 3))
+FILE_PREVIEW_RETRY_DELAY = timedelta(
+    seconds=int(os.getenv("FILE_PREVIEW_RETRY_DELAY_SECONDS", 60))
+)
+FILE_PREVIEW_TEXT_LENGTH = int(os.getenv("FILE_PREVIEW_TEXT_LENGTH", 500))
+FILE_PREVIEW_MAX_PART_SIZE = int(
+    os.getenv("FILE_PREVIEW_MAX_PART_SIZE", 64 * 1024 * 1024)
+)
+FILE_PREVIEW_SOFFICE = os.getenv("FILE_PREVIEW_SOFFICE", "")
+
+# Full-text search: at most this many characters of a document are indexed,
+# extracted by the preview job of the upload (file names are indexed at
+# once). `manage.py reindex_files` rebuilds the index in
+# FILE_SEARCH_REINDEX_WORKERS processes.
+FILE_SEARCH_MAX_TEXT_LENGTH = int(os.getenv("FILE_SEARCH_MAX_TEXT_LENGTH", 200000))
+FILE_SEARCH_REINDEX_WORKERS = int(os.getenv("FILE_SEARCH_REINDEX_WORKERS", 4))
+FILE_SEARCH_REINDEX_BATCH_SIZE = int(os.getenv("FILE_SEARCH_REINDEX_BATCH_SIZE", 200))
+
+# Request timings (standard.middleware.RequestTimingMiddleware): time spent
+# in queries, rendering and storage calls goes to a Server-Timing header and
+# a log line per request, a warning when the request runs more than
+# PERFORMANCE_QUERY_BUDGET queries or takes more than
+# PERFORMANCE_LATENCY_BUDGET_MS (0 turns a budget off). Benchmarks
+# (`manage.py benchmark_api`) read the query count from an X-DB-Queries
+# header, sent with QUERY_COUNT_HEADER.
+SERVER_TIMING_HEADER = os.getenv("SERVER_TIMING_HEADER", "TRUE") == "TRUE"
+QUERY_COUNT_HEADER = os.getenv("QUERY_COUNT_HEADER", "FALSE") == "TRUE"
+PERFORMANCE_QUERY_BUDGET = int(os.getenv("PERFORMANCE_QUERY_BUDGET", 20))
+PERFORMANCE_LATENCY_BUDGET_MS = int(os.getenv("PERFORMANCE_LATENCY_BUDGET_MS", 1000))
+
+# Prometheus metrics at /metrics (standard.metrics). Under gunicorn set
+# METRICS_DIR to a directory shared by the workers and emptied on deploy:
+# every worker writes its values to a file there and a scrape adds them up.
+# Scrapes need "Authorization: Bearer <METRICS_TOKEN>"; without a token the
+# endpoint is refused (403) unless DEBUG or TESTING.
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        # one line per request; quiet while testing
+        "standard.middleware": {
+            "handlers": ["console"],
+            "level": "ERROR" if TESTING else os.getenv("REQUEST_LOG_LEVEL", "INFO"),
+            "propagate": False,
+        },
+    },
+}
@@ -22,6 +22,8 @@ from rest_framework.permissions import AllowAny
 from django.conf import settings
 from django.conf.urls.static import static
 
+from standard.views import metrics_view
+
 
 schema_view = swagger_get_schema_view(
     openapi.Info(
@@ -37,6 +39,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path("api/", include("account.urls")),
     path("api/", include("file.urls")),
+    path("metrics", metrics_view, name="metrics"),
 
     path(
         "swagger/",
@@ -0,0 +1,299 @@
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+
+# In-process metrics registry, exposed in the Prometheus text format by
+# standard.views.metrics_view.
+#
+# With METRICS_DIR set, every process (gunicorn worker, outbox worker...)
+# keeps its values in its own memory-mapped file in that directory and a
+# scrape adds up the files of all processes, so one scrape of any worker
+# reports the whole deployment. Clear the directory when the deployment
+# starts; files of stopped workers are kept so counters never go down.
+# Without METRICS_DIR values stay in the process (e.g. runserver).
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# every Metric, in definition order
+REGISTRY = []
+
+# header: bytes used (entries start after 8 bytes)
+HEADER = struct.Struct("i4x")
+KEY_LENGTH = struct.Struct("i")
+VALUE = struct.Struct("d")
+INITIAL_FILE_SIZE = 64 * 1024
+
+
+def get_entry_size(encoded_key):
+    # length, key padded so the value is 8-byte aligned, value
+    padding = -(KEY_LENGTH.size + len(encoded_key)) % 8
+    return KEY_LENGTH.size + len(encoded_key) + padding + VALUE.size
+
+
+def iter_entries(data, used):
+    """(key, value, value offset) of a values file's bytes."""
+    offset = HEADER.size
+    while offset < used:
+        (length,) = KEY_LENGTH.unpack_from(data, offset)
+        encoded_key = bytes(
+            data[offset + KEY_LENGTH.size : offset + KEY_LENGTH.size + length]
+        )
+        value_offset = offset + get_entry_size(encoded_key) - VALUE.size
+        (value,) = VALUE.unpack_from(data, value_offset)
+        yield encoded_key.decode(), value, value_offset
+        offset = value_offset + VALUE.size
+
+
+class LocalValues:
+    """Values of this process only."""
+
+    def __init__(self):
+        self.values = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def add(self, key, amount):
+        with self.lock:
+            self.values[key] += amount
+
+    def collect(self):
+        with self.lock:
+            return dict(self.values)
+
+
+class FileValues:
+    """
+    Values of this process in a memory-mapped file, readable by every
+    process. Only this process writes it; an entry is complete before the
+    header counts it, so readers never see half an entry.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.file = open(os.path.join(directory, f"metrics_{os.getpid()}.db"), "a+b")
+        if os.fstat(self.file.fileno()).st_size == 0:
+            self.file.truncate(INITIAL_FILE_SIZE)
+        self.map_file()
+
+        # a new process with the pid of a stopped one continues its values
+        (self.used,) = HEADER.unpack_from(self.map, 0)
+        self.used = self.used or HEADER.size
+        self.offsets = {
+            key: offset for key, _value, offset in iter_entries(self.map, self.used)
+        }
+
+    def map_file(self):
+        self.capacity = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), self.capacity)
+
+    def add(self, key, amount):
+        with self.lock:
+            offset = self.offsets.get(key)
+            if offset is None:
+                offset = self.insert(key)
+            (value,) = VALUE.unpack_from(self.map, offset)
+            VALUE.pack_into(self.map, offset, value + amount)
+
+    def insert(self, key):
+        encoded_key = key.encode()
+        size = get_entry_size(encoded_key)
+        if self.used + size > self.capacity:
+            new_capacity = self.capacity
+            while self.used + size > new_capacity:
+                new_capacity *= 2
+            self.map.close()
+            self.file.truncate(new_capacity)
+            self.map_file()
+
+        KEY_LENGTH.pack_into(self.map, self.used, len(encoded_key))
+        self.map[
+            self.used + KEY_LENGTH.size : self.used + KEY_LENGTH.size + len(encoded_key)
+        ] = encoded_key
+        offset = self.used + size - VALUE.size
+        VALUE.pack_into(self.map, offset, 0.0)
+        self.used += size
+        HEADER.pack_into(self.map, 0, self.used)
+        self.offsets[key] = offset
+        return offset
+
+    def collect(self):
+        """Values of every process writing to the directory, added up."""
+        values = defaultdict(float)
+        for file_name in os.listdir(self.directory):
+            if not file_name.endswith(".db"):
+                continue
+            try:
+                with open(os.path.join(self.directory, file_name), "rb") as values_file:
+                    data = values_file.read()
+            except FileNotFoundError:
+                continue
+            if len(data) < HEADER.size:
+                continue
+            (used,) = HEADER.unpack_from(data, 0)
+            for key, value, _offset in iter_entries(data, min(used, len(data))):
+                values[key] += value
+        return dict(values)
+
+
+_values_stores = {}
+_values_stores_lock = threading.Lock()
+
+
+def get_values_store():
+    # one store per process: a forked worker opens its own file
+    store_key = (settings.METRICS_DIR, os.getpid())
+    store = _values_stores.get(store_key)
+    if store is None:
+        with _values_stores_lock:
+            store = _values_stores.get(store_key)
+            if store is None:
+                if settings.METRICS_DIR:
+                    store = FileValues(settings.METRICS_DIR)
+                else:
+                    store = LocalValues()
+                _values_stores[store_key] = store
+    return store
+
+
+def get_sample_key(sample_name, labels):
+    return json.dumps([sample_name, labels], sort_keys=True)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY.append(self)
+
+    def check_labels(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}"
+            )
+        return {name: str(value) for name, value in labels.items()}
+
+    def get_samples(self, values):
+        """(sample name, labels, value) of this metric in collected ``values``."""
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError("counters can only go up")
+        labels = self.check_labels(labels)
+        get_values_store().add(get_sample_key(f"{self.name}_total", labels), amount)
+
+    def get_samples(self, values):
+        samples = []
+        for key, value in values.items():
+            sample_name, labels = json.loads(key)
+            if sample_name == f"{self.name}_total":
+                samples.append((sample_name, labels, value))
+        return sorted(samples, key=lambda sample: sorted(sample[1].items()))
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = sorted(buckets)
+
+    def observe(self, value, **labels):
+        labels = self.check_labels(labels)
+        store = get_values_store()
+        index = bisect_left(self.buckets, value)
+        bound = self.buckets[index] if index < len(self.buckets) else math.inf
+        # one count per bucket here, made cumulative when collected
+        store.add(
+            get_sample_key(
+                f"{self.name}_bucket", {**labels, "le": format_value(bound)}
+            ),
+            1,
+        )
+        store.add(get_sample_key(f"{self.name}_sum", labels), value)
+        store.add(get_sample_key(f"{self.name}_count", labels), 1)
+
+    def get_samples(self, values):
+        bucket_counts = defaultdict(dict)
+        totals = defaultdict(dict)
+        for key, value in values.items():
+            sample_name, labels = json.loads(key)
+            if sample_name == f"{self.name}_bucket":
+                bound = labels.pop("le")
+                bucket_counts[json.dumps(labels, sort_keys=True)][bound] = value
+            elif sample_name in (f"{self.name}_sum", f"{self.name}_count"):
+                totals[json.dumps(labels, sort_keys=True)][sample_name] = value
+
+        samples = []
+        for labels_key in sorted(totals):
+            labels = json.loads(labels_key)
+            cumulative = 0.0
+            for bound in [*self.buckets, math.inf]:
+                cumulative += bucket_counts[labels_key].get(format_value(bound), 0.0)
+                samples.append(
+                    (
+                        f"{self.name}_bucket",
+                        {**labels, "le": format_value(bound)},
+                        cumulative,
+                    )
+                )
+            for sample_name in (f"{self.name}_sum", f"{self.name}_count"):
+                samples.append(
+                    (sample_name, labels, totals[labels_key].get(sample_name, 0.0))
+                )
+        return samples
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def escape_label_value(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def get_sample_value(sample_name, **labels):
+    """Current value of one sample (0 if never recorded), e.g. for tests."""
+    values = get_values_store().collect()
+    for metric in REGISTRY:
+        for name, sample_labels, value in metric.get_samples(values):
+            if name == sample_name and sample_labels == labels:
+                return value
+    return 0.0
+
+
+def generate_latest():
+    """Every registered metric in the Prometheus text exposition format."""
+    values = get_values_store().collect()
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for sample_name, labels, value in metric.get_samples(values):
+            label_text = ",".join(
+                f'{name}="{escape_label_value(label_value)}"'
+                for name, label_value in labels.items()
+            )
+            if label_text:
+                sample_name = f"{sample_name}{{{label_text}}}"
+            lines.append(f"{sample_name} {format_value(value)}")
+    return "\n".join(lines) + "\n"
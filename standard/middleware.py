@@ -0,0 +1,113 @@
+import json
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from .timing import collect_request_timings, install_query_timer, timed
+
+logger = logging.getLogger(__name__)
+
+
+class RequestTimingMiddleware:
+    """
+    Times the database queries, response rendering ("serialize") and storage
+    calls of every request, and the request as a whole ("total").
+
+    The timings go to a Server-Timing header (SERVER_TIMING_HEADER) and to
+    one JSON log line per request. The line is a warning when the request
+    ran more than PERFORMANCE_QUERY_BUDGET queries or took more than
+    PERFORMANCE_LATENCY_BUDGET_MS. With QUERY_COUNT_HEADER the query count
+    is also sent as X-DB-Queries (see `manage.py benchmark_api`).
+
+    Only what happens before the response is returned is measured: the body
+    of a streamed response (downloads, exports) is sent afterwards.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+        # this thread's open connections, and every one opened from now on
+        for connection in connections.all(initialized_only=True):
+            install_query_timer(connection)
+        connection_created.connect(install_query_timer)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        started = time.perf_counter()
+        with collect_request_timings() as timings:
+            response = self.get_response(request)
+        return self.add_timings(request, response, timings, started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with collect_request_timings() as timings:
+            response = await self.get_response(request)
+        return self.add_timings(request, response, timings, started)
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered right after this, render them here to
+        # time it (a rendered response is not rendered again)
+        with timed("serialize"):
+            return response.render()
+
+    def add_timings(self, request, response, timings, started):
+        total_ms = (time.perf_counter() - started) * 1000
+        queries = timings.counts["db"]
+
+        if settings.SERVER_TIMING_HEADER:
+            response["Server-Timing"] = ", ".join(
+                [
+                    f'db;dur={timings.get_milliseconds("db"):.1f};'
+                    f'desc="{queries} queries"',
+                    f'serialize;dur={timings.get_milliseconds("serialize"):.1f}',
+                    f'storage;dur={timings.get_milliseconds("storage"):.1f};'
+                    f'desc="{timings.counts["storage"]} calls"',
+                    f"total;dur={total_ms:.1f}",
+                ]
+            )
+        if settings.QUERY_COUNT_HEADER:
+            response["X-DB-Queries"] = str(queries)
+
+        over_budget = []
+        if settings.PERFORMANCE_QUERY_BUDGET and (
+            queries > settings.PERFORMANCE_QUERY_BUDGET
+        ):
+            over_budget.append("queries")
+        if settings.PERFORMANCE_LATENCY_BUDGET_MS and (
+            total_ms > settings.PERFORMANCE_LATENCY_BUDGET_MS
+        ):
+            over_budget.append("latency")
+
+        level = logging.WARNING if over_budget else logging.INFO
+        if logger.isEnabledFor(level):
+            resolver_match = request.resolver_match
+            logger.log(
+                level,
+                json.dumps(
+                    {
+                        "method": request.method,
+                        # the route, not the path: paths carry signed links
+                        "route": resolver_match.route if resolver_match else None,
+                        "status": response.status_code,
+                        "streaming": response.streaming,
+                        "total_ms": round(total_ms, 1),
+                        "db_ms": round(timings.get_milliseconds("db"), 1),
+                        "db_queries": queries,
+                        "serialize_ms": round(timings.get_milliseconds("serialize"), 1),
+                        "storage_ms": round(timings.get_milliseconds("storage"), 1),
+                        "storage_calls": timings.counts["storage"],
+                        "over_budget": over_budget,
+                    }
+                ),
+            )
+        return response
@@ -7,6 +7,14 @@ class MessageCode:
     INVALID_FILE_TYPE ="INVALID_FILE_TYPE "
     ACCESS_DENIED = "ACCESS_DENIED "
     INVALID_ID = "INVALID_ID"
+    INVALID_OFFSET = "INVALID_OFFSET"
+    INCOMPLETE_UPLOAD = "INCOMPLETE_UPLOAD"
+    FILE_TOO_LARGE = "FILE_TOO_LARGE"
+    DIRECT_UPLOAD_UNAVAILABLE = "DIRECT_UPLOAD_UNAVAILABLE"
+    INVALID_UPLOAD_TOKEN = "INVALID_UPLOAD_TOKEN"
+    UPLOAD_NOT_FOUND = "UPLOAD_NOT_FOUND"
+    PREVIEW_NOT_READY = "PREVIEW_NOT_READY"
+    TOO_MANY_FILES = "TOO_MANY_FILES"
 
 
 class ErrorMessage:
@@ -17,6 +25,23 @@ class ErrorMessage:
     INVALID_FILE_TYPE  = "Invalid file type. Only pptx, docx, and xlsx files are allowed."
     ACCESS_DENIED_UPLOAD = "Access denied. Only Ops Users are allowed to upload files."
     ACCESS_DENIED_DOWNLOAD = "Access denied. Only Client Users are allowed to Download files."
+    INVALID_FILE_CONTENT = "File content does not match its pptx, docx or xlsx extension."
+    FILE_TOO_LARGE = "File is larger than the allowed upload size."
+    INVALID_OFFSET = "Chunk offset does not match the uploaded size."
+    CHUNK_TOO_LARGE = "Chunk is larger than the allowed chunk size."
+    CHUNK_EXCEEDS_TOTAL_SIZE = "Chunk goes past the declared file size."
+    CHUNK_LENGTH_REQUIRED = "Send the chunk with a Content-Length header."
+    INCOMPLETE_UPLOAD = "Upload is not complete yet."
+    DIRECT_UPLOAD_UNAVAILABLE = "Direct uploads need an object storage backend."
+    INVALID_UPLOAD_TOKEN = "Upload token is invalid or has expired."
+    UPLOAD_NOT_FOUND = "Uploaded file was not found in storage."
+    CHECKSUM_MISMATCH = "Uploaded file does not match the declared size and SHA-256."
+    PREVIEW_NOT_READY = "Preview of this file is not available yet."
+    TOO_MANY_FILES = "Too many files in one upload."
+    INVALID_USER_FILE_TYPE = "Invalid file type. Only csv and jsonl files are allowed."
+    INVALID_USER_ROW = "Expected a JSON object of a user."
+    TOO_MANY_USERS = "Too many users in one request, use `manage.py provision_users`."
+    FILE_NAME_COUNT = "Send one file_name per file_content, or none."
 
 
 def get_error_response(error_code: str, errors: dict):
@@ -0,0 +1,68 @@
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Time spent per activity ("db", "storage", "serialize") while handling the
+# current request, reported by standard.middleware.RequestTimingMiddleware.
+# A context variable, not a thread local: sync_to_async and
+# asyncio.to_thread copy the context, so work an async view hands to a
+# thread is added to its request.
+_request_timings = ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.durations = defaultdict(float)
+        self.counts = defaultdict(int)
+        # a request's threads may record at the same time
+        self.lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.durations[name] += seconds
+            self.counts[name] += 1
+
+    def get_milliseconds(self, name):
+        return self.durations[name] * 1000
+
+
+@contextmanager
+def collect_request_timings():
+    """Collect the timings of the block (the request) into a RequestTimings."""
+    timings = RequestTimings()
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+@contextmanager
+def timed(name):
+    """Add the time the block takes to ``name`` of the current request."""
+    timings = _request_timings.get()
+    if timings is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - started)
+
+
+def time_query(execute, sql, params, many, context):
+    with timed("db"):
+        return execute(sql, params, many, context)
+
+
+def install_query_timer(connection, **kwargs):
+    """
+    Time every query of ``connection`` (also a ``connection_created``
+    receiver, so the connections of sync_to_async threads are covered).
+    """
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
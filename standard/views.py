@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+
+from .metrics import CONTENT_TYPE, generate_latest
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint, behind METRICS_TOKEN. Without a token it
+    is only served under DEBUG or in tests.
+    """
+    if not settings.METRICS_TOKEN:
+        if not (settings.DEBUG or settings.TESTING):
+            return HttpResponse(status=403)
+    elif not constant_time_compare(
+        request.headers.get("Authorization", ""), f"Bearer {settings.METRICS_TOKEN}"
+    ):
+        return HttpResponse(status=401)
+
+    return HttpResponse(generate_latest(), content_type=CONTENT_TYPE)